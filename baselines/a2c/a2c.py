@@ -30,7 +30,7 @@ class Model(object):
     """
     def __init__(self, policy, env, nsteps,
             ent_coef=0.01, vf_coef=0.5, max_grad_norm=0.5, lr=7e-4,
-            alpha=0.99, epsilon=1e-5, total_timesteps=int(80e6), lrschedule='linear'):
+            alpha=0.99, epsilon=1e-5, total_timesteps=int(80e6), lrschedule='linear', pipelined=False):
 
         sess = tf_util.get_session()
         nenvs = env.num_envs
@@ -38,8 +38,8 @@ class Model(object):
 
 
         with tf.variable_scope('a2c_model', reuse=tf.AUTO_REUSE):
-            # step_model is used for sampling
-            step_model = policy(nenvs, 1, sess)
+            # step_model is used for sampling (one half of the envs at a time when pipelined)
+            step_model = policy(nenvs // 2 if pipelined else nenvs, 1, sess)
 
             # train_model is used to train our network
             train_model = policy(nbatch, nsteps, sess)
@@ -130,6 +130,7 @@ def learn(
     gamma=0.99,
     log_interval=100,
     load_path=None,
+    pipelined=False,
     **network_kwargs):
 
     '''
@@ -174,6 +175,9 @@ def learn(
 
     log_interval:       int, specifies how frequently the logs are printed out (default: 100)
 
+    pipelined:          bool, split the envs in two halves and compute the actions of one half while the other half is simulated.
+                        Needs an even number of envs and an env with step_async(actions, env_ids) and poll(), such as SubprocVecEnv or ShmemVecEnv (default: False)
+
     **network_kwargs:   keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                         For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
 
@@ -189,12 +193,13 @@ def learn(
 
     # Instantiate the model object (that creates step_model and train_model)
     model = Model(policy=policy, env=env, nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
-        max_grad_norm=max_grad_norm, lr=lr, alpha=alpha, epsilon=epsilon, total_timesteps=total_timesteps, lrschedule=lrschedule)
+        max_grad_norm=max_grad_norm, lr=lr, alpha=alpha, epsilon=epsilon, total_timesteps=total_timesteps, lrschedule=lrschedule,
+        pipelined=pipelined)
     if load_path is not None:
         model.load(load_path)
 
     # Instantiate the runner object
-    runner = Runner(env, model, nsteps=nsteps, gamma=gamma)
+    runner = Runner(env, model, nsteps=nsteps, gamma=gamma, pipelined=pipelined)
 
     # Calculate the batch_size
     nbatch = nenvs*nsteps
@@ -204,9 +209,11 @@ def learn(
 
     for update in range(1, total_timesteps//nbatch+1):
         # Get mini batch of experiences
-        obs, states, rewards, masks, actions, values = runner.run()
+        with logger.timer('rollout'):
+            obs, states, rewards, masks, actions, values = runner.run()
 
-        policy_loss, value_loss, policy_entropy = model.train(obs, states, rewards, masks, actions, values)
+        with logger.timer('train'):
+            policy_loss, value_loss, policy_entropy = model.train(obs, states, rewards, masks, actions, values)
         nseconds = time.time()-tstart
 
         # Calculate the fps (frame per second)
@@ -221,6 +228,7 @@ def learn(
             logger.record_tabular("policy_entropy", float(policy_entropy))
             logger.record_tabular("value_loss", float(value_loss))
             logger.record_tabular("explained_variance", float(ev))
-            logger.dump_tabular()
+            with logger.timer('logging'):
+                logger.dump_tabular()
     return model
 
@@ -1,6 +1,7 @@
 import numpy as np
 from baselines.a2c.utils import discount_with_dones
 from baselines.common.runners import AbstractEnvRunner
+from baselines import logger
 
 class Runner(AbstractEnvRunner):
     """
@@ -12,20 +13,23 @@ class Runner(AbstractEnvRunner):
     run():
     - Make a mini batch of experiences
     """
-    def __init__(self, env, model, nsteps=5, gamma=0.99):
-        super().__init__(env=env, model=model, nsteps=nsteps)
+    def __init__(self, env, model, nsteps=5, gamma=0.99, pipelined=False):
+        super().__init__(env=env, model=model, nsteps=nsteps, pipelined=pipelined)
         self.gamma = gamma
         self.batch_action_shape = [x if x is not None else -1 for x in model.train_model.action.shape.as_list()]
         self.ob_dtype = model.train_model.X.dtype.as_numpy_dtype
 
     def run(self):
+        if self.pipelined:
+            return self.run_pipelined()
         # We initialize the lists that will contain the mb of experiences
         mb_obs, mb_rewards, mb_actions, mb_values, mb_dones = [],[],[],[],[]
         mb_states = self.states
         for n in range(self.nsteps):
             # Given observations, take action and value (V(s))
             # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
-            actions, values, states, _ = self.model.step(self.obs, S=self.states, M=self.dones)
+            with logger.timer('inference'):
+                actions, values, states, _ = self.model.step(self.obs, S=self.states, M=self.dones)
 
             # Append the experiences
             mb_obs.append(np.copy(self.obs))
@@ -34,13 +38,57 @@ class Runner(AbstractEnvRunner):
             mb_dones.append(self.dones)
 
             # Take actions in env and look the results
-            obs, rewards, dones, _ = self.env.step(actions)
+            with logger.timer('env_step'):
+                obs, rewards, dones, _ = self.env.step(actions)
             self.states = states
             self.dones = dones
             self.obs = obs
             mb_rewards.append(rewards)
         mb_dones.append(self.dones)
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_states)
 
+    def run_pipelined(self):
+        """
+        Like run(), but the envs are split in two halves that are stepped in turn: while one
+        half simulates (env.step_async(actions, env_ids)), the policy computes the actions of
+        the other one, so inference and simulation overlap.
+        """
+        nenv, nsteps = self.nenv, self.nsteps
+        mb_obs = np.zeros((nsteps,) + self.obs.shape, dtype=self.ob_dtype)
+        mb_rewards, mb_values = np.zeros((nsteps, nenv), dtype=np.float32), np.zeros((nsteps, nenv), dtype=np.float32)
+        mb_actions = None
+        mb_dones = np.zeros((nsteps + 1, nenv), dtype=np.bool)
+        mb_states = self.pipelined_states()
+        self.dones = np.array(self.dones, dtype=np.bool)
+
+        def act(g, env_ids, t):
+            nonlocal mb_actions
+            actions, values, self.group_states[g], _ = self.model.step(
+                self.obs[env_ids], S=self.group_states[g], M=self.dones[env_ids])
+            if mb_actions is None:
+                mb_actions = np.zeros((nsteps, nenv) + actions.shape[1:], dtype=actions.dtype)
+            mb_obs[t, env_ids] = self.obs[env_ids]
+            mb_actions[t, env_ids] = actions
+            mb_values[t, env_ids] = values
+            mb_dones[t, env_ids] = self.dones[env_ids]
+            return actions
+
+        def observe(env_ids, t, obs, rewards, dones, infos):
+            mb_rewards[t, env_ids] = rewards
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+
+        self.step_groups(self.groups, act, observe)
+        mb_dones[nsteps] = self.dones
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_states)
+
+    def _last_values(self):
+        if not self.pipelined:
+            return self.model.value(self.obs, S=self.states, M=self.dones)
+        return np.concatenate([self.model.value(self.obs[env_ids], S=states, M=self.dones[env_ids])
+                               for env_ids, states in zip(self.groups, self.group_states)])
+
+    def _finish(self, mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_states):
         # Batch of steps to batch of rollouts
         mb_obs = np.asarray(mb_obs, dtype=self.ob_dtype).swapaxes(1, 0).reshape(self.batch_ob_shape)
         mb_rewards = np.asarray(mb_rewards, dtype=np.float32).swapaxes(1, 0)
@@ -53,7 +101,7 @@ class Runner(AbstractEnvRunner):
 
         if self.gamma > 0.0:
             # Discount/bootstrap off value fn
-            last_values = self.model.value(self.obs, S=self.states, M=self.dones).tolist()
+            last_values = self._last_values().tolist()
             for n, (rewards, dones, value) in enumerate(zip(mb_rewards, mb_dones, last_values)):
                 rewards = rewards.tolist()
                 dones = dones.tolist()
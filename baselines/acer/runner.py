@@ -1,5 +1,6 @@
 import numpy as np
 from baselines.common.runners import AbstractEnvRunner
+from baselines import logger
 from baselines.common.vec_env.vec_frame_stack import VecFrameStack
 from gym import spaces
 
@@ -28,12 +29,14 @@ class Runner(AbstractEnvRunner):
         enc_obs = np.split(self.env.stackedobs, self.env.nstack, axis=-1)
         mb_obs, mb_actions, mb_mus, mb_dones, mb_rewards = [], [], [], [], []
         for _ in range(self.nsteps):
-            actions, mus, states = self.model._step(self.obs, S=self.states, M=self.dones)
+            with logger.timer('inference'):
+                actions, mus, states = self.model._step(self.obs, S=self.states, M=self.dones)
             mb_obs.append(np.copy(self.obs))
             mb_actions.append(actions)
             mb_mus.append(mus)
             mb_dones.append(self.dones)
-            obs, rewards, dones, _ = self.env.step(actions)
+            with logger.timer('env_step'):
+                obs, rewards, dones, _ = self.env.step(actions)
             # states information for statefull models like LSTM
             self.states = states
             self.dones = dones
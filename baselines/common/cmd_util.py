@@ -17,15 +17,31 @@ from baselines.common.atari_wrappers import make_atari, wrap_deepmind
 from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
 from baselines.common import retro_wrappers
+from baselines.common.wrappers import StepCache
+from baselines.common.profiler import sample_stacks
 
 def make_vec_env(env_id, env_type, num_env, seed,
                  wrapper_kwargs=None,
                  start_index=0,
                  reward_scale=1.0,
                  flatten_dict_observations=True,
-                 gamestate=None):
+                 gamestate=None,
+                 envs_per_worker=1,
+                 max_env_restarts=0,
+                 step_cache=None,
+                 step_cache_size=100000,
+                 step_cache_set_state=None,
+                 profile_rate=None):
     """
     Create a wrapped, monitored SubprocVecEnv for Atari and MuJoCo.
+    envs_per_worker environments are stepped in series by each subprocess;
+    subprocesses that die are respawned up to max_env_restarts times.
+    If step_cache is a path, the steps of the environments are memoized in a database
+    shared by the subprocesses, that holds up to step_cache_size of them; step_cache_set_state
+    names the method of the environments that restores an observation, which spares replaying
+    the cached steps on the next miss (see StepCache).
+    If profile_rate is given, the stacks of the subprocesses are sampled that many times per
+    second into profile_stacks.<pid>.txt files in the log directory (see StackSampler).
     """
     wrapper_kwargs = wrapper_kwargs or {}
     mpi_rank = MPI.COMM_WORLD.Get_rank() if MPI else 0
@@ -42,18 +58,27 @@ def make_vec_env(env_id, env_type, num_env, seed,
             gamestate=gamestate,
             flatten_dict_observations=flatten_dict_observations,
             wrapper_kwargs=wrapper_kwargs,
-            logger_dir=logger_dir
+            logger_dir=logger_dir,
+            step_cache=step_cache,
+            step_cache_size=step_cache_size,
+            step_cache_set_state=step_cache_set_state,
+            profile_rate=profile_rate
         )
 
     set_global_seeds(seed)
     if num_env > 1:
-        return SubprocVecEnv([make_thunk(i + start_index) for i in range(num_env)])
+        return SubprocVecEnv([make_thunk(i + start_index) for i in range(num_env)], envs_per_worker=envs_per_worker,
+                             max_restarts=max_env_restarts)
     else:
         return DummyVecEnv([make_thunk(start_index)])
 
 
-def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.0, gamestate=None, flatten_dict_observations=True, wrapper_kwargs=None, logger_dir=None):
+def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.0, gamestate=None, flatten_dict_observations=True, wrapper_kwargs=None, logger_dir=None,
+             step_cache=None, step_cache_size=100000, step_cache_set_state=None, profile_rate=None):
     wrapper_kwargs = wrapper_kwargs or {}
+    if profile_rate and logger_dir:
+        # does nothing in a process whose stacks are sampled already
+        sample_stacks(os.path.join(logger_dir, 'profile_stacks.%i.txt' % os.getpid()), profile_rate)
     if env_type == 'atari':
         env = make_atari(env_id)
     elif env_type == 'retro':
@@ -68,6 +93,8 @@ def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.
         env = gym.wrappers.FlattenDictWrapper(env, dict_keys=list(keys))
 
     env.seed(seed + subrank if seed is not None else None)
+    if step_cache is not None:
+        env = StepCache(env, step_cache, max_entries=step_cache_size, set_state=step_cache_set_state)
     env = Monitor(env,
                   logger_dir and os.path.join(logger_dir, str(mpi_rank) + '.' + str(subrank)),
                   allow_early_resets=True)
@@ -143,6 +170,15 @@ def common_arg_parser():
     parser.add_argument('--network', help='network type (mlp, cnn, lstm, cnn_lstm, conv_only)', default=None)
     parser.add_argument('--gamestate', help='game state to load (so far only used in retro games)', default=None)
     parser.add_argument('--num_env', help='Number of environment copies being run in parallel. When not specified, set to number of cpus for Atari, and to 1 for Mujoco', default=None, type=int)
+    parser.add_argument('--envs_per_worker', help='Number of environments stepped in series by each subprocess. Default: 1', default=1, type=int)
+    parser.add_argument('--max_env_restarts', help='Number of times environment subprocesses that died are restarted before the run aborts. Default: 0', default=0, type=int)
+    parser.add_argument('--step_cache', help='Path of a database in which to memoize the steps of expensive deterministic environments (eg. NASGym). Default: no memoization', default=None, type=str)
+    parser.add_argument('--step_cache_size', help='Number of steps memoized with --step_cache. Default: 100000', default=100000, type=int)
+    parser.add_argument('--step_cache_set_state', help='Method of the environment that restores an observation, used by --step_cache to bring the environment up to date after cached steps. Default: replay the cached steps on the environment, which costs as much as they saved', default=None, type=str)
+    parser.add_argument('--profile', help='Sample the Python stacks of the main process into the log directory (profile_stacks.txt, for flamegraph.pl) and profile a window of the training loop with cProfile (profile.prof)', default=False, action='store_true')
+    parser.add_argument('--profile_rate', help='Stack samples per second with --profile. Default: 20', default=20., type=float)
+    parser.add_argument('--profile_workers', help='With --profile, sample the stacks of the environment subprocesses too', default=False, action='store_true')
+    parser.add_argument('--profile_window', help='With --profile, cProfile from the START-th to the END-th logging interval (0 to start right away). Default: 1 2', nargs=2, default=[1, 2], type=int, metavar=('START', 'END'))
     parser.add_argument('--reward_scale', help='Reward scale factor. Default: 1.0', default=1.0, type=float)
     parser.add_argument('--save_path', help='Path to save trained model to', default=None, type=str)
     parser.add_argument('--save_video_interval', help='Save video every x steps (0 = disabled)', default=0, type=int)
@@ -0,0 +1,91 @@
+import csv
+import os
+import time
+
+from baselines.logger import csv_segment, csv_segments
+
+
+class EpisodeLog(object):
+    """
+    Append-only CSV log of info dicts, one row per dict.
+
+    The rows are buffered and only the new ones are appended to the file, once max_rows of them
+    are pending or flush_secs have passed since the last write, so that appending a row costs the
+    same however long the log is and at most max_rows rows are held in memory. The columns are
+    the keys of the first row and are preceded by a column numbering the rows, as written by
+    DataFrame.to_csv, so that pandas.read_csv(path, index_col=0) reads the log back. When keys
+    show up that the file has no column for, the file is closed and the next rows go to a new
+    segment with a column for every key so far, as for the CSVOutputFormat of the logger
+    (path.1.csv, path.2.csv, ...); read_episode_log merges the segments back.
+    """
+    def __init__(self, path, max_rows=1000, flush_secs=30.):
+        self.path = path
+        self.max_rows = max_rows
+        self.flush_secs = flush_secs
+        self.rows = []
+        self.nrows = 0
+        self.keys = []
+        self.key_set = set()
+        self.nsegments = 0
+        self.f = None
+        self.writer = None
+        self.tlastflush = time.time()
+
+    def append(self, rows):
+        """
+        Add the dicts in rows to the log.
+        """
+        self.rows.extend(rows)
+        if len(self.rows) >= self.max_rows or time.time() - self.tlastflush >= self.flush_secs:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending rows to the file.
+        """
+        self.tlastflush = time.time()
+        if not self.rows:
+            return
+        for row in self.rows:
+            if self.f is None or not self.key_set.issuperset(row):
+                self._open_segment(row)
+            line = {'': self.nrows}
+            line.update(row)
+            self.writer.writerow(line)
+            self.nrows += 1
+        self.rows = []
+        self.f.flush()
+
+    def _open_segment(self, row):
+        """Start a new segment, whose columns are the keys so far and those of row"""
+        if self.f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # segments of a previous log
+            for fname in csv_segments(self.path)[1:]:
+                os.remove(fname)
+        else:
+            self.f.close()
+        self.keys.extend(k for k in row if k not in self.key_set)
+        self.key_set.update(row)
+        self.f = open(csv_segment(self.path, self.nsegments), 'wt', newline='')
+        self.nsegments += 1
+        self.writer = csv.DictWriter(self.f, fieldnames=[''] + self.keys)
+        self.writer.writeheader()
+
+    def close(self):
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def read_episode_log(path):
+    """
+    Read an episode log written by EpisodeLog into a DataFrame, merging its segments.
+    """
+    import pandas
+    dfs = [pandas.read_csv(segment, index_col=0) for segment in csv_segments(path)]
+    if len(dfs) == 1:
+        return dfs[0]
+    # the last segment has all the keys
+    return pandas.concat(dfs, sort=False)[list(dfs[-1].columns)]
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+from baselines.common.misc_util import relatively_safe_pickle_dump, pickle_load
+
+STATE_FILENAME = 'state.pkl'
+
+
+def open_memmap(path, shape, dtype):
+    """Open a disk-backed array stored as a .npy file.
+
+    If the file already exists it is reopened in read/write mode, which
+    allows resuming a run from a previously filled buffer; otherwise a new
+    zero-filled file is created. Reads and writes go through the page cache,
+    so arrays larger than RAM can be used.
+
+    Parameters
+    ----------
+    path: str
+        path to the .npy file
+    shape: tuple
+        shape of the array
+    dtype: np.dtype
+        dtype of the array
+
+    Returns
+    -------
+    arr: np.memmap
+        memory-mapped array
+    """
+    shape = tuple(shape)
+    if os.path.exists(path):
+        arr = np.load(path, mmap_mode='r+')
+        if arr.shape != shape or arr.dtype != np.dtype(dtype):
+            raise ValueError('{} holds an array of shape {} and dtype {}, expected {} and {}'.format(
+                path, arr.shape, arr.dtype, shape, np.dtype(dtype)))
+        return arr
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def save_state(dirname, state, arrays=()):
+    """Flush `arrays` to disk and save the bookkeeping `state` (eg. ring
+    buffer indices) of a disk-backed buffer stored in `dirname`."""
+    for arr in arrays:
+        if isinstance(arr, np.memmap):
+            arr.flush()
+    relatively_safe_pickle_dump(state, os.path.join(dirname, STATE_FILENAME))
+
+
+def load_state(dirname):
+    """Returns the state saved with `save_state`, or None if `dirname` holds no saved buffer."""
+    path = os.path.join(dirname, STATE_FILENAME)
+    if not os.path.exists(path):
+        return None
+    return pickle_load(path)
@@ -5,6 +5,7 @@ import pickle
 import random
 import tempfile
 import zipfile
+from collections import namedtuple
 
 
 def zipsame(*seqs):
@@ -239,6 +240,50 @@ def relatively_safe_pickle_dump(obj, path, compression=False):
     os.rename(temp_storage, path)
 
 
+ArrayChunks = namedtuple('ArrayChunks', ['shape', 'dtype', 'chunks'])
+ArrayChunks.__doc__ = """An array of known shape and dtype given as an iterable of consecutive
+chunks along its first axis, which `relatively_safe_arrays_dump` writes
+one chunk at a time instead of holding the whole array in memory."""
+
+
+def relatively_safe_arrays_dump(arrays, path, compression=False):
+    """Save a dict of arrays to an .npz file at `path`, with the same failure
+    guarantees as `relatively_safe_pickle_dump`.
+
+    Arrays are written as raw .npy blocks, so saving is bounded by disk
+    bandwidth rather than by pickling.
+
+    Parameters
+    ----------
+    arrays: dict
+        arrays (or scalars, or ArrayChunks) to save, keyed by name
+    path: str
+        path to the output file
+    compression: bool
+        if true the blocks will be zlib-compressed
+    """
+    temp_storage = path + ".relatively_safe"
+    mode = zipfile.ZIP_DEFLATED if compression else zipfile.ZIP_STORED
+    with zipfile.ZipFile(temp_storage, "w", compression=mode, allowZip64=True) as myzip:
+        for name, value in arrays.items():
+            with myzip.open(name + ".npy", "w", force_zip64=True) as f:
+                if isinstance(value, ArrayChunks):
+                    dtype = np.dtype(value.dtype)
+                    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                              'shape': tuple(value.shape)}
+                    np.lib.format.write_array_header_1_0(f, header)
+                    nrows = 0
+                    for chunk in value.chunks:
+                        chunk = np.ascontiguousarray(chunk, dtype=dtype)
+                        assert chunk.shape[1:] == tuple(value.shape[1:]), "chunk of %s has a different shape" % name
+                        f.write(chunk.tobytes())
+                        nrows += len(chunk)
+                    assert nrows == value.shape[0], "chunks of %s do not add up to its shape" % name
+                else:
+                    np.lib.format.write_array(f, np.asanyarray(value))
+    os.rename(temp_storage, path)
+
+
 def pickle_load(path, compression=False):
     """Unpickle a possible compressed pickle.
 
@@ -39,13 +39,22 @@ class RunningMeanStd(object):
 
 
     def update(self, x):
-        x = x.astype('float64')
-        n = int(np.prod(self.shape))
-        totalvec = np.zeros(n*2+1, 'float64')
-        addvec = np.concatenate([x.sum(axis=0).ravel(), np.square(x).sum(axis=0).ravel(), np.array([len(x)],dtype='float64')])
-        if MPI is not None:
-            MPI.COMM_WORLD.Allreduce(addvec, totalvec, op=MPI.SUM)
-        self.incfiltparams(totalvec[0:n].reshape(self.shape), totalvec[n:2*n].reshape(self.shape), totalvec[2*n])
+        self.incfiltparams(*mpi_sums(x, self.shape))
+
+def mpi_sums(x, shape):
+    """
+    Sum of x and of its square over the first axis and the length of x, each summed over
+    the MPI workers (if mpi4py is available). Every worker has to call it the same number of times.
+    """
+    x = x.astype('float64')
+    n = int(np.prod(shape))
+    totalvec = np.zeros(n*2+1, 'float64')
+    addvec = np.concatenate([x.sum(axis=0).ravel(), np.square(x).sum(axis=0).ravel(), np.array([len(x)],dtype='float64')])
+    if MPI is not None:
+        MPI.COMM_WORLD.Allreduce(addvec, totalvec, op=MPI.SUM)
+    else:
+        totalvec = addvec
+    return totalvec[0:n].reshape(shape), totalvec[n:2*n].reshape(shape), totalvec[2*n]
 
 @U.in_session
 def test_runningmeanstd():
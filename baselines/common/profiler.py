@@ -0,0 +1,129 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from multiprocessing import util
+
+from baselines import logger
+
+
+class StackSampler(object):
+    """
+    Samples the Python stack of a thread, by default the main one, rate times per second from a
+    background thread, and writes how many times each stack was seen to path every flush_secs
+    seconds, in the collapsed format of flamegraph.pl: the frames from the outermost one,
+    separated by semicolons, then the count. Equal stacks are counted together, so the file
+    grows with the number of distinct stacks rather than with the length of the run, and the
+    overhead is that of rate stack walks per second.
+    """
+    def __init__(self, path, rate=20., flush_secs=60., thread_id=None, max_depth=100):
+        self.path = path
+        self.interval = 1. / rate
+        self.flush_secs = flush_secs
+        self.thread_id = threading.main_thread().ident if thread_id is None else thread_id
+        self.max_depth = max_depth
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='stack_sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines = ['%s %i\n' % (stack, count) for stack, count in self.counts.most_common()]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        tlastflush = time.time()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # the thread is gone
+                return
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append('%s (%s:%i)' % (code.co_name, os.path.basename(code.co_filename).replace(';', '_'),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            del frame
+            with self.lock:
+                self.counts[';'.join(reversed(stack))] += 1
+            if time.time() - tlastflush >= self.flush_secs:
+                self.flush()
+                tlastflush = time.time()
+
+
+_sampler = None
+
+def sample_stacks(path, rate=20., flush_secs=60.):
+    """
+    Sample the stacks of the main thread of this process into path (see StackSampler), unless
+    they are sampled already. The samples are written out again when the process exits,
+    subprocesses included.
+    """
+    global _sampler
+    if _sampler is not None and _sampler.pid == os.getpid():
+        return _sampler
+    _sampler = StackSampler(path, rate=rate, flush_secs=flush_secs).start()
+    # multiprocessing runs its finalizers on exit in the main process and in its subprocesses
+    util.Finalize(None, _sampler.stop, exitpriority=10)
+    return _sampler
+
+
+class CProfileWindow(object):
+    """
+    Profiles the thread that dumps the logger with cProfile from its start-th to its end-th
+    logger.dumpkvs() (0 for right away), that is over end - start logging intervals of the
+    training loop, then writes the stats to path (see pstats).
+    """
+    def __init__(self, path, start=1, end=2):
+        assert 0 <= start < end
+        self.path = path
+        self.start = start
+        self.end = end
+        self.ndumps = 0
+        self.profile = None
+        logger.add_dump_hook(self._on_dump)
+        if start == 0:
+            self._enable()
+
+    def stop(self):
+        """
+        Write out the stats of a window that did not reach its end.
+        """
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+            self.profile = None
+        logger.remove_dump_hook(self._on_dump)
+
+    def _enable(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def _on_dump(self):
+        self.ndumps += 1
+        if self.ndumps == self.start:
+            self._enable()
+        elif self.ndumps == self.end:
+            self.stop()
@@ -1,8 +1,10 @@
 import numpy as np
 from abc import ABC, abstractmethod
+from baselines import logger
+from baselines.common.vec_env.vec_env import check_partial_steps
 
 class AbstractEnvRunner(ABC):
-    def __init__(self, *, env, model, nsteps):
+    def __init__(self, *, env, model, nsteps, pipelined=False):
         self.env = env
         self.model = model
         self.nenv = nenv = env.num_envs if hasattr(env, 'num_envs') else 1
@@ -18,8 +20,59 @@ class AbstractEnvRunner(ABC):
         self.p_rewards = np.zeros((nenv, 1))
         self.timesteps = np.zeros((nenv, 1), dtype=np.int32)
 
+        # Compute the actions of one half of the envs while the other half is simulated (see
+        # step_groups); the step model must then be built for nenv // 2 envs, and the recurrent
+        # state of each half is kept in group_states
+        self.pipelined = pipelined
+        if pipelined:
+            assert nenv % 2 == 0, 'pipelined stepping needs an even number of envs'
+            check_partial_steps(env)
+            self.groups = np.array_split(np.arange(nenv), 2)
+            self.group_states = [self.states for _ in self.groups]
+
     @abstractmethod
     def run(self):
         raise NotImplementedError
 
-    
\ No newline at end of file
+    def step_groups(self, groups, act, observe):
+        """
+        Step each group of envs nsteps times, each group again as soon as all of its envs
+        finished their previous step, using env.step_async(actions, env_ids) and env.poll().
+        With two groups, the actions of one group are computed while the other one is
+        simulated (see the pipelined option of the runners).
+
+        act(g, env_ids, t) returns the actions of group g for its step t;
+        observe(env_ids, t, obs, rewards, dones, infos) records the results of step t of env_ids.
+        """
+        sizes = np.array([len(env_ids) for env_ids in groups])
+        group_of = np.empty(self.nenv, dtype=np.int64)
+        for g, env_ids in enumerate(groups):
+            group_of[env_ids] = g
+        counts = np.zeros(len(groups), dtype=np.int64)
+        received = np.zeros(len(groups), dtype=np.int64)
+        for g, env_ids in enumerate(groups):
+            with logger.timer('inference'):
+                actions = act(g, env_ids, 0)
+            self.env.step_async(actions, env_ids)
+        while counts.min() < self.nsteps:
+            with logger.timer('env_step'):
+                env_ids, obs, rewards, dones, infos = self.env.poll()
+            if len(env_ids) == 0:
+                continue
+            observe(env_ids, counts[group_of[env_ids]], obs, rewards, dones, infos)
+            received += np.bincount(group_of[env_ids], minlength=len(groups))
+            for g in np.flatnonzero(received == sizes):
+                received[g] = 0
+                counts[g] += 1
+                if counts[g] < self.nsteps:
+                    with logger.timer('inference'):
+                        actions = act(g, groups[g], counts[g])
+                    self.env.step_async(actions, groups[g])
+
+    def pipelined_states(self):
+        """
+        Recurrent state of all envs (None for feed-forward policies) in pipelined mode.
+        """
+        if self.group_states[0] is None:
+            return None
+        return np.concatenate(self.group_states)
@@ -4,17 +4,48 @@ from baselines.common.tf_util import get_session
 
 class RunningMeanStd(object):
     # https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
-    def __init__(self, epsilon=1e-4, shape=()):
+    def __init__(self, epsilon=1e-4, shape=(), merge_every=1):
         self.mean = np.zeros(shape, 'float64')
         self.var = np.ones(shape, 'float64')
         self.count = epsilon
+        # With merge_every > 1, update() only adds the batch to running sums (of the differences
+        # to the mean, for precision), which are merged into mean, var and count every
+        # merge_every updates or by flush(); mean and var lag behind until then.
+        self.merge_every = merge_every
+        self._reset_sums()
 
     def update(self, x):
+        if self.merge_every > 1:
+            diff = x - self._shift
+            self._sum += diff.sum(axis=0)
+            self._sumsq += np.square(diff).sum(axis=0)
+            self._sum_count += x.shape[0]
+            self._num_pending += 1
+            if self._num_pending >= self.merge_every:
+                self.flush()
+            return
         batch_mean = np.mean(x, axis=0)
         batch_var = np.var(x, axis=0)
         batch_count = x.shape[0]
         self.update_from_moments(batch_mean, batch_var, batch_count)
 
+    def flush(self):
+        """
+        Merge the batches accumulated since the last merge into mean, var and count.
+        """
+        if self._sum_count > 0:
+            batch_mean = self._sum / self._sum_count
+            batch_var = np.maximum(self._sumsq / self._sum_count - np.square(batch_mean), 0.)
+            self.update_from_moments(self._shift + batch_mean, batch_var, self._sum_count)
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._shift = self.mean
+        self._sum = np.zeros_like(self.mean)
+        self._sumsq = np.zeros_like(self.mean)
+        self._sum_count = 0
+        self._num_pending = 0
+
     def update_from_moments(self, batch_mean, batch_var, batch_count):
         self.mean, self.var, self.count = update_mean_var_count_from_moments(
             self.mean, self.var, self.count, batch_mean, batch_var, batch_count)
@@ -99,6 +130,26 @@ def test_runningmeanstd():
 
         np.testing.assert_allclose(ms1, ms2)
 
+def test_runningmeanstd_merge_every():
+    for (x1, x2, x3) in [
+        (np.random.randn(3) + 100, np.random.randn(4) + 100, np.random.randn(5) + 100),
+        (np.random.randn(3,2), np.random.randn(4,2), np.random.randn(5,2)),
+        ]:
+
+        rms = RunningMeanStd(epsilon=0.0, shape=x1.shape[1:], merge_every=2)
+
+        x = np.concatenate([x1, x2, x3], axis=0)
+        ms1 = [x.mean(axis=0), x.var(axis=0)]
+        rms.update(x1)
+        rms.update(x2)
+        np.testing.assert_allclose(rms.mean, np.concatenate([x1, x2]).mean(axis=0))
+        rms.update(x3)
+        assert rms.count == len(x1) + len(x2)
+        rms.flush()
+        ms2 = [rms.mean, rms.var]
+
+        np.testing.assert_allclose(ms1, ms2)
+
 def test_tf_runningmeanstd():
     for (x1, x2, x3) in [
         (np.random.randn(3), np.random.randn(4), np.random.randn(5)),
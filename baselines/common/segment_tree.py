@@ -1,8 +1,10 @@
 import operator
 
+import numpy as np
+
 
 class SegmentTree(object):
-    def __init__(self, capacity, operation, neutral_element):
+    def __init__(self, capacity, operation, neutral_element, batch_operation=None):
         """Build a Segment Tree data structure.
 
         https://en.wikipedia.org/wiki/Segment_tree
@@ -27,11 +29,16 @@ class SegmentTree(object):
         neutral_element: obj
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
+        batch_operation: lambda np.array, np.array -> np.array
+            elementwise version of `operation` used by the batched methods
+            (eg. np.maximum for max). Defaults to `operation`.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._depth = capacity.bit_length() - 1
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
+        self._batch_operation = batch_operation or operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
         if start == node_start and end == node_end:
@@ -76,26 +83,58 @@ class SegmentTree(object):
     def __setitem__(self, idx, val):
         # index of the leaf
         idx += self._capacity
-        self._value[idx] = val
+        value = self._value
+        value[idx] = val
         idx //= 2
         while idx >= 1:
-            self._value[idx] = self._operation(
-                self._value[2 * idx],
-                self._value[2 * idx + 1]
+            # item() returns python scalars, which is much faster than numpy scalar arithmetic
+            value[idx] = self._operation(
+                value.item(2 * idx),
+                value.item(2 * idx + 1)
             )
             idx //= 2
 
+    def set_batch(self, idxs, vals):
+        """Set `arr[idxs[i]] = vals[i]` for all i, updating the tree
+        one level at a time for the whole batch.
+
+        If an index is repeated, the last value wins (as with
+        repeated calls to `__setitem__`).
+
+        Parameters
+        ----------
+        idxs: np.array
+            indices of the items to set
+        vals: np.array
+            new values of the items
+        """
+        idxs = np.asarray(idxs, dtype=np.int64) + self._capacity
+        self._value[idxs] = vals
+        for _ in range(self._depth):
+            idxs = np.unique(idxs // 2)
+            self._value[idxs] = self._batch_operation(
+                self._value[2 * idxs],
+                self._value[2 * idxs + 1]
+            )
+
     def __getitem__(self, idx):
         assert 0 <= idx < self._capacity
         return self._value[self._capacity + idx]
 
+    def get_batch(self, idxs):
+        """Returns `arr[idxs]` as an np.array"""
+        idxs = np.asarray(idxs)
+        assert np.all(0 <= idxs) and np.all(idxs < self._capacity)
+        return self._value[self._capacity + idxs]
+
 
 class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
             operation=operator.add,
-            neutral_element=0.0
+            neutral_element=0.0,
+            batch_operation=np.add
         )
 
     def sum(self, start=0, end=None):
@@ -123,20 +162,46 @@ class SumSegmentTree(SegmentTree):
         assert 0 <= prefixsum <= self.sum() + 1e-5
         idx = 1
         while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
+            if self._value.item(2 * idx) > prefixsum:
                 idx = 2 * idx
             else:
-                prefixsum -= self._value[2 * idx]
+                prefixsum -= self._value.item(2 * idx)
                 idx = 2 * idx + 1
         return idx - self._capacity
 
+    def find_prefixsum_idx_batch(self, prefixsums):
+        """Batched version of `find_prefixsum_idx`.
+
+        All queries descend the tree together, one level per step.
+
+        Parameters
+        ----------
+        prefixsums: np.array
+            upperbounds on the sum of array prefix
+
+        Returns
+        -------
+        idxs: np.array
+            highest indexes satisfying the prefixsum constraints
+        """
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        assert np.all(0 <= prefixsums) and np.all(prefixsums <= self.sum() + 1e-5)
+        idxs = np.ones(len(prefixsums), dtype=np.int64)
+        for _ in range(self._depth):  # all queries are at the same depth
+            left = self._value[2 * idxs]
+            go_right = left <= prefixsums
+            prefixsums -= np.where(go_right, left, 0.0)
+            idxs = 2 * idxs + go_right
+        return idxs - self._capacity
+
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
             operation=min,
-            neutral_element=float('inf')
+            neutral_element=float('inf'),
+            batch_operation=np.minimum
         )
 
     def min(self, start=0, end=None):
@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import gym
+import numpy as np
+import pytest
+
+from baselines.a2c.runner import Runner as A2CRunner
+from baselines.common.vec_env import DummyVecEnv, ShmemVecEnv, SubprocVecEnv, VecEnvWrapper, VecFrameStack
+from baselines.meta_a2c.runner import Runner as MetaA2CRunner
+from baselines.ppo2.runner import Runner as PPO2Runner
+
+
+class CountingEnv(gym.Env):
+    """Env whose observations count the steps; episodes of env i last i + 2 steps"""
+
+    def __init__(self, seed):
+        self.seed_ = seed
+        self.observation_space = gym.spaces.Box(low=0, high=100, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+        return np.array([self.t, self.seed_], dtype=np.float32)
+
+    def step(self, action):
+        self.t += 1
+        done = self.t >= self.seed_ + 2
+        info = {'episode': {'r': self.t, 'l': self.seed_}} if done else {}
+        return np.array([self.t, self.seed_], dtype=np.float32), float(action) + self.seed_, done, info
+
+
+class FakeModel(object):
+    """Deterministic policy whose actions and values depend on the observations only"""
+    initial_state = None
+
+    def __init__(self):
+        self.train_model = SimpleNamespace(
+            action=SimpleNamespace(shape=SimpleNamespace(as_list=lambda: [None]), dtype=SimpleNamespace(name='int64')),
+            X=SimpleNamespace(dtype=SimpleNamespace(as_numpy_dtype=np.float32)))
+
+    def step(self, obs, *args, S=None, M=None):
+        values = obs.sum(axis=1).astype(np.float32)
+        return (obs[:, 0] % 2).astype(np.int64), values, None, values / 10
+
+    def value(self, obs, *args, S=None, M=None):
+        return obs.sum(axis=1).astype(np.float32)
+
+
+def _env_fns(nenv=3):
+    return [(lambda seed: lambda: CountingEnv(seed))(i) for i in range(nenv)]
+
+
+class NoPollWrapper(VecEnvWrapper):
+    """Wrapper that does not implement partial steps"""
+
+    def reset(self):
+        return self.venv.reset()
+
+    def step_wait(self):
+        return self.venv.step_wait()
+
+
+@pytest.mark.parametrize('make_runner', (
+    lambda env, async_envs: PPO2Runner(env=env, model=FakeModel(), nsteps=5, gamma=0.9, lam=0.95, async_envs=async_envs),
+    lambda env, async_envs: MetaA2CRunner(env, FakeModel(), nsteps=5, gamma=0.9, async_envs=async_envs),
+))
+@pytest.mark.parametrize('klass', (SubprocVecEnv, ShmemVecEnv))
+@pytest.mark.parametrize('wrap', (lambda env: env, lambda env: VecFrameStack(env, 2)))
+def test_async_runner_matches_sync(make_runner, klass, wrap):
+    sync_runner = make_runner(wrap(DummyVecEnv(_env_fns())), False)
+    async_env = wrap(klass(_env_fns()))
+    async_runner = make_runner(async_env, True)
+    try:
+        for _ in range(3):
+            sync_out, async_out = sync_runner.run(), async_runner.run()
+            for out1, out2 in zip(sync_out[:-1], async_out[:-1]):
+                if out1 is None:
+                    assert out2 is None
+                else:
+                    np.testing.assert_allclose(out1, out2)
+            assert sorted(map(str, sync_out[-1])) == sorted(map(str, async_out[-1]))
+    finally:
+        async_env.close()
+
+    with pytest.raises(NotImplementedError, match='NoPollWrapper'):
+        make_runner(VecFrameStack(NoPollWrapper(DummyVecEnv(_env_fns())), 2), True)
+
+
+@pytest.mark.parametrize('make_runner', (
+    lambda env, pipelined: PPO2Runner(env=env, model=FakeModel(), nsteps=5, gamma=0.9, lam=0.95, pipelined=pipelined),
+    lambda env, pipelined: A2CRunner(env, FakeModel(), nsteps=5, gamma=0.9, pipelined=pipelined),
+    lambda env, pipelined: MetaA2CRunner(env, FakeModel(), nsteps=5, gamma=0.9, pipelined=pipelined),
+))
+@pytest.mark.parametrize('klass', (SubprocVecEnv, ShmemVecEnv))
+@pytest.mark.parametrize('wrap', (lambda env: env, lambda env: VecFrameStack(env, 2)))
+def test_pipelined_runner_matches_sync(make_runner, klass, wrap):
+    sync_runner = make_runner(wrap(DummyVecEnv(_env_fns(4))), False)
+    pipelined_env = wrap(klass(_env_fns(4)))
+    pipelined_runner = make_runner(pipelined_env, True)
+    try:
+        for _ in range(3):
+            for out1, out2 in zip(sync_runner.run(), pipelined_runner.run()):
+                if out1 is None:
+                    assert out2 is None
+                elif isinstance(out1, list):
+                    assert sorted(map(str, out1)) == sorted(map(str, out2))
+                else:
+                    np.testing.assert_allclose(out1, out2)
+    finally:
+        pipelined_env.close()
+
+    with pytest.raises(NotImplementedError, match='NoPollWrapper'):
+        make_runner(VecFrameStack(NoPollWrapper(DummyVecEnv(_env_fns(4))), 2), True)
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from baselines.common.episode_log import EpisodeLog, read_episode_log
+from baselines.logger import csv_segments
+
+
+def test_episode_log(tmpdir):
+    path = str(tmpdir.join('episode_logs', 'episodes_results.csv'))
+    rows = [{'step': i, 'reward': 0.5 * i, 'done': i % 3 == 0} for i in range(10)]
+    log = EpisodeLog(path, max_rows=4, flush_secs=float('inf'))
+    log.append(rows[:3])
+    assert log.f is None
+    log.append(rows[3:5])
+    assert len(log.rows) == 0
+    log.append(rows[5:])
+    log.close()
+
+    expected = pd.DataFrame(rows, columns=['step', 'reward', 'done'])
+    pd.testing.assert_frame_equal(pd.read_csv(path, index_col=0), expected)
+    with open(path) as f:
+        assert f.read() == expected.to_csv()
+
+
+def test_episode_log_new_keys(tmpdir):
+    path = str(tmpdir.join('episodes_results.csv'))
+    rows = [{'step': 0, 'reward': 0.5}, {'step': 1, 'reward': 1., 'error': 'diverged'},
+            {'step': 2, 'reward': 1.5}, {'step': 3, 'reward': 2., 'accuracy': 0.9}]
+    log = EpisodeLog(path, max_rows=2, flush_secs=float('inf'))
+    log.append(rows)
+    log.close()
+
+    # a key that shows up later starts a new segment with a column for it
+    assert csv_segments(path) == [path, str(tmpdir.join('episodes_results.1.csv')),
+                                  str(tmpdir.join('episodes_results.2.csv'))]
+    expected = pd.DataFrame(rows, columns=['step', 'reward', 'error', 'accuracy'])
+    pd.testing.assert_frame_equal(read_episode_log(path), expected)
+
+    # a new log at the same path drops the old segments
+    log = EpisodeLog(path)
+    log.append(rows[:1])
+    log.close()
+    assert csv_segments(path) == [path]
+    pd.testing.assert_frame_equal(read_episode_log(path), pd.DataFrame(rows[:1], columns=['step', 'reward']))
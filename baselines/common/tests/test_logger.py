@@ -0,0 +1,86 @@
+import gc
+import os.path as osp
+import weakref
+
+import numpy as np
+import pytest
+
+from baselines import logger
+from baselines.logger import CSVOutputFormat, read_csv, csv_segments
+
+
+def test_csv_segments(tmpdir):
+    fname = str(tmpdir.join('progress.csv'))
+
+    writer = CSVOutputFormat(fname)
+    writer.writekvs({'b': 1, 'a': 2})
+    writer.writekvs({'b': 3, 'a': 4})
+    writer.writekvs({'a': 5, 'c': 6})
+    writer.writekvs({'a': 7, 'c': 8, 'b': 9})
+    writer.writekvs({'d': 10})
+    writer.close()
+
+    assert csv_segments(fname) == [fname, str(tmpdir.join('progress.1.csv')), str(tmpdir.join('progress.2.csv'))]
+    with open(fname) as f:
+        assert f.read() == 'a,b\n2,1\n4,3\n'
+    df = read_csv(fname)
+    assert list(df.columns) == ['a', 'b', 'c', 'd']
+    np.testing.assert_array_equal(df.values, [
+        [2, 1, np.nan, np.nan],
+        [4, 3, np.nan, np.nan],
+        [5, np.nan, 6, np.nan],
+        [7, 9, 8, np.nan],
+        [np.nan, np.nan, np.nan, 10]])
+
+    # a new log in the same directory drops the old segments
+    writer = CSVOutputFormat(fname)
+    writer.writekvs({'a': 1})
+    writer.close()
+    assert csv_segments(fname) == [fname]
+    assert list(read_csv(fname)['a']) == [1]
+
+
+@pytest.mark.parametrize('policy', ['block', 'drop'])
+def test_async_logger(tmpdir, policy):
+    dir = str(tmpdir)
+    with logger.scoped_configure(dir, ['csv', 'log'], async_policy=policy, async_queue=2):
+        writer = logger.get_current().output_formats[0]
+        assert isinstance(writer, logger.AsyncOutputFormat)
+        for i in range(100):
+            logger.logkv('i', i)
+            logger.dumpkvs()
+        logger.log('done')
+
+    df = read_csv(osp.join(dir, 'progress.csv'))
+    with open(osp.join(dir, 'log.txt')) as f:
+        log = f.read()
+    assert log.endswith('done\n' if writer.ndropped == 0 else 'done\nLogger dropped %i snapshots of key/values\n' % writer.ndropped)
+    if policy == 'block':
+        assert writer.ndropped == 0
+    assert list(df['i']) == sorted(df['i']) and len(df) == 100 - writer.ndropped
+
+
+def test_async_logger_released(tmpdir):
+    # closed writers are not kept alive by their exit hook
+    refs = []
+    for _ in range(3):
+        with logger.scoped_configure(str(tmpdir), ['log'], async_policy='block'):
+            refs.append(weakref.ref(logger.get_current().output_formats[0]))
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+
+
+def test_timers(tmpdir):
+    with logger.scoped_configure(str(tmpdir), [], timers=True):
+        for _ in range(10):
+            with logger.timer('phase'):
+                pass
+        kvs = logger.dumpkvs()
+        assert set(kvs) == {'wait_phase', 'wait_phase_mean', 'wait_phase_p50', 'wait_phase_p90', 'wait_phase_p99'}
+        assert kvs['wait_phase_p50'] <= kvs['wait_phase_p99'] <= kvs['wait_phase']
+        assert logger.dumpkvs() == {}
+
+    with logger.scoped_configure(str(tmpdir), [], timers=False):
+        with logger.timer('phase'):
+            pass
+        assert logger.dumpkvs() == {}
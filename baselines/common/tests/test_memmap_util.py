@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from baselines.common.memmap_util import open_memmap
+
+
+def test_open_memmap_reopen(tmpdir):
+    path = str(tmpdir.join('arr.npy'))
+    arr = open_memmap(path, (4, 3), np.uint8)
+    arr[2] = 7
+    arr.flush()
+    del arr
+
+    arr = open_memmap(path, (4, 3), np.uint8)
+    assert isinstance(arr, np.memmap)
+    np.testing.assert_array_equal(arr[2], 7)
+    with pytest.raises(ValueError):
+        open_memmap(path, (5, 3), np.uint8)
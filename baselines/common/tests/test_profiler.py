@@ -0,0 +1,64 @@
+import os.path as osp
+import pstats
+import time
+
+import gym
+
+from baselines import logger
+from baselines.common.profiler import StackSampler, CProfileWindow, sample_stacks
+from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+
+
+def busy_loop(seconds):
+    tstart = time.time()
+    while time.time() - tstart < seconds:
+        pass
+
+
+def test_stack_sampler(tmpdir):
+    path = str(tmpdir.join('profile_stacks.txt'))
+    sampler = StackSampler(path, rate=200., flush_secs=0.1).start()
+    busy_loop(0.5)
+    with open(path) as f:
+        assert f.read()
+    sampler.stop()
+
+    counts = {}
+    with open(path) as f:
+        for line in f:
+            stack, count = line.rsplit(' ', 1)
+            counts[stack] = int(count)
+    assert sum(counts.values()) > 10
+    assert any(stack.split(';')[-1].startswith('busy_loop (test_profiler.py:') for stack in counts)
+
+
+def test_cprofile_window(tmpdir):
+    path = str(tmpdir.join('profile.prof'))
+    with logger.scoped_configure(str(tmpdir), []):
+        window = CProfileWindow(path, start=1, end=2)
+        logger.dumpkvs()
+        busy_loop(0.05)
+        logger.dumpkvs()
+        assert osp.exists(path)
+        logger.dumpkvs()
+        window.stop()
+    functions = {func for (_, _, func) in pstats.Stats(path).stats}
+    assert 'busy_loop' in functions
+
+
+def make_profiled_env(dir):
+    def make_env():
+        sample_stacks(osp.join(dir, 'profile_stacks.worker.txt'), rate=100.)
+        return gym.make('CartPole-v0')
+    return make_env
+
+
+def test_sample_worker_stacks(tmpdir):
+    # both envs run in the same worker, which is sampled once
+    env = SubprocVecEnv([make_profiled_env(str(tmpdir))] * 2, envs_per_worker=2)
+    env.reset()
+    busy_loop(0.2)
+    env.close()
+    # written when the worker exits
+    with open(str(tmpdir.join('profile_stacks.worker.txt'))) as f:
+        assert 'worker (subproc_vec_env.py:' in f.read()
@@ -95,9 +95,41 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_set_batch():
+    tree = SumSegmentTree(8)
+    ref = SumSegmentTree(8)
+    min_tree = MinSegmentTree(8)
+
+    idxs = np.array([1, 5, 2, 5, 7])
+    vals = np.array([0.5, 1.0, 2.0, 3.0, 0.25])
+    tree.set_batch(idxs, vals)
+    min_tree.set_batch(idxs, vals)
+    for idx, val in zip(idxs, vals):
+        ref[idx] = val
+
+    assert np.isclose(tree[5], 3.0)
+    for start in range(8):
+        for end in range(start + 1, 9):
+            assert np.isclose(tree.sum(start, end), ref.sum(start, end))
+    assert np.isclose(min_tree.min(), 0.25)
+    assert np.isclose(min_tree.min(0, 7), 0.5)
+
+
+def test_prefixsum_idx_batch():
+    tree = SumSegmentTree(16)
+    tree.set_batch(np.arange(11), np.random.rand(11))
+
+    prefixsums = np.random.rand(256) * tree.sum()
+    expected = [tree.find_prefixsum_idx(p) for p in prefixsums]
+    np.testing.assert_array_equal(tree.find_prefixsum_idx_batch(prefixsums), expected)
+    assert np.all(tree.find_prefixsum_idx_batch(prefixsums) < 11)
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_set_batch()
+    test_prefixsum_idx_batch()
@@ -0,0 +1,93 @@
+import sqlite3
+
+import gym
+import numpy as np
+
+from baselines.common.wrappers import StepCache
+
+
+class SequenceEnv(gym.Env):
+    """Deterministic env whose observation lists the actions taken so far"""
+    def __init__(self, length=3):
+        self.length = length
+        self.action_space = gym.spaces.Discrete(4)
+        self.observation_space = gym.spaces.Box(low=-1, high=3, shape=(length,), dtype=np.int64)
+        self.nsteps = 0
+
+    def reset(self):
+        self.obs = -np.ones(self.length, dtype=np.int64)
+        self.t = 0
+        return self.obs.copy()
+
+    def step(self, action):
+        self.nsteps += 1
+        self.obs[self.t] = action
+        self.t += 1
+        return self.obs.copy(), float(self.obs[:self.t].sum()), self.t == self.length, {'t': self.t}
+
+    def set_obs(self, obs):
+        self.obs = obs.copy()
+        self.t = int((obs >= 0).sum())
+
+
+def run(env, actions):
+    env.reset()
+    return [env.step(a) for a in actions]
+
+
+def test_step_cache(tmpdir):
+    path = str(tmpdir.join('steps.sqlite'))
+    raw = SequenceEnv()
+    first = run(raw, [1, 2, 3])
+    raw.nsteps = 0
+
+    for key in ('state', 'actions'):
+        env = StepCache(SequenceEnv(), path + key, key=key)
+        other = StepCache(SequenceEnv(), path + key, key=key)
+        for (ob, rew, done, info), expected in zip(run(env, [1, 2, 3]), first):
+            np.testing.assert_array_equal(ob, expected[0])
+            assert (rew, done, info) == (expected[1], expected[2], dict(expected[3], step_cache_hit=False))
+
+        # the steps are shared through the database
+        results = run(other, [1, 2, 3])
+        assert other.env.nsteps == 0 and other.hits == 3
+        for (ob, rew, done, info), expected in zip(results, first):
+            np.testing.assert_array_equal(ob, expected[0])
+            assert (rew, done, info) == (expected[1], expected[2], dict(expected[3], step_cache_hit=True))
+
+        # a miss after hits first steps the env through the actions it missed
+        ob, rew, done, info = run(other, [1, 2, 0])[-1]
+        assert other.env.nsteps == 3 and not info['step_cache_hit']
+        np.testing.assert_array_equal(ob, [1, 2, 0])
+        assert rew == 3.
+
+    # the least recently used step is dropped
+    env = StepCache(SequenceEnv(), str(tmpdir.join('lru.sqlite')), max_entries=2)
+    run(env, [1, 2])
+    run(env, [1])
+    run(env, [3])
+    assert sqlite3.connect(env.path).execute('SELECT COUNT(*) FROM steps').fetchone()[0] == 2
+    assert run(env, [1])[0][3]['step_cache_hit']
+    assert not run(env, [1, 2])[1][3]['step_cache_hit']
+    env.close()
+
+
+def test_step_cache_touches_and_set_state(tmpdir):
+    path = str(tmpdir.join('steps.sqlite'))
+    run(StepCache(SequenceEnv(), path), [1, 2, 3])
+
+    # hits are written to the database touch_batch at a time
+    env = StepCache(SequenceEnv(), path, touch_batch=3, set_state='set_obs')
+    run(env, [1, 2])
+    assert env.hits == 2 and env.db.total_changes == 0
+    run(env, [1])
+    assert env.db.total_changes == 0
+    run(env, [1, 2, 3])
+    assert env.db.total_changes == 3 and not env.touched
+
+    # a miss after hits restores the env from the last observation instead of replaying the hits
+    ob, rew, done, info = run(env, [1, 2, 0])[-1]
+    assert env.env.nsteps == 1 and not info['step_cache_hit']
+    np.testing.assert_array_equal(ob, [1, 2, 0])
+    assert rew == 3.
+    env.close()
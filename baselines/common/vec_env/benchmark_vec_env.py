@@ -0,0 +1,103 @@
+"""
+Compares the stepping throughput of DummyVecEnv, SubprocVecEnv with
+a varying number of environments per subprocess and ShmemVecEnv with and
+without copying the observations, and times the step of VecFrameStack
+on its own.
+"""
+
+import argparse
+import time
+
+import gym
+import numpy as np
+
+from baselines.common.vec_env import DummyVecEnv, ShmemVecEnv, SubprocVecEnv, VecEnv, VecFrameStack
+
+
+def make_env_fn(env_id, seed):
+    def _thunk():
+        env = gym.make(env_id)
+        env.seed(seed)
+        return env
+    return _thunk
+
+
+def time_steps(venv, num_steps):
+    venv.reset()
+    actions = [np.array([venv.action_space.sample() for _ in range(venv.num_envs)]) for _ in range(16)]
+    tstart = time.time()
+    for t in range(num_steps):
+        venv.step(actions[t % len(actions)])
+    return venv.num_envs * num_steps / (time.time() - tstart)
+
+
+class FrameVecEnv(VecEnv):
+    """VecEnv that returns ready-made frames at no cost, to time the wrappers around it alone"""
+
+    def __init__(self, num_envs, frame_shape, episode_length=100):
+        observation_space = gym.spaces.Box(low=0, high=255, shape=frame_shape, dtype=np.uint8)
+        VecEnv.__init__(self, num_envs, observation_space, gym.spaces.Discrete(2))
+        self.frames = np.random.RandomState(0).randint(0, 256, size=(16, num_envs) + frame_shape).astype(np.uint8)
+        self.rews = np.zeros(num_envs, dtype=np.float32)
+        # the envs finish their episodes one after another
+        self.episode_length = episode_length
+        self.t = 0
+
+    def reset(self):
+        return self.frames[0]
+
+    def step_async(self, actions):
+        pass
+
+    def step_wait(self):
+        self.t += 1
+        dones = (np.arange(self.num_envs) + self.t) % self.episode_length == 0
+        return self.frames[self.t % len(self.frames)], self.rews, dones, [{}] * self.num_envs
+
+
+def time_frame_stack(num_envs, frame_shape, nstack, num_steps):
+    venv = VecFrameStack(FrameVecEnv(num_envs, frame_shape), nstack)
+    venv.reset()
+    actions = np.zeros(num_envs, dtype=np.int64)
+    tstart = time.time()
+    for _ in range(num_steps):
+        venv.step(actions)
+    return (time.time() - tstart) / num_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--env', type=str, default='CartPole-v0')
+    parser.add_argument('--num-envs', type=int, default=64)
+    parser.add_argument('--num-steps', type=int, default=500)
+    parser.add_argument('--envs-per-worker', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--frame-stack-envs', type=int, default=16)
+    parser.add_argument('--frame-shape', type=int, nargs='+', default=[84, 84, 1])
+    parser.add_argument('--nstack', type=int, default=4)
+    parser.add_argument('--frame-stack-steps', type=int, default=2000)
+    args = parser.parse_args()
+
+    step_time = time_frame_stack(args.frame_stack_envs, tuple(args.frame_shape), args.nstack, args.frame_stack_steps)
+    print('VecFrameStack(nstack={}) over {} envs of {} frames: {:.0f} us/step'.format(
+        args.nstack, args.frame_stack_envs, 'x'.join(map(str, args.frame_shape)), step_time * 1e6))
+
+    env_fns = [make_env_fn(args.env, seed) for seed in range(args.num_envs)]
+    venvs = [('DummyVecEnv', lambda: DummyVecEnv(env_fns))]
+    for envs_per_worker in args.envs_per_worker:
+        venvs.append(('SubprocVecEnv(envs_per_worker={})'.format(envs_per_worker),
+                      lambda envs_per_worker=envs_per_worker: SubprocVecEnv(env_fns, envs_per_worker=envs_per_worker)))
+    for copy_obs in (True, False):
+        venvs.append(('ShmemVecEnv(copy_obs={})'.format(copy_obs),
+                      lambda copy_obs=copy_obs: ShmemVecEnv(env_fns, copy_obs=copy_obs)))
+
+    for name, make_venv in venvs:
+        venv = make_venv()
+        try:
+            fps = time_steps(venv, args.num_steps)
+        finally:
+            venv.close()
+        print('{}: {:.0f} env steps/s'.format(name, fps))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,9 +26,15 @@ class DummyVecEnv(VecEnv):
         self.buf_rews  = np.zeros((self.num_envs,), dtype=np.float32)
         self.buf_infos = [{} for _ in range(self.num_envs)]
         self.actions = None
+        self.pending = []
         self.spec = self.envs[0].spec
 
-    def step_async(self, actions):
+    def step_async(self, actions, env_ids=None):
+        if env_ids is not None:
+            # partial steps are run when they are polled
+            assert len(actions) == len(env_ids)
+            self.pending.extend(zip(env_ids, actions))
+            return
         listify = True
         try:
             if len(actions) == self.num_envs:
@@ -55,15 +61,36 @@ class DummyVecEnv(VecEnv):
         return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
                 self.buf_infos.copy())
 
+    def poll(self, min_ready=1, timeout=None):
+        env_ids, pending, self.pending = [], self.pending, []
+        for e, action in pending:
+            obs, self.buf_rews[e], self.buf_dones[e], self.buf_infos[e] = self.envs[e].step(action)
+            if self.buf_dones[e]:
+                obs = self.envs[e].reset()
+            self._save_obs(e, obs)
+            env_ids.append(e)
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        if len(env_ids) == 0:
+            return env_ids, None, np.zeros(0), np.zeros(0, dtype=np.bool), ()
+        obs = dict_to_obs({k: self.buf_obs[k][env_ids] for k in self.keys})
+        return (env_ids, obs, self.buf_rews[env_ids], self.buf_dones[env_ids],
+                tuple(self.buf_infos[e] for e in env_ids))
+
     def reset(self):
+        self.pending = []
         for e in range(self.num_envs):
             obs = self.envs[e].reset()
             self._save_obs(e, obs)
         return self._obs_from_buf()
 
     def save_db_experiments(self):
-        for e in range(self.num_envs):
-            self.envs[e].save_db_experiments()
+        self.env_method('save_db_experiments')
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.envs[e], method_name)(*method_args, **method_kwargs) for e in self._get_indices(indices)]
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[e], attr_name) for e in self._get_indices(indices)]
 
     def _save_obs(self, e, obs):
         for k in self.keys:
@@ -3,31 +3,44 @@ An interface for asynchronous vectorized environments.
 """
 
 import multiprocessing as mp
+import time
 import numpy as np
 from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
-import ctypes
 from baselines import logger
 
 from .util import dict_to_obs, obs_space_info, obs_to_dict
 
-_NP_TO_CT = {np.float32: ctypes.c_float,
-             np.int32: ctypes.c_int32,
-             np.int8: ctypes.c_int8,
-             np.uint8: ctypes.c_char,
-             np.bool: ctypes.c_bool}
+# commands written to the shared command array before waking a worker up;
+# workers set their entry back to _IDLE once they finished a command
+_IDLE, _STEP, _RESET, _RENDER, _CLOSE, _CALL = range(6)
 
 
 class ShmemVecEnv(VecEnv):
     """
     Optimized version of SubprocVecEnv that uses shared variables to communicate observations.
+
+    The observations of all envs live in one contiguous shared block per observation key,
+    laid out as (num_envs, *shape); rewards, dones and actions are shared arrays as well.
+    Workers are woken up with a semaphore each and report back through a common one, so
+    only non-empty infos (and rarely used commands such as render) go through pipes.
     """
 
-    def __init__(self, env_fns, spaces=None, context='spawn'):
+    def __init__(self, env_fns, spaces=None, context='spawn', copy_obs=True, max_restarts=0):
         """
         If you don't specify observation_space, we'll have to create a dummy
         environment to get it.
+
+        If copy_obs is False, reset() and step_wait() return views of the shared observation
+        block instead of copies. They are overwritten by the next step or reset, so they must
+        be consumed (or copied) before that.
+
+        Workers that died (eg. killed by the OOM killer) are respawned from their env_fns up to
+        max_restarts times before giving up with an EOFError. The env of a respawned worker is
+        reset, and its next step returns reward 0, done=True and {'worker_restarted': True} as
+        info (its observation is the reset one if the step was lost with the worker).
+        num_restarts counts the restarts so far.
         """
-        ctx = mp.get_context(context)
+        self.ctx = ctx = mp.get_context(context)
         if spaces:
             observation_space, action_space = spaces
         else:
@@ -38,98 +51,347 @@ class ShmemVecEnv(VecEnv):
                 dummy.close()
                 del dummy
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        self.copy_obs = copy_obs
         self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
-        self.obs_bufs = [
-            {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], int(np.prod(self.obs_shapes[k]))) for k in self.obs_keys}
-            for _ in env_fns]
-        self.parent_pipes = []
-        self.procs = []
-        with clear_mpi_env_vars():
-            for env_fn, obs_buf in zip(env_fns, self.obs_bufs):
-                wrapped_fn = CloudpickleWrapper(env_fn)
-                parent_pipe, child_pipe = ctx.Pipe()
-                proc = ctx.Process(target=_subproc_worker,
-                            args=(child_pipe, parent_pipe, wrapped_fn, obs_buf, self.obs_shapes, self.obs_dtypes, self.obs_keys))
-                proc.daemon = True
-                self.procs.append(proc)
-                self.parent_pipes.append(parent_pipe)
-                proc.start()
-                child_pipe.close()
+        self.shared_bufs = {
+            'obs': {k: _alloc_shared(ctx, (self.num_envs,) + tuple(self.obs_shapes[k]), self.obs_dtypes[k])
+                    for k in self.obs_keys},
+            'rew': _alloc_shared(ctx, (self.num_envs,), np.float64),
+            'done': _alloc_shared(ctx, (self.num_envs,), np.bool_),
+            'info_flags': _alloc_shared(ctx, (self.num_envs,), np.bool_),
+            'cmd': _alloc_shared(ctx, (self.num_envs,), np.int32),
+            # actions of spaces without a fixed shape (eg. Tuple) are sent through the pipes
+            'act': (_alloc_shared(ctx, (self.num_envs,) + tuple(action_space.shape), action_space.dtype)
+                    if action_space.shape is not None else None),
+        }
+        self.obs_bufs = {k: _as_ndarray(buf) for k, buf in self.shared_bufs['obs'].items()}
+        self.rew_buf = _as_ndarray(self.shared_bufs['rew'])
+        self.done_buf = _as_ndarray(self.shared_bufs['done'])
+        self.info_flags = _as_ndarray(self.shared_bufs['info_flags'])
+        self.cmd_buf = _as_ndarray(self.shared_bufs['cmd'])
+        self.act_buf = _as_ndarray(self.shared_bufs['act']) if self.shared_bufs['act'] is not None else None
+        self.start_sems = [ctx.Semaphore(0) for _ in env_fns]
+        self.done_sem = ctx.Semaphore(0)
+
+        self.env_fns = [CloudpickleWrapper(env_fn) for env_fn in env_fns]
+        self.max_restarts = max_restarts
+        self.num_restarts = 0
+        self.restarted = np.zeros(self.num_envs, dtype=np.bool)
+        self.parent_pipes = [None] * self.num_envs
+        self.procs = [None] * self.num_envs
+        for index in range(self.num_envs):
+            self._start_worker(index)
         self.waiting_step = False
+        # envs running a partial step, see step_async(actions, env_ids)
+        self.stepping = np.zeros(self.num_envs, dtype=np.bool)
         self.viewer = None
 
     def reset(self):
         if self.waiting_step:
             logger.warn('Called reset() while waiting for the step to complete')
             self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('reset', None))
-        return self._decode_obses([pipe.recv() for pipe in self.parent_pipes])
+        self._drain_pending()
+        self._send(_RESET)
+        self._wait()
+        self.restarted[:] = False
+        return self._decode_obses()
 
-    def step_async(self, actions):
-        assert len(actions) == len(self.parent_pipes)
-        for pipe, act in zip(self.parent_pipes, actions):
-            pipe.send(('step', act))
+    def step_async(self, actions, env_ids=None):
+        """
+        Step all envs, or only the envs in env_ids with one action each;
+        the results of such a partial step are collected with poll().
+        """
+        if env_ids is not None:
+            self._step_some(actions, env_ids)
+            return
+        assert not self.stepping.any(), "Wait for the partial steps with poll() before stepping all envs"
+        assert len(actions) == self.num_envs
+        if self.act_buf is not None:
+            self.act_buf[...] = np.asarray(actions).reshape(self.act_buf.shape)
+        else:
+            for pipe, act in zip(self.parent_pipes, actions):
+                try:
+                    pipe.send(act)
+                except (EOFError, ConnectionError):
+                    pass  # the worker died, _wait restarts it
+        self._send(_STEP)
+        self.waiting_step = True
+
+    def _step_some(self, actions, env_ids):
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        assert len(actions) == len(env_ids)
+        assert not self.waiting_step, "Wait for the step of all envs with step_wait() before a partial step"
+        assert not self.stepping[env_ids].any(), "Some of the envs {} are still stepping".format(env_ids)
+        self.stepping[env_ids] = True
+        if self.act_buf is not None:
+            self.act_buf[env_ids] = np.asarray(actions).reshape((len(env_ids),) + self.act_buf.shape[1:])
+        else:
+            for index, act in zip(env_ids, actions):
+                try:
+                    self.parent_pipes[index].send(act)
+                except (EOFError, ConnectionError):
+                    pass  # the worker died, poll restarts it
+        self.cmd_buf[env_ids] = _STEP
+        for index in env_ids:
+            self.start_sems[index].release()
+
+    def poll(self, min_ready=1, timeout=None):
+        """
+        Collect the results of the partial steps started with step_async(actions, env_ids).
+
+        Blocks until at least min_ready envs (or all stepping envs, if fewer are stepping)
+        finished or timeout seconds passed, and reports all envs that finished by then.
+
+        Returns (env_ids, obs, rews, dones, infos) for the envs that finished, in the format
+        of step_wait(); obs is None if no env finished.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            stepping = np.flatnonzero(self.stepping)
+            env_ids = stepping[self.cmd_buf[stepping] == _IDLE]
+            if len(env_ids) >= min(min_ready, len(stepping)):
+                break
+            remaining = 1.0 if deadline is None else min(1.0, deadline - time.time())
+            if remaining <= 0:
+                break
+            self._wait_any(stepping, remaining)
+        self.stepping[env_ids] = False
+        if len(env_ids) == 0:
+            return env_ids, None, np.zeros(0), np.zeros(0, dtype=np.bool), ()
+        infos = [self._recv_info(e) for e in env_ids]
+        rews, dones = self.rew_buf[env_ids], self.done_buf[env_ids]
+        for i in np.flatnonzero(self.restarted[env_ids]):
+            rews[i], dones[i], infos[i] = 0, True, {'worker_restarted': True}
+        self.restarted[env_ids] = False
+        obs = dict_to_obs({k: self.obs_bufs[k][env_ids] for k in self.obs_keys})
+        return env_ids, obs, rews, dones, tuple(infos)
 
     def step_wait(self):
-        outs = [pipe.recv() for pipe in self.parent_pipes]
-        obs, rews, dones, infos = zip(*outs)
-        return self._decode_obses(obs), np.array(rews), np.array(dones), infos
+        # cleared first so that close() does not wait for the step again if a worker died for good
+        self.waiting_step = False
+        self._wait()
+        infos = [self._recv_info(e) for e in range(self.num_envs)]
+        restarted = np.flatnonzero(self.restarted)
+        self.rew_buf[restarted] = 0
+        self.done_buf[restarted] = True
+        for e in restarted:
+            infos[e] = {'worker_restarted': True}
+        self.restarted[:] = False
+        return self._decode_obses(), np.copy(self.rew_buf), np.copy(self.done_buf), infos
 
     def close_extras(self):
         if self.waiting_step:
             self.step_wait()
+        self._drain_pending()
+        self._send(_CLOSE)
+        self._wait()
         for pipe in self.parent_pipes:
-            pipe.send(('close', None))
-        for pipe in self.parent_pipes:
-            pipe.recv()
             pipe.close()
         for proc in self.procs:
             proc.join()
 
     def get_images(self, mode='human'):
-        for pipe in self.parent_pipes:
-            pipe.send(('render', None))
-        return [pipe.recv() for pipe in self.parent_pipes]
+        self._send(_RENDER)
+        return [self._recv_image(index) for index in range(self.num_envs)]
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_envs(indices, ('env_method', method_name, method_args, method_kwargs))
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_envs(indices, ('get_attr', attr_name, (), {}))
+
+    def _call_envs(self, indices, call):
+        """Wake the workers of the envs in indices up with call at once, then gather the results"""
+        assert not self.waiting_step and not self.stepping.any(), "Wait for the steps of the envs first"
+        indices = self._get_indices(indices)
+        for index in set(indices):
+            self.parent_pipes[index].send(call)
+            self.cmd_buf[index] = _CALL
+            self.start_sems[index].release()
+        results = {index: self.parent_pipes[index].recv() for index in set(indices)}
+        for index in indices:
+            ok, result = results[index]
+            if not ok:
+                raise result
+        return [results[index][1] for index in indices]
 
-    def _decode_obses(self, obs):
+    def _start_worker(self, index):
+        parent_pipe, child_pipe = self.ctx.Pipe()
+        proc = self.ctx.Process(target=_subproc_worker,
+                    args=(child_pipe, parent_pipe, self.env_fns[index], index, self.start_sems[index], self.done_sem,
+                          self.shared_bufs))
+        proc.daemon = True
+        with clear_mpi_env_vars():
+            proc.start()
+        child_pipe.close()
+        self.procs[index], self.parent_pipes[index] = proc, parent_pipe
+
+    def _restart_worker(self, index):
+        """
+        Respawn the worker of env index, which died, from its env_fn and make it reset its env.
+        The new worker releases done_sem once the reset is done. Raises EOFError once
+        max_restarts restarts were made.
+        """
+        proc = self.procs[index]
+        if self.num_restarts >= self.max_restarts:
+            raise EOFError('ShmemVecEnv worker {} died with exit code {} ({} restarts so far)'.format(
+                index, proc.exitcode, self.num_restarts))
+        self.num_restarts += 1
+        logger.warn('ShmemVecEnv worker {} died with exit code {}, restarting it ({}/{})'.format(
+            index, proc.exitcode, self.num_restarts, self.max_restarts))
+        proc.join()
+        self.parent_pipes[index].close()
+        # the dead worker may not have consumed its last wake up
+        self.start_sems[index] = self.ctx.Semaphore(0)
+        self._start_worker(index)
+        self.restarted[index] = True
+        self.cmd_buf[index] = _RESET
+        self.start_sems[index].release()
+
+    def _recv_info(self, index):
+        if self.restarted[index] or not self.info_flags[index]:
+            return {}
+        try:
+            return self.parent_pipes[index].recv()
+        except (EOFError, ConnectionError):
+            # died between reporting the step and sending its info
+            self._restart_worker(index)
+            self._wait([index])
+            return {}
+
+    def _recv_image(self, index):
+        try:
+            return self.parent_pipes[index].recv()
+        except (EOFError, ConnectionError):
+            self._restart_worker(index)
+            self._wait([index])
+            self.cmd_buf[index] = _RENDER
+            self.start_sems[index].release()
+            return self.parent_pipes[index].recv()
+
+    def _send(self, cmd):
+        self.cmd_buf[:] = cmd
+        for sem in self.start_sems:
+            sem.release()
+
+    def _wait(self, indices=None):
+        """
+        Wait for the workers of the envs in indices (by default all of them) to finish their
+        command, restarting dead ones. Workers mark themselves idle before releasing done_sem,
+        which only wakes the parent up: the command buffer tells which envs are outstanding, so
+        a worker that dies between the two is not waited for.
+        """
+        outstanding = range(self.num_envs) if indices is None else indices
+        while True:
+            outstanding = [index for index in outstanding if self.cmd_buf[index] != _IDLE]
+            if not outstanding:
+                return
+            self._wait_any(outstanding, 1.0)
+
+    def _wait_any(self, outstanding, timeout):
+        """
+        Wait up to timeout seconds for some worker to finish its command; if none did, restart
+        the dead workers among the envs in outstanding.
+        """
+        if self.done_sem.acquire(timeout=timeout):
+            # the other workers that finished meanwhile are found in the command buffer as well
+            while self.done_sem.acquire(block=False):
+                pass
+            return
+        for index in outstanding:
+            if self.procs[index].is_alive() or self.cmd_buf[index] == _IDLE:
+                continue
+            if self.cmd_buf[index] == _CLOSE:
+                # nothing to restart for
+                self.cmd_buf[index] = _IDLE
+            else:
+                # the new worker reports its reset in place of the lost command
+                self._restart_worker(index)
+
+    def _drain_pending(self):
+        """Discard the results of partial steps that were never polled"""
+        stepping = np.flatnonzero(self.stepping)
+        self._wait(stepping)
+        for index in stepping:
+            self._recv_info(index)
+        self.stepping[:] = False
+
+    def _decode_obses(self):
         result = {}
         for k in self.obs_keys:
-
-            bufs = [b[k] for b in self.obs_bufs]
-            o = [np.frombuffer(b.get_obj(), dtype=self.obs_dtypes[k]).reshape(self.obs_shapes[k]) for b in bufs]
-            result[k] = np.array(o)
+            result[k] = np.copy(self.obs_bufs[k]) if self.copy_obs else self.obs_bufs[k]
         return dict_to_obs(result)
 
 
-def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs_dtypes, keys):
+def _alloc_shared(ctx, shape, dtype):
+    """
+    Allocate a shared block for an array of the given shape
+    and dtype; view it with _as_ndarray.
+    """
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray('b', max(1, int(np.prod(shape)) * dtype.itemsize))
+    return raw, tuple(shape), dtype.str
+
+
+def _as_ndarray(buf):
+    raw, shape, dtype = buf
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, index, start_sem, done_sem, bufs):
     """
     Control a single environment instance using IPC and
     shared memory.
     """
+    obs_bufs = {k: _as_ndarray(buf)[index] for k, buf in bufs['obs'].items()}
+    rew_buf, done_buf = _as_ndarray(bufs['rew']), _as_ndarray(bufs['done'])
+    info_flags, cmd_buf = _as_ndarray(bufs['info_flags']), _as_ndarray(bufs['cmd'])
+    act_buf = _as_ndarray(bufs['act']) if bufs['act'] is not None else None
+
     def _write_obs(maybe_dict_obs):
         flatdict = obs_to_dict(maybe_dict_obs)
-        for k in keys:
-            dst = obs_bufs[k].get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtypes[k]).reshape(obs_shapes[k])  # pylint: disable=W0212
-            np.copyto(dst_np, flatdict[k])
+        for k, dst in obs_bufs.items():
+            np.copyto(dst, flatdict[k])
 
     env = env_fn_wrapper.x()
     parent_pipe.close()
     try:
         while True:
-            cmd, data = pipe.recv()
-            if cmd == 'reset':
-                pipe.send(_write_obs(env.reset()))
-            elif cmd == 'step':
-                obs, reward, done, info = env.step(data)
+            start_sem.acquire()
+            cmd = cmd_buf[index]
+            if cmd == _RESET:
+                _write_obs(env.reset())
+                cmd_buf[index] = _IDLE
+                done_sem.release()
+            elif cmd == _STEP:
+                action = act_buf[index] if act_buf is not None else pipe.recv()
+                obs, reward, done, info = env.step(action)
                 if done:
                     obs = env.reset()
-                pipe.send((_write_obs(obs), reward, done, info))
-            elif cmd == 'render':
+                _write_obs(obs)
+                rew_buf[index] = reward
+                done_buf[index] = done
+                info_flags[index] = bool(info)
+                cmd_buf[index] = _IDLE
+                # release before sending, the parent reads the infos once all envs are done
+                done_sem.release()
+                if info:
+                    pipe.send(info)
+            elif cmd == _RENDER:
+                cmd_buf[index] = _IDLE
                 pipe.send(env.render(mode='rgb_array'))
-            elif cmd == 'close':
-                pipe.send(None)
+            elif cmd == _CALL:
+                kind, name, args, kwargs = pipe.recv()
+                # errors are sent back to be raised in the parent rather than killing the worker
+                try:
+                    result = True, (getattr(env, name)(*args, **kwargs) if kind == 'env_method' else getattr(env, name))
+                except Exception as e:
+                    result = False, e
+                cmd_buf[index] = _IDLE
+                pipe.send(result)
+            elif cmd == _CLOSE:
+                cmd_buf[index] = _IDLE
+                done_sem.release()
                 break
             else:
                 raise RuntimeError('Got unrecognized cmd %s' % cmd)
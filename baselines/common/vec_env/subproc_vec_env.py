@@ -1,36 +1,61 @@
 import multiprocessing as mp
+import time
+from collections import deque
+from multiprocessing.connection import wait
 
 import numpy as np
+from baselines import logger
 from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
 
+# errors raised when talking to a worker that died
+_WORKER_ERRORS = (EOFError, ConnectionError)
+
+
+def worker(remote, parent_remote, env_fn_wrappers):
+    def step_env(env, action):
+        ob, reward, done, info = env.step(action)
+        if done:
+            ob = env.reset()
+        return ob, reward, done, info
+
+    def call_envs(fn, envs):
+        # errors are sent back to be raised in the parent rather than killing the worker
+        try:
+            return True, [fn(env) for env in envs]
+        except Exception as e:
+            return False, e
 
-def worker(remote, parent_remote, env_fn_wrapper):
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    envs = [env_fn_wrapper() for env_fn_wrapper in env_fn_wrappers.x]
     try:
         while True:
             cmd, data = remote.recv()
             if cmd == 'step':
-                ob, reward, done, info = env.step(data)
-                if done:
-                    ob = env.reset()
-                remote.send((ob, reward, done, info))
+                remote.send([step_env(env, action) for env, action in zip(envs, data)])
+            elif cmd == 'step_some':
+                remote.send([step_env(envs[i], action) for i, action in zip(*data)])
             elif cmd == 'reset':
-                ob = env.reset()
-                remote.send(ob)
+                remote.send([env.reset() for env in envs])
             elif cmd == 'render':
-                remote.send(env.render(mode='rgb_array'))
+                remote.send([env.render(mode='rgb_array') for env in envs])
             elif cmd == 'close':
                 remote.close()
                 break
+            elif cmd == 'env_method':
+                idxs, name, args, kwargs = data
+                remote.send(call_envs(lambda env: getattr(env, name)(*args, **kwargs), [envs[i] for i in idxs]))
+            elif cmd == 'get_attr':
+                idxs, name = data
+                remote.send(call_envs(lambda env: getattr(env, name), [envs[i] for i in idxs]))
             elif cmd == 'get_spaces_spec':
-                remote.send((env.observation_space, env.action_space, env.spec))
+                remote.send((envs[0].observation_space, envs[0].action_space, envs[0].spec))
             else:
                 raise NotImplementedError
     except KeyboardInterrupt:
         print('SubprocVecEnv worker: got KeyboardInterrupt')
     finally:
-        env.close()
+        for env in envs:
+            env.close()
 
 
 class SubprocVecEnv(VecEnv):
@@ -38,67 +63,290 @@ class SubprocVecEnv(VecEnv):
     VecEnv that runs multiple environments in parallel in subproceses and communicates with them via pipes.
     Recommended to use when num_envs > 1 and step() can be a bottleneck.
     """
-    def __init__(self, env_fns, spaces=None, context='spawn'):
+    def __init__(self, env_fns, spaces=None, context='spawn', envs_per_worker=1, max_restarts=0):
         """
         Arguments:
 
         env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
+        envs_per_worker: number of environments stepped in series by each subprocess, which then sends
+                         the results of all of them in a single message. For cheap environments this
+                         amortizes the process switch and pickling overhead of the pipes.
+        max_restarts: number of times workers that died (eg. killed by the OOM killer) are respawned
+                      from their env_fns before giving up with an EOFError. The envs of a respawned
+                      worker are reset, and their next reported step has reward 0, done=True and
+                      {'worker_restarted': True} as info (its observation is the reset one if the
+                      step was lost with the worker). num_restarts counts the restarts so far.
         """
         self.waiting = False
         self.closed = False
+        # set before anything can fail, so that close() copes with a partially built env
+        self.remotes, self.ps = [], []
+        self.pending = {}
         nenvs = len(env_fns)
-        ctx = mp.get_context(context)
-        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(nenvs)])
-        self.ps = [ctx.Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-                   for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
-        for p in self.ps:
-            p.daemon = True  # if the main process crashes, we should not cause things to hang
-            with clear_mpi_env_vars():
-                p.start()
-        for remote in self.work_remotes:
-            remote.close()
+        assert envs_per_worker >= 1, "envs_per_worker must be positive"
+        nworkers = -(-nenvs // envs_per_worker)
+        # spread the envs as evenly as possible, eg. 10 envs with envs_per_worker=4 run as 4, 3 and 3
+        self.worker_sizes = [len(idxs) for idxs in np.array_split(np.arange(nenvs), nworkers)]
+        self.env_fns = [CloudpickleWrapper(env_fn) for env_fn in self._split(list(env_fns))]
+        self.ctx = mp.get_context(context)
+        self.max_restarts = max_restarts
+        self.num_restarts = 0
+        # worker of every env and index of the env inside its worker
+        self.env_workers = np.repeat(np.arange(nworkers), self.worker_sizes)
+        self.env_local_idxs = np.arange(nenvs) - np.repeat(np.cumsum([0] + self.worker_sizes[:-1]), self.worker_sizes)
+        # env ids of the partial steps sent to each worker, in the order in which they will be answered
+        self.pending = {}
+        self.stepping = np.zeros(nenvs, dtype=np.bool)
+        # envs whose worker was restarted since their last reported step
+        self.restarted = np.zeros(nenvs, dtype=np.bool)
+
+        self.remotes, self.ps = [None] * nworkers, [None] * nworkers
+        for w in range(nworkers):
+            self._start_worker(w)
 
         self.remotes[0].send(('get_spaces_spec', None))
         observation_space, action_space, self.spec = self.remotes[0].recv()
         self.viewer = None
-        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        VecEnv.__init__(self, nenvs, observation_space, action_space)
 
-    def step_async(self, actions):
+    def step_async(self, actions, env_ids=None):
+        """
+        Step all envs, or only the envs in env_ids with one action each;
+        the results of such a partial step are collected with poll().
+        """
         self._assert_not_closed()
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+        if env_ids is not None:
+            self._step_some(actions, env_ids)
+            return
+        assert not self.pending, "Wait for the partial steps with poll() before stepping all envs"
+        for w, action in enumerate(self._split(actions)):
+            self._send(w, ('step', action))
         self.waiting = True
 
+    def _step_some(self, actions, env_ids):
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        assert len(actions) == len(env_ids)
+        assert not self.waiting, "Wait for the step of all envs with step_wait() before a partial step"
+        assert not self.stepping[env_ids].any(), "Some of the envs {} are still stepping".format(env_ids)
+        self.stepping[env_ids] = True
+        workers = self.env_workers[env_ids]
+        for w in np.unique(workers):
+            mask = workers == w
+            self._send(w, ('step_some', (self.env_local_idxs[env_ids[mask]], [actions[i] for i in np.flatnonzero(mask)])))
+            self.pending.setdefault(w, deque()).append(env_ids[mask])
+
+    def poll(self, min_ready=1, timeout=None):
+        """
+        Collect the results of the partial steps started with step_async(actions, env_ids).
+
+        Blocks until the results of at least min_ready envs (or of all pending envs, if
+        fewer are stepping) arrived or timeout seconds passed, then also collects all other
+        results that are already available. Envs that run in the same worker are reported
+        together.
+
+        Returns (env_ids, obs, rews, dones, infos) for the envs that finished, in the format
+        of step_wait(); obs is None if no env finished.
+        """
+        self._assert_not_closed()
+        deadline = None if timeout is None else time.time() + timeout
+        results, env_ids = [], []
+
+        def collect(timeout):
+            remotes = {self.remotes[w]: w for w in self.pending}
+            for remote in wait(list(remotes), timeout=timeout):
+                w = remotes[remote]
+                while w in self.pending and remote.poll():
+                    ids = self.pending[w].popleft()
+                    if not self.pending[w]:
+                        del self.pending[w]
+                    self.stepping[ids] = False
+                    env_ids.extend(ids)
+                    try:
+                        results.extend(remote.recv())
+                    except _WORKER_ERRORS:
+                        # the steps still queued on the worker are lost as well
+                        batches = [ids] + list(self.pending.pop(w, ()))
+                        ids = np.concatenate(batches[1:] or [np.zeros(0, dtype=np.int64)])
+                        self.stepping[ids] = False
+                        env_ids.extend(ids)
+                        obs = self._restart_worker(w)
+                        results.extend(_restarted_step(obs[i]) for i in self.env_local_idxs[np.concatenate(batches)])
+                        break
+
+        while self.pending and len(env_ids) < min_ready:
+            remaining = None if deadline is None else max(0., deadline - time.time())
+            collect(remaining)
+            if deadline is not None and time.time() >= deadline:
+                break
+        if self.pending:
+            collect(0)
+
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        if not results:
+            return env_ids, None, np.zeros(0), np.zeros(0, dtype=np.bool), ()
+        obs, rews, dones, infos = zip(*results)
+        return (env_ids, _flatten_obs(obs)) + self._report_restarts(env_ids, np.stack(rews), np.stack(dones), infos)
+
     def step_wait(self):
         self._assert_not_closed()
-        results = [remote.recv() for remote in self.remotes]
+        # cleared first so that close() does not wait for the answers again if a worker died for good
         self.waiting = False
+        results = _flatten_list([self._recv(w, lambda obs: [_restarted_step(o) for o in obs])
+                                 for w in range(len(self.remotes))])
         obs, rews, dones, infos = zip(*results)
-        return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos
+        return (_flatten_obs(obs),) + self._report_restarts(np.arange(self.num_envs), np.stack(rews), np.stack(dones), infos)
 
     def reset(self):
         self._assert_not_closed()
-        for remote in self.remotes:
-            remote.send(('reset', None))
-        return _flatten_obs([remote.recv() for remote in self.remotes])
+        self._drain_pending()
+        self.restarted[:] = False
+        for w in range(len(self.remotes)):
+            self._send(w, ('reset', None))
+        return _flatten_obs(_flatten_list([self._recv(w, lambda obs: obs) for w in range(len(self.remotes))]))
 
     def close_extras(self):
         self.closed = True
         if self.waiting:
             for remote in self.remotes:
-                remote.recv()
+                try:
+                    remote.recv()
+                except _WORKER_ERRORS:
+                    pass
+        if self.pending:
+            self._drain_pending()
+        # workers that were never started if __init__ failed are None
         for remote in self.remotes:
-            remote.send(('close', None))
+            try:
+                if remote is not None:
+                    remote.send(('close', None))
+            except _WORKER_ERRORS:
+                pass
         for p in self.ps:
-            p.join()
+            if p is not None:
+                p.join()
 
     def get_images(self):
         self._assert_not_closed()
-        for pipe in self.remotes:
-            pipe.send(('render', None))
-        imgs = [pipe.recv() for pipe in self.remotes]
+        for w in range(len(self.remotes)):
+            self._send(w, ('render', None))
+        imgs = _flatten_list([self._recv(w, lambda obs: self._render_worker(w)) for w in range(len(self.remotes))])
         return imgs
 
+    def _render_worker(self, w):
+        self.remotes[w].send(('render', None))
+        return self.remotes[w].recv()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_envs('env_method', indices, method_name, method_args, method_kwargs)
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_envs('get_attr', indices, attr_name)
+
+    def _call_envs(self, cmd, indices, *data):
+        """Send cmd to the workers of the envs in indices at once, then gather the results"""
+        self._assert_not_closed()
+        assert not self.waiting and not self.pending, "Wait for the steps of the envs first"
+        env_ids = np.asarray(self._get_indices(indices), dtype=np.int64)
+        workers = self.env_workers[env_ids]
+        positions = [(w, np.flatnonzero(workers == w)) for w in np.unique(workers)]
+        for w, pos in positions:
+            self._send(w, (cmd, (self.env_local_idxs[env_ids[pos]],) + data))
+        results, error = [None] * len(env_ids), None
+        # every worker answers, so that the pipes stay in sync even if some of them failed
+        for w, pos in positions:
+            ok, result = self.remotes[w].recv()
+            if not ok:
+                error = error or result
+                continue
+            for i, r in zip(pos, result):
+                results[i] = r
+        if error is not None:
+            raise error
+        return results
+
+    def _drain_pending(self):
+        """Discard the results of partial steps that were never polled"""
+        for w, batches in self.pending.items():
+            for _ in batches:
+                try:
+                    self.remotes[w].recv()
+                except _WORKER_ERRORS:
+                    if not self.closed:
+                        self._restart_worker(w)
+                    break
+        self.pending = {}
+        self.stepping[:] = False
+
+    def _start_worker(self, w):
+        remote, work_remote = self.ctx.Pipe()
+        p = self.ctx.Process(target=worker, args=(work_remote, remote, self.env_fns[w]))
+        p.daemon = True  # if the main process crashes, we should not cause things to hang
+        with clear_mpi_env_vars():
+            p.start()
+        work_remote.close()
+        self.remotes[w], self.ps[w] = remote, p
+
+    def _restart_worker(self, w):
+        """
+        Respawn worker w, which died, from its env_fns and return the reset observations
+        of its envs. Raises EOFError once max_restarts restarts were made.
+        """
+        while True:
+            self.ps[w].join(timeout=1.0)
+            if self.ps[w].is_alive():
+                self.ps[w].terminate()
+                self.ps[w].join()
+            if self.num_restarts >= self.max_restarts:
+                raise EOFError('SubprocVecEnv worker {} died with exit code {} ({} restarts so far)'.format(
+                    w, self.ps[w].exitcode, self.num_restarts))
+            self.num_restarts += 1
+            logger.warn('SubprocVecEnv worker {} died with exit code {}, restarting it ({}/{})'.format(
+                w, self.ps[w].exitcode, self.num_restarts, self.max_restarts))
+            self.remotes[w].close()
+            self._start_worker(w)
+            self.restarted[self.env_workers == w] = True
+            try:
+                self.remotes[w].send(('reset', None))
+                return self.remotes[w].recv()
+            except _WORKER_ERRORS:
+                continue
+
+    def _report_restarts(self, env_ids, rews, dones, infos):
+        """Mark the steps of env_ids whose worker was restarted as done; returns (rews, dones, infos)"""
+        restarted = np.flatnonzero(self.restarted[env_ids])
+        if len(restarted) == 0:
+            return rews, dones, infos
+        self.restarted[env_ids[restarted]] = False
+        rews[restarted] = 0
+        dones[restarted] = True
+        infos = list(infos)
+        for i in restarted:
+            infos[i] = {'worker_restarted': True}
+        return rews, dones, tuple(infos)
+
+    def _send(self, w, msg):
+        try:
+            self.remotes[w].send(msg)
+        except _WORKER_ERRORS:
+            # the worker died, which the following _recv finds out as well
+            if self.num_restarts >= self.max_restarts:
+                raise
+
+    def _recv(self, w, on_restart):
+        """
+        Receive the answer of worker w; if the worker died, restart it and
+        return on_restart(reset observations of its envs) instead.
+        """
+        try:
+            return self.remotes[w].recv()
+        except _WORKER_ERRORS:
+            return on_restart(self._restart_worker(w))
+
+    def _split(self, items):
+        """Splits per-env items into one list per worker"""
+        splits = np.cumsum(self.worker_sizes)[:-1]
+        return [items[start:end] for start, end in zip([0, *splits], [*splits, len(items)])]
+
     def _assert_not_closed(self):
         assert not self.closed, "Trying to operate on a SubprocVecEnv after calling close()"
 
@@ -106,6 +354,10 @@ class SubprocVecEnv(VecEnv):
         if not self.closed:
             self.close()
 
+def _restarted_step(ob):
+    """Step result reported for an env whose worker was restarted"""
+    return ob, 0.0, True, {'worker_restarted': True}
+
 def _flatten_obs(obs):
     assert isinstance(obs, (list, tuple))
     assert len(obs) > 0
@@ -115,3 +367,10 @@ def _flatten_obs(obs):
         return {k: np.stack([o[k] for o in obs]) for k in keys}
     else:
         return np.stack(obs)
+
+def _flatten_list(l):
+    assert isinstance(l, (list, tuple))
+    assert len(l) > 0
+    assert all([len(l_) > 0 for l_ in l])
+
+    return [l__ for l_ in l for l__ in l_]
@@ -2,12 +2,17 @@
 Tests for asynchronous vectorized environments.
 """
 
+import os
+
 import gym
 import numpy as np
 import pytest
 from .dummy_vec_env import DummyVecEnv
-from .shmem_vec_env import ShmemVecEnv
+from .shmem_vec_env import ShmemVecEnv, _RESET
 from .subproc_vec_env import SubprocVecEnv
+from .vec_frame_stack import VecFrameStack
+from .vec_monitor import VecMonitor
+from .vec_normalize import VecNormalize
 from baselines.common.tests.test_with_mpi import with_mpi
 
 
@@ -67,6 +72,291 @@ def test_vec_env(klass, dtype):  # pylint: disable=R0914
     assert_venvs_equal(env1, env2, num_steps=num_steps)
 
 
+def test_shmem_no_copy():
+    """
+    Test that ShmemVecEnv with copy_obs=False matches
+    DummyVecEnv and returns views of its shared block.
+    """
+    num_envs = 3
+    shape = (3, 8)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'uint8'))(i) for i in range(num_envs)]
+    env = ShmemVecEnv(fns, copy_obs=False)
+    obs1 = env.reset()
+    obs2, _, _, _ = env.step(np.zeros((num_envs,) + shape, dtype='uint8'))
+    assert np.shares_memory(obs1, obs2)
+    env.close()
+    assert_venvs_equal(DummyVecEnv(fns), ShmemVecEnv(fns, copy_obs=False), num_steps=50)
+
+
+@pytest.mark.parametrize('envs_per_worker', (2, 4))
+def test_subproc_envs_per_worker(envs_per_worker):
+    """
+    Test that stepping several environments in each
+    subprocess of SubprocVecEnv is equivalent to DummyVecEnv.
+    """
+    num_envs = 7
+    shape = (3, 8)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env1 = DummyVecEnv(fns)
+    env2 = SubprocVecEnv(fns, envs_per_worker=envs_per_worker)
+    assert len(env2.ps) == -(-num_envs // envs_per_worker)
+    assert_venvs_equal(env1, env2, num_steps=50)
+
+
+@pytest.mark.parametrize('klass', (DummyVecEnv, SubprocVecEnv, ShmemVecEnv))
+def test_partial_steps(klass):
+    """
+    Test that stepping subsets of the envs with
+    step_async(actions, env_ids) and poll() gives the
+    same results as stepping all of them.
+    """
+    num_envs = 4
+    shape = (3, 8)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env1 = DummyVecEnv(fns)
+    env2 = klass(fns, envs_per_worker=2) if klass is SubprocVecEnv else klass(fns)
+    try:
+        env1.reset()
+        env2.reset()
+        actions = np.ones((num_envs,) + shape, dtype='float32')
+        for _ in range(10):
+            obs1, rews1, dones1, infos1 = env1.step(actions)
+            env2.step_async(actions[[2, 0]], [2, 0])
+            env2.step_async(actions[[1, 3]], [1, 3])
+            env_ids, obs2, rews2, dones2, infos2 = env2.poll(min_ready=num_envs)
+            assert sorted(env_ids) == list(range(num_envs))
+            assert np.allclose(obs1[env_ids], obs2)
+            assert np.allclose(rews1[env_ids], rews2)
+            assert np.array_equal(dones1[env_ids], dones2)
+            assert [infos1[e] for e in env_ids] == list(infos2)
+        env_ids, obs, _, _, _ = env2.poll(timeout=0.01)
+        assert len(env_ids) == 0 and obs is None
+    finally:
+        env1.close()
+        env2.close()
+
+
+@pytest.mark.parametrize('klass', (DummyVecEnv, SubprocVecEnv, ShmemVecEnv))
+def test_partial_steps_wrapped(klass):
+    """
+    Test that the wrappers that support partial steps treat
+    every env as if it was stepped on its own.
+    """
+    num_envs = 4
+    shape = (3, 2)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+
+    def wrap(venv):
+        return VecFrameStack(VecNormalize(VecMonitor(venv), training=False), 3)
+    env = wrap(klass(fns))
+    single_envs = [wrap(DummyVecEnv([fn])) for fn in fns]
+    try:
+        env.reset()
+        for single_env in single_envs:
+            single_env.reset()
+        rng = np.random.RandomState(0)
+        for step in range(20):
+            # the envs drift apart as they are stepped unevenly
+            env_ids = np.flatnonzero(rng.rand(num_envs) < 0.6)
+            actions = np.full((len(env_ids),) + shape, step, dtype='float32')
+            env.step_async(actions, env_ids)
+            polled_ids, obs, rews, dones, infos = env.poll(min_ready=len(env_ids))
+            assert sorted(polled_ids) == list(env_ids)
+            for i, e in enumerate(polled_ids):
+                obs1, rews1, dones1, infos1 = single_envs[e].step(actions[:1])
+                assert np.allclose(obs1[0], obs[i])
+                assert np.allclose(rews1[0], rews[i]) and dones1[0] == dones[i]
+                assert infos1[0].get('episode', {}).get('l') == infos[i].get('episode', {}).get('l')
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize('channels', (1, 3))
+def test_frame_stack(channels):
+    """
+    Test that VecFrameStack stacks like rolling the stacked
+    observations by a frame and zeroing finished envs, and
+    leaves the observations it returned before alone.
+    """
+    num_envs, nstack = 4, 3
+    shape = (2, 2, channels)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env = VecFrameStack(DummyVecEnv(fns), nstack)
+    raw_env = DummyVecEnv(fns)
+    obs = env.reset()
+    expected = np.zeros((num_envs,) + shape[:-1] + (channels * nstack,), dtype='float32')
+    expected[..., -channels:] = raw_env.reset()
+    assert np.array_equal(obs, expected)
+    for step in range(10):
+        actions = np.full((num_envs,) + shape, step, dtype='float32')
+        prev_obs, prev_expected = obs, expected
+        obs, _, dones, _ = env.step(actions)
+        raw_obs, _, raw_dones, _ = raw_env.step(actions)
+        assert np.array_equal(dones, raw_dones) and dones.any()
+        expected = np.roll(expected, shift=-channels, axis=-1)
+        expected[dones] = 0
+        expected[..., -channels:] = raw_obs
+        assert np.array_equal(obs, expected)
+        assert np.array_equal(prev_obs, prev_expected)
+    env.close()
+
+
+def test_vec_normalize_stats(tmpdir):
+    """
+    Test that VecNormalize statistics can be saved, loaded,
+    reduced with MPI, and frozen for evaluation.
+    """
+    num_envs = 3
+    shape = (2,)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    actions = np.ones((num_envs,) + shape, dtype='float32')
+    env = VecNormalize(DummyVecEnv(fns))
+    mpi_env = VecNormalize(DummyVecEnv(fns), use_mpi=True)
+    for venv in (env, mpi_env):
+        venv.reset()
+        for _ in range(5):
+            venv.step(actions)
+    np.testing.assert_allclose(env.ob_rms.mean, mpi_env.ob_rms.mean)
+    np.testing.assert_allclose(env.ob_rms.var, mpi_env.ob_rms.var)
+    np.testing.assert_allclose(env.ret_rms.var, mpi_env.ret_rms.var)
+
+    path = str(tmpdir.join('stats'))
+    env.save_stats(path)
+    eval_env = VecNormalize(DummyVecEnv(fns), training=False)
+    eval_env.load_stats(path)
+    np.testing.assert_allclose(eval_env.ob_rms.mean, env.ob_rms.mean)
+    count = eval_env.ob_rms.count
+    obs = eval_env.reset()
+    for _ in range(5):
+        env.step(actions)
+        eval_env.step(actions)
+    assert eval_env.ob_rms.count == count
+    assert np.allclose(obs, (DummyVecEnv(fns).reset() - eval_env.ob_rms.mean) / np.sqrt(eval_env.ob_rms.var + eval_env.epsilon))
+
+
+@pytest.mark.parametrize('klass', (DummyVecEnv, SubprocVecEnv, ShmemVecEnv))
+def test_env_method(klass):
+    """
+    Test that env_method and get_attr reach the
+    environments in the requested order.
+    """
+    num_envs = 4
+    shape = (3,)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env = klass(fns, envs_per_worker=2) if klass is SubprocVecEnv else klass(fns)
+    try:
+        env.reset()
+        assert env.get_attr('_max_steps') == [1, 2, 3, 4]
+        assert env.get_attr('_max_steps', indices=[3, 0, 1]) == [4, 1, 2]
+        assert env.get_attr('_max_steps', indices=2) == [3]
+        start_obs = env.env_method('reset', indices=[2, 1])
+        assert np.array_equal(start_obs, [SimpleEnv(seed, shape, 'float32').reset() for seed in (2, 1)])
+        env.env_method('seed_steps', 7)
+        assert env.get_attr('_max_steps') == [7] * num_envs
+        obs, _, _, _ = env.step(np.zeros((num_envs,) + shape, dtype='float32'))
+        assert obs.shape == (num_envs,) + shape
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize('klass', (SubprocVecEnv, ShmemVecEnv))
+def test_env_method_errors(klass):
+    """
+    Test that errors of env_method and get_attr are raised
+    in the parent and leave the workers running.
+    """
+    num_envs = 4
+    shape = (3,)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env = klass(fns, envs_per_worker=2) if klass is SubprocVecEnv else klass(fns)
+    try:
+        env.reset()
+        assert not hasattr(env, 'save_db_experiments')
+        with pytest.raises(AttributeError):
+            env.env_method('save_db_experiments')
+        with pytest.raises(AttributeError):
+            env.get_attr('missing', indices=[1, 2])
+        with pytest.raises(TypeError):
+            env.env_method('seed_steps')
+        assert env.get_attr('_max_steps') == [1, 2, 3, 4]
+        obs, _, _, _ = env.step(np.zeros((num_envs,) + shape, dtype='float32'))
+        assert obs.shape == (num_envs,) + shape
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize('klass', (SubprocVecEnv, ShmemVecEnv))
+def test_worker_restart(klass, tmpdir):
+    """
+    Test that a worker that dies is respawned, and that its env
+    reports a done step with the reset observation.
+    """
+    num_envs = 3
+    shape = (2,)
+    marker = str(tmpdir.join('crashed'))
+    fns = [(lambda seed: lambda: CrashingEnv(seed, shape, marker if seed == 1 else None))(i) for i in range(num_envs)]
+    env = klass(fns, max_restarts=1)
+    try:
+        reset_obs = env.reset()
+        actions = np.ones((num_envs,) + shape, dtype='float32')
+        for t in range(5):
+            obs, rews, dones, infos = env.step(actions)
+            if t == CrashingEnv.crash_step:
+                assert dones[1] and rews[1] == 0 and infos[1] == {'worker_restarted': True}
+                assert np.allclose(obs[1], reset_obs[1])
+                assert env.num_restarts == 1
+            else:
+                assert not dones[1] and infos[1] == {}
+            assert not dones[0] and not dones[2]
+    finally:
+        env.close()
+
+    os.remove(marker)
+    env = klass(fns, max_restarts=0)
+    try:
+        env.reset()
+        with pytest.raises(EOFError):
+            for _ in range(5):
+                env.step(actions)
+    finally:
+        env.close()
+
+
+def test_shmem_worker_dies_when_idle():
+    """
+    Test that ShmemVecEnv does not wait for a worker that died after
+    finishing its command but before reporting it.
+    """
+    num_envs = 3
+    shape = (2,)
+    fns = [(lambda seed: lambda: SimpleEnv(seed, shape, 'float32'))(i) for i in range(num_envs)]
+    env = ShmemVecEnv(fns)
+    try:
+        env.reset()
+        env.procs[0].terminate()
+        env.procs[0].join()
+        # the other workers reset, worker 0 looks as if it had finished as well
+        env.cmd_buf[1:] = _RESET
+        for sem in env.start_sems[1:]:
+            sem.release()
+        env._wait()
+    finally:
+        env.close()
+
+
+def test_subproc_close_partially_built():
+    """
+    Test that a SubprocVecEnv whose __init__ failed can still be closed.
+    """
+    for env_fns, envs_per_worker, error in (([lambda: None], 0, AssertionError),
+                                            ([lambda: 1 / 0], 1, (EOFError, ConnectionError))):
+        env = SubprocVecEnv.__new__(SubprocVecEnv)
+        with pytest.raises(error):
+            env.__init__(env_fns, envs_per_worker=envs_per_worker)
+        env.close()
+        assert env.closed
+
+
 class SimpleEnv(gym.Env):
     """
     An environment with a pre-determined observation space
@@ -101,6 +391,9 @@ class SimpleEnv(gym.Env):
     def render(self, mode=None):
         raise NotImplementedError
 
+    def seed_steps(self, max_steps):
+        self._max_steps = max_steps
+
 
 
 @with_mpi()
@@ -112,3 +405,28 @@ def test_mpi_with_subprocvecenv():
     venv.close()
     assert ob.shape == (nenv,) + shape
 
+
+class CrashingEnv(gym.Env):
+    """
+    An environment that counts its steps and whose process dies at
+    step crash_step (once: the death is recorded in the marker file).
+    """
+    crash_step = 2
+
+    def __init__(self, seed, shape, marker):
+        self._marker = marker
+        self._shape = shape
+        self._cur_step = seed
+        self.action_space = gym.spaces.Box(low=0, high=0xFF, shape=shape, dtype='float32')
+        self.observation_space = self.action_space
+
+    def step(self, action):
+        if self._marker is not None and self._cur_step == self.crash_step and not os.path.exists(self._marker):
+            open(self._marker, 'w').close()
+            os._exit(1)
+        self._cur_step += 1
+        return np.full(self._shape, self._cur_step, dtype='float32'), 1.0, False, {}
+
+    def reset(self):
+        self._cur_step = 0
+        return np.zeros(self._shape, dtype='float32')
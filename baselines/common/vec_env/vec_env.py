@@ -83,6 +83,43 @@ class VecEnv(ABC):
         """
         pass
 
+    def poll(self, min_ready=1, timeout=None):
+        """
+        Wait for the partial steps started with step_async(actions, env_ids),
+        which steps only the envs in env_ids, so that slow envs do not hold back
+        the others. Supported by DummyVecEnv, SubprocVecEnv, ShmemVecEnv and the
+        wrappers that implement poll (see check_partial_steps).
+
+        Returns (env_ids, obs, rews, dones, infos) for the envs that finished
+        (at least min_ready of them unless timeout seconds passed), with the
+        other values in the format of step_wait().
+        """
+        raise NotImplementedError
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """
+        Call method_name(*method_args, **method_kwargs) on the environments in indices
+        (an int, a sequence of ints or None for all of them) and return the list of
+        the results. Environments that run in different processes are called in parallel.
+        Errors raised by the environments are raised again here.
+        """
+        raise NotImplementedError
+
+    def get_attr(self, attr_name, indices=None):
+        """
+        Return the list of the values of the attribute attr_name of the
+        environments in indices (an int, a sequence of ints or None for all of them).
+        Errors raised by the environments (eg. AttributeError) are raised again here.
+        """
+        raise NotImplementedError
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return list(range(self.num_envs))
+        if isinstance(indices, int):
+            return [indices]
+        return list(indices)
+
     def close_extras(self):
         """
         Clean up the  extra resources, beyond what's in this base class.
@@ -150,8 +187,11 @@ class VecEnvWrapper(VecEnv):
                         observation_space=observation_space or venv.observation_space,
                         action_space=action_space or venv.action_space)
 
-    def step_async(self, actions):
-        self.venv.step_async(actions)
+    def step_async(self, actions, env_ids=None):
+        if env_ids is None:
+            self.venv.step_async(actions)
+        else:
+            self.venv.step_async(actions, env_ids)
 
     @abstractmethod
     def reset(self):
@@ -170,6 +210,12 @@ class VecEnvWrapper(VecEnv):
     def get_images(self):
         return self.venv.get_images()
 
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self.venv.env_method(method_name, *method_args, indices=indices, **method_kwargs)
+
+    def get_attr(self, attr_name, indices=None):
+        return self.venv.get_attr(attr_name, indices=indices)
+
 class VecEnvObservationWrapper(VecEnvWrapper):
     @abstractmethod
     def process(self, obs):
@@ -183,6 +229,22 @@ class VecEnvObservationWrapper(VecEnvWrapper):
         obs, rews, dones, infos = self.venv.step_wait()
         return self.process(obs), rews, dones, infos
 
+    def poll(self, min_ready=1, timeout=None):
+        env_ids, obs, rews, dones, infos = self.venv.poll(min_ready=min_ready, timeout=timeout)
+        return env_ids, None if obs is None else self.process(obs), rews, dones, infos
+
+def check_partial_steps(venv):
+    """
+    Raise NotImplementedError unless venv and all the VecEnvs it wraps implement the
+    partial steps of step_async(actions, env_ids) and poll(), so that runners that need
+    them fail when they are built rather than in the middle of a rollout.
+    """
+    while venv is not None:
+        if type(venv).poll is VecEnv.poll:
+            raise NotImplementedError('{} does not support partial steps with step_async(actions, env_ids) '
+                                      'and poll()'.format(type(venv).__name__))
+        venv = getattr(venv, 'venv', None)
+
 class CloudpickleWrapper(object):
     """
     Uses cloudpickle to serialize contents (otherwise multiprocessing tries to use pickle)
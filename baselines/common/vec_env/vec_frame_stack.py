@@ -4,6 +4,12 @@ from gym import spaces
 
 
 class VecFrameStack(VecEnvWrapper):
+    """
+    Stacks the last nstack observations of every env along the last axis.
+
+    The frames are kept in a ring buffer, so that a step only writes the newest one, and are
+    gathered in order into a new array for every step, which is also kept as stackedobs.
+    """
     def __init__(self, venv, nstack):
         self.venv = venv
         self.nstack = nstack
@@ -11,20 +17,66 @@ class VecFrameStack(VecEnvWrapper):
         low = np.repeat(wos.low, self.nstack, axis=-1)
         high = np.repeat(wos.high, self.nstack, axis=-1)
         self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        # last nstack frames of every env, the newest one of env e at index self.newest[e]; the
+        # envs only drift apart when they are stepped separately with poll()
+        self.frames = np.zeros((nstack, venv.num_envs) + wos.shape, low.dtype)
+        self.newest = np.full(venv.num_envs, nstack - 1)
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.stackedobs = np.roll(self.stackedobs, shift=-1, axis=-1)
-        for (i, new) in enumerate(news):
-            if new:
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
+        self._push(slice(None), obs, news)
+        self.stackedobs = self._stack()
         return self.stackedobs, rews, news, infos
 
+    def poll(self, min_ready=1, timeout=None):
+        env_ids, obs, rews, news, infos = self.venv.poll(min_ready=min_ready, timeout=timeout)
+        if obs is not None:
+            self._push(env_ids, obs, news)
+            obs = self._stack(env_ids)
+        return env_ids, obs, rews, news, infos
+
     def reset(self):
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
+        self.frames[...] = 0
+        self.newest[:] = self.nstack - 1
+        self.frames[-1] = obs
+        self.stackedobs = self._stack()
         return self.stackedobs
+
+    def _slots(self, env_ids):
+        """
+        Slots of the newest frames of env_ids (a slice or an array of env ids) and the envs to
+        pair them with when indexing frames; envs stepped together share their slot, which
+        spares a gather.
+        """
+        newest = self.newest[env_ids]
+        if np.all(newest == newest[0]):
+            return newest[0], env_ids
+        return newest, np.arange(self.num_envs)[env_ids]
+
+    def _push(self, env_ids, obs, news):
+        self.newest[env_ids] = (self.newest[env_ids] + 1) % self.nstack
+        self.frames[:, np.arange(self.num_envs)[env_ids][np.asarray(news, dtype=np.bool)]] = 0
+        newest, envs = self._slots(env_ids)
+        self.frames[newest, envs] = obs
+
+    def _stack(self, env_ids=None):
+        """
+        Gather the frames of env_ids (by default all envs) oldest first into a new array.
+        """
+        if env_ids is None:
+            nenvs, env_ids = self.num_envs, slice(None)
+        else:
+            nenvs = len(env_ids)
+        newest, envs = self._slots(env_ids)
+        nc = self.frames.shape[-1]
+        stacked = np.empty((nenvs,) + self.stackedobs.shape[1:], self.stackedobs.dtype)
+        for k in range(self.nstack):
+            # oldest frame first, a channel at a time: numpy copies strided single values much
+            # faster than strided runs of a few of them
+            slot = (newest + 1 + k) % self.nstack
+            for c in range(nc):
+                stacked[..., k * nc + c] = self.frames[slot, envs, ..., c]
+        return stacked
@@ -28,12 +28,20 @@ class VecMonitor(VecEnvWrapper):
 
     def step_wait(self):
         obs, rews, dones, infos = self.venv.step_wait()
-        self.eprets += rews
-        self.eplens += 1
+        return obs, rews, dones, self._record(np.arange(self.num_envs), rews, dones, infos)
+
+    def poll(self, min_ready=1, timeout=None):
+        env_ids, obs, rews, dones, infos = self.venv.poll(min_ready=min_ready, timeout=timeout)
+        return env_ids, obs, rews, dones, tuple(self._record(env_ids, rews, dones, infos))
+
+    def _record(self, env_ids, rews, dones, infos):
+        self.eprets[env_ids] += rews
+        self.eplens[env_ids] += 1
         newinfos = []
-        for (i, (done, ret, eplen, info)) in enumerate(zip(dones, self.eprets, self.eplens, infos)):
+        for (i, done, info) in zip(env_ids, dones, infos):
             info = info.copy()
             if done:
+                ret, eplen = self.eprets[i], self.eplens[i]
                 epinfo = {'r': ret, 'l': eplen, 't': round(time.time() - self.tstart, 6)}
                 info['episode'] = epinfo
                 if self.keep_buf:
@@ -45,5 +53,4 @@ class VecMonitor(VecEnvWrapper):
                 if self.results_writer:
                     self.results_writer.write_row(epinfo)
             newinfos.append(info)
-
-        return obs, rews, dones, newinfos
+        return newinfos
@@ -1,6 +1,7 @@
 from . import VecEnvWrapper
 from baselines.common.running_mean_std import RunningMeanStd
 import numpy as np
+import pickle
 
 
 class VecNormalize(VecEnvWrapper):
@@ -9,35 +10,98 @@ class VecNormalize(VecEnvWrapper):
     and returns from an environment.
     """
 
-    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8):
+    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8,
+                 use_mpi=False, training=True, merge_every=1):
+        """
+        use_mpi: update the statistics with the observations and returns of all MPI workers,
+                 which then all normalize alike. The workers have to step their envs in lockstep.
+        training: update the statistics; set it to False to evaluate with frozen statistics.
+        merge_every: accumulate the sums of the observations and returns of that many steps before
+                     merging them into the statistics (see RunningMeanStd); the normalization then
+                     uses statistics that are up to merge_every steps old.
+        """
         VecEnvWrapper.__init__(self, venv)
-        self.ob_rms = RunningMeanStd(shape=self.observation_space.shape) if ob else None
-        self.ret_rms = RunningMeanStd(shape=()) if ret else None
+        self.ob_rms = RunningMeanStd(shape=self.observation_space.shape, merge_every=merge_every) if ob else None
+        self.ret_rms = RunningMeanStd(shape=(), merge_every=merge_every) if ret else None
         self.clipob = clipob
         self.cliprew = cliprew
         self.ret = np.zeros(self.num_envs)
         self.gamma = gamma
         self.epsilon = epsilon
+        self.use_mpi = use_mpi
+        self.training = training
 
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.ret = self.ret * self.gamma + rews
+        obs, rews = self._filter_step(slice(None), obs, rews, news)
+        return obs, rews, news, infos
+
+    def poll(self, min_ready=1, timeout=None):
+        env_ids, obs, rews, news, infos = self.venv.poll(min_ready=min_ready, timeout=timeout)
+        if obs is not None:
+            obs, rews = self._filter_step(env_ids, obs, rews, news)
+        return env_ids, obs, rews, news, infos
+
+    def _filter_step(self, env_ids, obs, rews, news):
+        """Normalize the observations and rewards of a step of the envs in env_ids"""
+        ret = self.ret[env_ids] * self.gamma + rews
         obs = self._obfilt(obs)
         if self.ret_rms:
-            self.ret_rms.update(self.ret)
+            if self.training:
+                self._update(self.ret_rms, ret)
             rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
-        self.ret[news] = 0.
-        return obs, rews, news, infos
+        ret[news] = 0.
+        self.ret[env_ids] = ret
+        return obs, rews
 
     def _obfilt(self, obs):
         if self.ob_rms:
-            self.ob_rms.update(obs)
+            if self.training:
+                self._update(self.ob_rms, obs)
             obs = np.clip((obs - self.ob_rms.mean) / np.sqrt(self.ob_rms.var + self.epsilon), -self.clipob, self.clipob)
             return obs
         else:
             return obs
 
+    def _update(self, rms, x):
+        if not self.use_mpi:
+            rms.update(x)
+            return
+        from baselines.common.mpi_running_mean_std import mpi_sums
+        xsum, xsumsq, count = mpi_sums(x, rms.mean.shape)
+        mean = xsum / count
+        rms.update_from_moments(mean, np.maximum(xsumsq / count - np.square(mean), 0.), count)
+
     def reset(self):
         self.ret = np.zeros(self.num_envs)
         obs = self.venv.reset()
         return self._obfilt(obs)
+
+    def save_stats(self, path):
+        """
+        Save the observation and return statistics to path.
+        """
+        for rms in (self.ob_rms, self.ret_rms):
+            if rms is not None:
+                rms.flush()
+        with open(path, 'wb') as f:
+            pickle.dump({'ob_rms': self.ob_rms, 'ret_rms': self.ret_rms}, f)
+
+    def load_stats(self, path):
+        """
+        Load the observation and return statistics saved with save_stats.
+        """
+        with open(path, 'rb') as f:
+            stats = pickle.load(f)
+        self.ob_rms, self.ret_rms = stats['ob_rms'], stats['ret_rms']
+
+
+def find_vec_normalize(venv):
+    """
+    Return the VecNormalize wrapper among the wrappers of venv, or None.
+    """
+    while venv is not None:
+        if isinstance(venv, VecNormalize):
+            return venv
+        venv = getattr(venv, 'venv', None)
+    return None
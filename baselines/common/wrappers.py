@@ -1,4 +1,11 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
 import gym
+import numpy as np
 
 class TimeLimit(gym.Wrapper):
     def __init__(self, env, max_episode_steps=None):
@@ -16,4 +23,131 @@ class TimeLimit(gym.Wrapper):
 
     def reset(self, **kwargs):
         self._elapsed_steps = 0
-        return self.env.reset(**kwargs)
\ No newline at end of file
+        return self.env.reset(**kwargs)
+
+class StepCache(gym.Wrapper):
+    """
+    Memoize the steps of an expensive deterministic env, such as NASGym, whose steps train and
+    evaluate a network.
+
+    The result (observation, reward, done, info) of every step is stored in an SQLite database
+    at path, which the envs of all the workers share, under a hash of either the observation the
+    step started from and the action (key='state'), or the actions taken since the reset
+    (key='actions'). A step whose key is in the database returns the stored result without
+    stepping the env. At most max_entries results are kept, the least recently used ones are
+    dropped first. The uses of cached results are written to the database, which then takes the
+    write lock shared by all the workers, touch_batch at a time or with the next new result.
+    info['step_cache_hit'] tells whether the result of a step came from the cache.
+
+    After a cache hit the env lags behind the observations returned; before the next step that
+    misses, it is brought up to date with set_state, a function(env, observation) or the name of
+    a method of the unwrapped env that takes the observation. Without set_state the env is
+    stepped again through all the actions it missed, so that for an env like NASGym a miss after
+    a run of hits costs as much as the steps the hits saved: the cache then only saves the
+    episodes (or the ends of episodes) that are served from it entirely.
+    """
+    def __init__(self, env, path, max_entries=100000, key='state', set_state=None, touch_batch=100):
+        super(StepCache, self).__init__(env)
+        assert key in ('state', 'actions')
+        self.path = path
+        self.max_entries = max_entries
+        self.key = key
+        if isinstance(set_state, str):
+            method = set_state
+            set_state = lambda env, obs: getattr(env.unwrapped, method)(obs)
+        self.set_state = set_state
+        self.touch_batch = touch_batch
+        # time of the last use of the keys of the hits that are not written to the database yet
+        self.touched = {}
+        self.namespace = env.spec.id if env.spec is not None else ''
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+        self.obs = None
+        self.actions = []
+        self.missed_actions = []
+
+    def reset(self, **kwargs):
+        self.obs = self.env.reset(**kwargs)
+        self.actions = []
+        self.missed_actions = []
+        return self.obs
+
+    def step(self, action):
+        self.actions.append(action)
+        key = self._key(action)
+        result = self._get(key)
+        hit = result is not None
+        if hit:
+            self.hits += 1
+            self.missed_actions.append(action)
+        else:
+            self.misses += 1
+            self._catch_up()
+            result = self.env.step(action)
+            self._put(key, result)
+        self.obs, reward, done, info = result
+        info = dict(info, step_cache_hit=hit)
+        return self.obs, reward, done, info
+
+    def close(self):
+        if self.db is not None:
+            with self.db:
+                self._write_touches(self.db)
+            self.db.close()
+            self.db = None
+        return self.env.close()
+
+    def _key(self, action):
+        h = hashlib.sha1(self.namespace.encode())
+        for x in ([self.obs, action] if self.key == 'state' else self.actions):
+            x = np.ascontiguousarray(x)
+            assert x.dtype != np.object, 'StepCache needs array observations and actions'
+            h.update(str((x.dtype.str, x.shape)).encode())
+            h.update(x.tobytes())
+        return h.hexdigest()
+
+    def _catch_up(self):
+        if not self.missed_actions:
+            return
+        if self.set_state is not None:
+            self.set_state(self.env, self.obs)
+        else:
+            for action in self.missed_actions:
+                self.env.step(action)
+        self.missed_actions = []
+
+    def _connect(self):
+        # opened lazily, so that every worker process has its own connection
+        if self.db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.db = sqlite3.connect(self.path, timeout=600)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS steps (key TEXT PRIMARY KEY, result BLOB, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS steps_used ON steps (used)')
+        return self.db
+
+    def _get(self, key):
+        db = self._connect()
+        row = db.execute('SELECT result FROM steps WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.touch_batch:
+            with db:
+                self._write_touches(db)
+        return pickle.loads(row[0])
+
+    def _put(self, key, result):
+        db = self._connect()
+        with db:
+            self._write_touches(db)
+            db.execute('INSERT OR REPLACE INTO steps VALUES (?, ?, ?)',
+                       (key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+            db.execute('DELETE FROM steps WHERE key IN '
+                       '(SELECT key FROM steps ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def _write_touches(self, db):
+        if self.touched:
+            db.executemany('UPDATE steps SET used = ? WHERE key = ?', [(t, k) for k, t in self.touched.items()])
+            self.touched = {}
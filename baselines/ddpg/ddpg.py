@@ -42,6 +42,7 @@ def learn(network, env,
           tau=0.01,
           eval_env=None,
           param_noise_adaption_interval=50,
+          memory_storage_dir=None,
           **network_kwargs):
 
     set_global_seeds(seed)
@@ -60,7 +61,10 @@ def learn(network, env,
     nb_actions = env.action_space.shape[-1]
     assert (np.abs(env.action_space.low) == env.action_space.high).all()  # we assume symmetric actions.
 
-    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape)
+    if memory_storage_dir is not None and MPI is not None and MPI.COMM_WORLD.Get_size() > 1:
+        memory_storage_dir = os.path.join(memory_storage_dir, 'rank{}'.format(rank))
+    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape,
+                    storage_dir=memory_storage_dir)
     critic = Critic(network=network, **network_kwargs)
     actor = Actor(nb_actions, network=network, **network_kwargs)
 
@@ -133,14 +137,16 @@ def learn(network, env,
                 agent.reset()
             for t_rollout in range(nb_rollout_steps):
                 # Predict next action.
-                action, q, _, _ = agent.step(obs, apply_noise=True, compute_Q=True)
+                with logger.timer('inference'):
+                    action, q, _, _ = agent.step(obs, apply_noise=True, compute_Q=True)
 
                 # Execute next action.
                 if rank == 0 and render:
                     env.render()
 
                 # max_action is of dimension A, whereas action is dimension (nenvs, A) - the multiplication gets broadcasted to the batch
-                new_obs, r, done, info = env.step(max_action * action)  # scale for execution in env (as far as DDPG is concerned, every action is in [-1, 1])
+                with logger.timer('env_step'):
+                    new_obs, r, done, info = env.step(max_action * action)  # scale for execution in env (as far as DDPG is concerned, every action is in [-1, 1])
                 # note these outputs are batched from vecenv
 
                 t += 1
@@ -181,7 +187,9 @@ def learn(network, env,
                     distance = agent.adapt_param_noise()
                     epoch_adaptive_distances.append(distance)
 
-                cl, al = agent.train()
+                # includes the 'sample' phase
+                with logger.timer('train'):
+                    cl, al = agent.train()
                 epoch_critic_losses.append(cl)
                 epoch_actor_losses.append(al)
                 agent.update_target_net()
@@ -258,7 +266,8 @@ def learn(network, env,
             logger.record_tabular(key, combined_stats[key])
 
         if rank == 0:
-            logger.dump_tabular()
+            with logger.timer('logging'):
+                logger.dump_tabular()
         logger.info('')
         logdir = logger.get_dir()
         if rank == 0 and logdir:
@@ -268,6 +277,7 @@ def learn(network, env,
             if eval_env and hasattr(eval_env, 'get_state'):
                 with open(os.path.join(logdir, 'eval_env_state.pkl'), 'wb') as f:
                     pickle.dump(eval_env.get_state(), f)
+        memory.flush()
 
 
     return agent
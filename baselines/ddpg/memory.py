@@ -1,12 +1,21 @@
+import os
+
 import numpy as np
 
+from baselines.common.memmap_util import open_memmap, save_state, load_state
+from baselines.common.misc_util import relatively_safe_arrays_dump
+
 
 class RingBuffer(object):
-    def __init__(self, maxlen, shape, dtype='float32'):
+    def __init__(self, maxlen, shape, dtype='float32', path=None):
         self.maxlen = maxlen
         self.start = 0
         self.length = 0
-        self.data = np.zeros((maxlen,) + shape).astype(dtype)
+        if path is not None:
+            # disk-backed storage, see baselines.common.memmap_util
+            self.data = open_memmap(path, (maxlen,) + shape, dtype)
+        else:
+            self.data = np.zeros((maxlen,) + shape).astype(dtype)
 
     def __len__(self):
         return self.length
@@ -40,14 +49,52 @@ def array_min2d(x):
 
 
 class Memory(object):
-    def __init__(self, limit, action_shape, observation_shape):
+    _buffer_names = ('observations0', 'actions', 'rewards', 'terminals1', 'observations1')
+
+    def __init__(self, limit, action_shape, observation_shape, storage_dir=None):
         self.limit = limit
+        self.storage_dir = storage_dir
+
+        def path(name):
+            return os.path.join(storage_dir, name + '.npy') if storage_dir is not None else None
 
-        self.observations0 = RingBuffer(limit, shape=observation_shape)
-        self.actions = RingBuffer(limit, shape=action_shape)
-        self.rewards = RingBuffer(limit, shape=(1,))
-        self.terminals1 = RingBuffer(limit, shape=(1,))
-        self.observations1 = RingBuffer(limit, shape=observation_shape)
+        self.observations0 = RingBuffer(limit, shape=observation_shape, path=path('observations0'))
+        self.actions = RingBuffer(limit, shape=action_shape, path=path('actions'))
+        self.rewards = RingBuffer(limit, shape=(1,), path=path('rewards'))
+        self.terminals1 = RingBuffer(limit, shape=(1,), path=path('terminals1'))
+        self.observations1 = RingBuffer(limit, shape=observation_shape, path=path('observations1'))
+
+        # resume from a memory previously flushed to storage_dir
+        state = load_state(storage_dir) if storage_dir is not None else None
+        if state is not None:
+            for buf in self._buffers():
+                buf.start, buf.length = state['start'], state['length']
+
+    def _buffers(self):
+        return [getattr(self, name) for name in self._buffer_names]
+
+    def flush(self):
+        """Write the memory to storage_dir so that it can be reopened later"""
+        if self.storage_dir is None:
+            return
+        state = {'start': self.observations0.start, 'length': self.observations0.length}
+        save_state(self.storage_dir, state, [buf.data for buf in self._buffers()])
+
+    def save(self, path, compression=False):
+        """Save the stored transitions to an .npz file (one raw array block per buffer)"""
+        idxs = np.arange(self.nb_entries)
+        arrays = {name: buf.get_batch(idxs) for name, buf in zip(self._buffer_names, self._buffers())}
+        arrays['limit'] = self.limit
+        relatively_safe_arrays_dump(arrays, path, compression=compression)
+
+    def load(self, path):
+        """Restore the transitions saved with `save`"""
+        with np.load(path) as data:
+            assert int(data['limit']) == self.limit, "saved memory has a different limit"
+            for name, buf in zip(self._buffer_names, self._buffers()):
+                values = data[name]
+                buf.start, buf.length = 0, len(values)
+                buf.data[:len(values)] = values
 
     def sample(self, batch_size):
         # Draw such that we always have a proceeding element.
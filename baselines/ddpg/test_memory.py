@@ -0,0 +1,31 @@
+import numpy as np
+
+from baselines.ddpg.memory import Memory
+
+
+def test_ddpg_memory_resume(tmpdir):
+    storage_dir = str(tmpdir)
+    memory = Memory(8, action_shape=(2,), observation_shape=(3,), storage_dir=storage_dir)
+    for i in range(11):
+        memory.append(np.full(3, i), np.full(2, i), i, np.full(3, i + 1), 0.)
+    memory.flush()
+
+    resumed = Memory(8, action_shape=(2,), observation_shape=(3,), storage_dir=storage_dir)
+    assert resumed.nb_entries == memory.nb_entries == 8
+    np.testing.assert_array_equal(resumed.rewards.get_batch(np.arange(8)), memory.rewards.get_batch(np.arange(8)))
+    assert resumed.rewards[0] == 3
+
+
+def test_ddpg_memory_save_load(tmpdir):
+    path = str(tmpdir.join('memory.npz'))
+    memory = Memory(8, action_shape=(2,), observation_shape=(3,))
+    for i in range(11):
+        memory.append(np.full(3, i), np.full(2, i), i, np.full(3, i + 1), 0.)
+    memory.save(path)
+
+    restored = Memory(8, action_shape=(2,), observation_shape=(3,))
+    restored.load(path)
+    assert restored.nb_entries == 8
+    for name in Memory._buffer_names:
+        np.testing.assert_array_equal(getattr(restored, name).get_batch(np.arange(8)),
+                                      getattr(memory, name).get_batch(np.arange(8)))
@@ -5,16 +5,16 @@ import tensorflow as tf
 import zipfile
 import cloudpickle
 import numpy as np
-import pandas as pd
 
 import baselines.common.tf_util as U
 from baselines.common.tf_util import load_variables, save_variables
 from baselines import logger
 from baselines.common.schedules import LinearSchedule
 from baselines.common import set_global_seeds
+from baselines.common.episode_log import EpisodeLog
 
 from baselines import deepq
-from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, FrameStackReplayBuffer, ReplayPrefetcher
 from baselines.deepq.utils import ObservationInput
 
 from baselines.common.tf_util import get_session
@@ -114,6 +114,11 @@ def learn(env,
           prioritized_replay_beta0=0.4,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
+          columnar_replay=False,
+          replay_frame_stack=None,
+          replay_prefetch=0,
+          replay_storage_dir=None,
+          n_step=1,
           param_noise=False,
           callback=None,
           load_path=None,
@@ -153,6 +158,9 @@ def learn(env,
         how often to save the model. This is so that the best version is restored
         at the end of the training. If you do not wish to restore the best version at
         the end of the training set this variable to None.
+    checkpoint_path: str
+        directory for the checkpoints. If set, the replay buffer is saved along with the
+        model, and both are restored when training is resumed from this directory.
     learning_starts: int
         how many steps of the model to collect transitions for before learning starts
     gamma: float
@@ -170,6 +178,23 @@ def learn(env,
         to 1.0. If set to None equals to total_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    columnar_replay: bool
+        if True the replay buffer stores transitions in preallocated typed arrays, which makes
+        sampling much cheaper at the cost of allocating the whole buffer upfront.
+    replay_frame_stack: int
+        number of frames stacked along the last axis of the observations (4 for
+        wrap_deepmind(frame_stack=True)). If set, the replay buffer stores every frame only once
+        and rebuilds the stacks at sample time. Cannot be combined with prioritized_replay.
+    replay_prefetch: int
+        number of minibatches to sample ahead in a background thread, overlapping replay sampling
+        with the training step. Priority updates are then applied asynchronously. 0 disables it.
+    replay_storage_dir: str
+        directory in which the replay buffer is kept as memory-mapped files, for buffers larger
+        than RAM. The buffer is flushed with every checkpoint, and an existing buffer in this
+        directory is reopened. Not supported with replay_frame_stack.
+    n_step: int
+        number of steps of the returns used as targets. The n-step returns are computed by the
+        replay buffer at sample time and truncated at the end of episodes.
     param_noise: bool
         whether or not to use parameter space noise (https://arxiv.org/abs/1706.01905)
     callback: (locals, globals) -> None
@@ -213,7 +238,8 @@ def learn(env,
         q_func=q_func,
         num_actions=env.action_space.n,
         optimizer=tf.train.AdamOptimizer(learning_rate=lr),
-        gamma=gamma,
+        # the replay buffer returns n-step returns, bootstrap from n steps ahead
+        gamma=gamma ** n_step,
         grad_norm_clipping=10,
         param_noise=param_noise
     )
@@ -227,16 +253,30 @@ def learn(env,
     act = ActWrapper(act, act_params)
 
     # Create the replay buffer
+    assert not (prioritized_replay and replay_frame_stack is not None), \
+        "replay_frame_stack is not supported with prioritized_replay"
+    assert not (replay_storage_dir and replay_frame_stack is not None), \
+        "replay_frame_stack is not supported with replay_storage_dir"
+    assert not (n_step > 1 and replay_frame_stack is not None), \
+        "replay_frame_stack is not supported with n_step > 1"
     if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha,
+                                                columnar=columnar_replay, storage_dir=replay_storage_dir,
+                                                n_step=n_step, gamma=gamma)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = total_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
+    elif replay_frame_stack is not None:
+        replay_buffer = FrameStackReplayBuffer(buffer_size, frame_stack=replay_frame_stack)
+        beta_schedule = None
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, columnar=columnar_replay, storage_dir=replay_storage_dir,
+                                     n_step=n_step, gamma=gamma)
         beta_schedule = None
+    if replay_prefetch > 0:
+        replay_buffer = ReplayPrefetcher(replay_buffer, num_batches=replay_prefetch)
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * total_timesteps),
                                  initial_p=1.0,
@@ -255,12 +295,20 @@ def learn(env,
         td = checkpoint_path or td
 
         model_file = os.path.join(td, "model")
+        replay_buffer_file = os.path.join(td, "replay_buffer.npz")
         model_saved = False
 
-        if tf.train.latest_checkpoint(td) is not None:
+        # save_variables writes a plain file rather than a tf checkpoint
+        if tf.train.latest_checkpoint(td) is not None or os.path.exists(model_file):
             load_variables(model_file)
             logger.log('Loaded model from {}'.format(model_file))
             model_saved = True
+            if os.path.exists(replay_buffer_file):
+                replay_buffer.load(replay_buffer_file)
+                logger.log('Loaded {} transitions from {}'.format(len(replay_buffer), replay_buffer_file))
+                if len(replay_buffer) >= learning_starts:
+                    # the restored buffer is already warm, start learning right away
+                    learning_starts = 0
         elif load_path is not None:
             load_variables(load_path)
             logger.log('Loaded model from {}'.format(load_path))
@@ -272,12 +320,10 @@ def learn(env,
         os.makedirs(episode_log_dir, exist_ok=True)
 
         # Save trial log
-        episode_log_path = "{dir}/{name}.csv".format(
+        episode_log = EpisodeLog("{dir}/{name}.csv".format(
             dir=episode_log_dir,
             name="episodes_results"
-        )
-
-        episode_df = None
+        ))
 
         for t in range(total_timesteps):
             if callback is not None:
@@ -298,18 +344,14 @@ def learn(env,
                 kwargs['reset'] = reset
                 kwargs['update_param_noise_threshold'] = update_param_noise_threshold
                 kwargs['update_param_noise_scale'] = True
-            action = act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
+            with logger.timer('inference'):
+                action = act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
             env_action = action
             reset = False
-            new_obs, rew, done, info_dict = env.step(env_action)
+            with logger.timer('env_step'):
+                new_obs, rew, done, info_dict = env.step(env_action)
 
-            if episode_df is None:
-                headers = info_dict[0].keys()
-                episode_df = pd.DataFrame(columns=headers)
-
-            episode_df = episode_df.append(
-                info_dict, ignore_index=True
-            )
+            episode_log.append(info_dict)
 
             # Store transition in the replay buffer.
             replay_buffer.add(obs, action, rew, new_obs, float(done))
@@ -323,13 +365,16 @@ def learn(env,
 
             if t > learning_starts and t % train_freq == 0:
                 # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
-                if prioritized_replay:
-                    experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
-                    (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
-                else:
-                    obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
-                    weights, batch_idxes = np.ones_like(rewards), None
-                td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
+                with logger.timer('sample'):
+                    if prioritized_replay:
+                        experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t),
+                                                          weights_dtype=np.float32)
+                        (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+                    else:
+                        obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
+                        weights, batch_idxes = np.ones_like(rewards), None
+                with logger.timer('train'):
+                    td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
                 if prioritized_replay:
                     new_priorities = np.abs(td_errors) + prioritized_replay_eps
                     replay_buffer.update_priorities(batch_idxes, new_priorities)
@@ -345,7 +390,8 @@ def learn(env,
                 logger.record_tabular("episodes", num_episodes)
                 logger.record_tabular("mean 100 episode reward", mean_100ep_reward)
                 logger.record_tabular("% time spent exploring", int(100 * exploration.value(t)))
-                logger.dump_tabular()
+                with logger.timer('logging'):
+                    logger.dump_tabular()
 
             if (checkpoint_freq is not None and t > learning_starts and
                     num_episodes > 100 and t % checkpoint_freq == 0):
@@ -356,28 +402,28 @@ def learn(env,
                     save_variables(model_file)
                     model_saved = True
                     saved_mean_reward = mean_100ep_reward
+                replay_buffer.flush()
+                if checkpoint_path is not None:
+                    replay_buffer.save(replay_buffer_file)
                 # Save the episode logs
-                if episode_df is not None:
-                    outfile = open(episode_log_path, 'w')
-                    logger.log("Saving episode logs")
-                    episode_df.to_csv(outfile)
-                    outfile.close()
-                    # episode_df = None
+                logger.log("Saving episode logs")
+                episode_log.flush()
                 # Save the DB of experiments
                 if hasattr(env, 'save_db_experiments'):
                     logger.log("Saving database of experiments")
                     env.save_db_experiments()
 
-        if episode_df is not None:
-            outfile = open(episode_log_path, 'w')
-            logger.log("Saving episode logs")
-            episode_df.to_csv(outfile)
-            outfile.close()
+        logger.log("Saving episode logs")
+        episode_log.close()
         # Save the DB of experiments
         if hasattr(env, 'save_db_experiments'):
             logger.log("Saving database of experiments")
             env.save_db_experiments()
 
+        if replay_prefetch > 0:
+            replay_buffer.close()
+        replay_buffer.flush()
+
         if model_saved:
             if print_freq is not None:
                 logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
@@ -0,0 +1,43 @@
+import argparse
+import time
+
+import numpy as np
+
+from baselines.deepq.replay_buffer import ReplayBuffer
+
+
+def fill(buffer, num_transitions, obs_shape):
+    for i in range(num_transitions):
+        # fresh arrays for every transition, as returned by a real env
+        obs_t = np.full(obs_shape, i % 256, dtype=np.uint8)
+        obs_tp1 = np.full(obs_shape, (i + 1) % 256, dtype=np.uint8)
+        buffer.add(obs_t, i % 4, 1.0, obs_tp1, 0.0)
+
+
+def time_sampling(buffer, batch_size, num_samples):
+    tstart = time.time()
+    for _ in range(num_samples):
+        buffer.sample(batch_size)
+    return (time.time() - tstart) / num_samples
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-samples', type=int, default=1000)
+    parser.add_argument('--obs-shape', type=int, nargs='+', default=[84, 84, 4])
+    args = parser.parse_args()
+
+    for columnar in (False, True):
+        buffer = ReplayBuffer(args.size, columnar=columnar)
+        tstart = time.time()
+        fill(buffer, args.size, tuple(args.obs_shape))
+        add_time = (time.time() - tstart) / args.size
+        sample_time = time_sampling(buffer, args.batch_size, args.num_samples)
+        print('columnar={}: add {:.2f} us/transition, sample {:.3f} ms/batch'.format(
+            columnar, add_time * 1e6, sample_time * 1e3))
+
+
+if __name__ == '__main__':
+    main()
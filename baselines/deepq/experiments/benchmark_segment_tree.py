@@ -0,0 +1,46 @@
+import argparse
+import time
+
+import numpy as np
+
+from baselines.common.segment_tree import SumSegmentTree
+
+
+def time_loop(tree, idxs, vals, prefixsums, repeats):
+    tstart = time.time()
+    for _ in range(repeats):
+        for idx, val in zip(idxs, vals):
+            tree[idx] = val
+        [tree.find_prefixsum_idx(p) for p in prefixsums]
+    return (time.time() - tstart) / repeats
+
+
+def time_batch(tree, idxs, vals, prefixsums, repeats):
+    tstart = time.time()
+    for _ in range(repeats):
+        tree.set_batch(idxs, vals)
+        tree.find_prefixsum_idx_batch(prefixsums)
+    return (time.time() - tstart) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--capacity', type=int, default=2 ** 20)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 256, 1024])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    tree = SumSegmentTree(args.capacity)
+    tree.set_batch(np.arange(args.capacity), np.random.rand(args.capacity))
+    for batch_size in args.batch_sizes:
+        idxs = np.random.randint(0, args.capacity, size=batch_size)
+        vals = np.random.rand(batch_size)
+        prefixsums = np.random.rand(batch_size) * tree.sum()
+        loop_time = time_loop(tree, idxs, vals, prefixsums, args.repeats)
+        batch_time = time_batch(tree, idxs, vals, prefixsums, args.repeats)
+        print('batch_size={}: per-element {:.3f} ms, batched {:.3f} ms, speedup {:.1f}x'.format(
+            batch_size, loop_time * 1e3, batch_time * 1e3, loop_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 import numpy as np
+import os
+import queue
 import random
+import threading
+from collections import deque
 
+from baselines.common.memmap_util import open_memmap, save_state, load_state
+from baselines.common.misc_util import ArrayChunks, relatively_safe_arrays_dump
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
 
 class ReplayBuffer(object):
-    def __init__(self, size):
+    _fields = ('obs_t', 'action', 'reward', 'obs_tp1', 'done')
+
+    def __init__(self, size, columnar=False, storage_dir=None, n_step=1, gamma=0.99):
         """Create Replay buffer.
 
         Parameters
@@ -13,15 +21,53 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        columnar: bool
+            if True, transitions are stored in preallocated typed arrays
+            (one per field) that are allocated on the first call to `add`.
+            Sampling then becomes a single fancy-index gather per field
+            instead of rebuilding the batch element by element.
+        storage_dir: str
+            if set, the columnar arrays are memory-mapped .npy files in this
+            directory, so the buffer can be larger than RAM (implies columnar).
+            If the directory holds a buffer saved with `flush`, it is reopened
+            and the run resumes without refilling the buffer.
+        n_step: int
+            number of steps of the returns computed at sample time (implies
+            columnar). For n_step > 1 the sampled rewards are the discounted
+            sums of up to `n_step` rewards, truncated at the end of an episode,
+            and next_obs/done are those of the last transition summed over.
+            Bootstrapped targets must then use gamma ** n_step.
+        gamma: float
+            discount factor of the n-step returns
         """
-        self._storage = []
+        assert n_step >= 1
+        columnar = columnar or storage_dir is not None or n_step > 1
+        self._storage = [] if not columnar else None
         self._maxsize = size
         self._next_idx = 0
+        self._columnar = columnar
+        self._num_in_buffer = 0
+        self._storage_dir = storage_dir
+        self._n_step = n_step
+        self._gamma = gamma
+
+        state = load_state(storage_dir) if storage_dir is not None else None
+        if state is not None:
+            assert state['maxsize'] == size, "buffer in {} has a different size".format(storage_dir)
+            self._next_idx = state['next_idx']
+            self._num_in_buffer = state['num_in_buffer']
+            self._storage = tuple(np.load(self._storage_path(name), mmap_mode='r+') for name in self._fields)
 
     def __len__(self):
+        if self._columnar:
+            return self._num_in_buffer
         return len(self._storage)
 
     def add(self, obs_t, action, reward, obs_tp1, done):
+        if self._columnar:
+            self._add_columnar(obs_t, action, reward, obs_tp1, done)
+            return
+
         data = (obs_t, action, reward, obs_tp1, done)
 
         if self._next_idx >= len(self._storage):
@@ -30,7 +76,41 @@ class ReplayBuffer(object):
             self._storage[self._next_idx] = data
         self._next_idx = (self._next_idx + 1) % self._maxsize
 
+    def _storage_path(self, name):
+        return os.path.join(self._storage_dir, name + '.npy')
+
+    def _allocate(self, name, shape, dtype, length=None):
+        length = length or self._maxsize
+        if self._storage_dir is not None:
+            return open_memmap(self._storage_path(name), (length,) + shape, dtype)
+        return np.empty((length,) + shape, dtype=dtype)
+
+    @staticmethod
+    def _column_dtype(name, x):
+        # rewards and dones are stored as floats, so that an integer first reward or a
+        # boolean first done does not truncate the ones added later
+        if name in ('reward', 'done'):
+            return np.result_type(x.dtype, np.float32)
+        return x.dtype
+
+    def _add_columnar(self, *data):
+        data = [np.asarray(x) for x in data]
+        if self._storage is None:
+            self._storage = tuple(self._allocate(name, x.shape, self._column_dtype(name, x))
+                                  for name, x in zip(self._fields, data))
+
+        for column, x in zip(self._storage, data):
+            column[self._next_idx] = x
+        self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_in_buffer = min(self._maxsize, self._num_in_buffer + 1)
+
     def _encode_sample(self, idxes):
+        if self._n_step > 1:
+            return self._encode_n_step_sample(idxes)
+        if self._columnar:
+            idxes = np.asarray(idxes)
+            return tuple(column[idxes] for column in self._storage)
+
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         for i in idxes:
             data = self._storage[i]
@@ -42,6 +122,99 @@ class ReplayBuffer(object):
             dones.append(done)
         return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
 
+    def _encode_n_step_sample(self, idxes):
+        obses_t, actions, rewards, obses_tp1, dones = self._storage
+        idxes = np.asarray(idxes)
+        offsets = np.arange(self._n_step)
+        window = (idxes[:, None] + offsets) % self._maxsize
+        # rewards and dones hold a single value per transition, possibly with a trailing axis
+        window_rewards = rewards[window].reshape(window.shape)
+        window_dones = dones[window].reshape(window.shape) != 0
+        # steps after the first done of the window belong to the next episode
+        valid = np.cumsum(window_dones, axis=1) - window_dones == 0
+        returns = np.sum(np.where(valid, window_rewards, 0) * self._gamma ** offsets, axis=1)
+        returns = returns.reshape((len(idxes),) + rewards.shape[1:])
+        last = window[np.arange(len(idxes)), np.sum(valid, axis=1) - 1]
+        return obses_t[idxes], actions[idxes], returns, obses_tp1[last], dones[last]
+
+    def flush(self):
+        """Write the buffer contents and indices to `storage_dir` so that
+        the buffer can be reopened later. Does nothing for in-memory buffers."""
+        if self._storage_dir is None or self._storage is None:
+            return
+        state = {
+            'maxsize': self._maxsize,
+            'next_idx': self._next_idx,
+            'num_in_buffer': self._num_in_buffer,
+        }
+        save_state(self._storage_dir, state, self._storage)
+
+    def _state_arrays(self):
+        data = {'maxsize': self._maxsize, 'next_idx': self._next_idx}
+        n = len(self)
+        if n == 0:
+            return data
+        if self._columnar:
+            # until the buffer wraps around only the first n slots are filled
+            data.update({name: column[:n] for name, column in zip(self._fields, self._storage)})
+        else:
+            # observations are streamed into the file a chunk of transitions at a time rather
+            # than copied into one dense array; the other fields are small
+            for j, name in enumerate(self._fields):
+                if name in ('obs_t', 'obs_tp1'):
+                    first = np.asarray(self._storage[0][j])
+                    data[name] = ArrayChunks((n,) + first.shape, first.dtype, self._chunks(j, n))
+                else:
+                    data[name] = np.array([transition[j] for transition in self._storage])
+        return data
+
+    def _chunks(self, j, n, chunk_size=1024):
+        for start in range(0, n, chunk_size):
+            yield np.array([np.array(transition[j], copy=False)
+                            for transition in self._storage[start:start + chunk_size]])
+
+    def _load_state_arrays(self, data):
+        assert data['maxsize'] == self._maxsize, "saved buffer has a different size"
+        self._next_idx = int(data['next_idx'])
+        if self._fields[0] not in data:
+            return
+        columns = [data[name] for name in self._fields]
+        if self._columnar:
+            if self._storage is None:
+                self._storage = tuple(self._allocate(name, column.shape[1:], column.dtype)
+                                      for name, column in zip(self._fields, columns))
+            for column, values in zip(self._storage, columns):
+                column[:len(values)] = values
+            self._num_in_buffer = len(columns[0])
+        else:
+            self._storage = list(zip(*columns))
+
+    def save(self, path, compression=False):
+        """Save the contents of the buffer to an .npz file.
+
+        Every field is written as a single raw array block, so saving is
+        bounded by disk bandwidth.
+
+        Parameters
+        ----------
+        path: str
+            path to the output file
+        compression: bool
+            if True, the blocks are zlib-compressed
+        """
+        relatively_safe_arrays_dump(self._state_arrays(), path, compression=compression)
+
+    def load(self, path):
+        """Restore the contents of the buffer from a file written by `save`.
+
+        Parameters
+        ----------
+        path: str
+            path to the saved buffer
+        """
+        with np.load(path) as data:
+            self._load_state_arrays({key: data[key] for key in data.files})
+
     def sample(self, batch_size):
         """Sample a batch of experiences.
 
@@ -64,12 +237,20 @@ class ReplayBuffer(object):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        if self._n_step > 1:
+            # only transitions followed by n_step - 1 stored ones have complete returns
+            assert len(self) >= self._n_step
+            oldest = (self._next_idx - len(self)) % self._maxsize
+            idxes = (oldest + np.random.randint(0, len(self) - self._n_step + 1, size=batch_size)) % self._maxsize
+        elif self._columnar:
+            idxes = np.random.randint(0, len(self), size=batch_size)
+        else:
+            idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
         return self._encode_sample(idxes)
 
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, columnar=False, storage_dir=None, n_step=1, gamma=0.99):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,12 +261,25 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        columnar: bool
+            if True, store transitions in preallocated typed arrays
+        storage_dir: str
+            if set, store transitions in memory-mapped files in this directory.
+            Priorities are kept in memory; when an existing buffer is reopened
+            all its transitions start with the maximum priority, except the
+            newest ones whose n-step return is still incomplete.
+        n_step: int
+            number of steps of the returns computed at sample time. A transition
+            can only be sampled once its n-step return is complete.
+        gamma: float
+            discount factor of the n-step returns
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, columnar=columnar, storage_dir=storage_dir,
+                                                      n_step=n_step, gamma=gamma)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -96,25 +290,48 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_sum = SumSegmentTree(it_capacity)
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
+        # slots whose n-step return is still incomplete, they keep a zero priority until then
+        self._pending = deque()
+        if len(self) > 0:
+            self._it_sum.set_batch(np.arange(len(self)), np.full(len(self), self._max_priority ** self._alpha))
+            self._it_min.set_batch(np.arange(len(self)), np.full(len(self), self._max_priority ** self._alpha))
+            self._pending = deque(self._incomplete_slots().tolist())
+            for idx in self._pending:
+                self._it_sum[idx] = 0.0
+                self._it_min[idx] = float('inf')
 
-    def add(self, *args, **kwargs):
+    def _incomplete_slots(self):
+        """Slots of the newest transitions after the last done, at most n_step - 1 of them,
+        oldest first: those whose n-step return is still incomplete."""
+        newest = (self._next_idx - 1 - np.arange(min(self._n_step - 1, len(self)))) % self._maxsize
+        dones = self._storage[4][newest].reshape(len(newest)) != 0
+        n = np.argmax(dones) if dones.any() else len(newest)
+        return newest[:n][::-1]
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
         """See ReplayBuffer.store_effect"""
         idx = self._next_idx
-        super().add(*args, **kwargs)
-        self._it_sum[idx] = self._max_priority ** self._alpha
-        self._it_min[idx] = self._max_priority ** self._alpha
+        super().add(obs_t, action, reward, obs_tp1, done)
+        if self._n_step == 1:
+            self._it_sum[idx] = self._max_priority ** self._alpha
+            self._it_min[idx] = self._max_priority ** self._alpha
+            return
+
+        self._it_sum[idx] = 0.0
+        self._it_min[idx] = float('inf')
+        self._pending.append(idx)
+        while self._pending and (done or len(self._pending) >= self._n_step):
+            ready = self._pending.popleft()
+            self._it_sum[ready] = self._max_priority ** self._alpha
+            self._it_min[ready] = self._max_priority ** self._alpha
 
     def _sample_proportional(self, batch_size):
-        res = []
-        p_total = self._it_sum.sum(0, len(self._storage) - 1)
+        p_total = self._it_sum.sum(0, len(self) - 1)
         every_range_len = p_total / batch_size
-        for i in range(batch_size):
-            mass = random.random() * every_range_len + i * every_range_len
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        mass = (np.random.random(size=batch_size) + np.arange(batch_size)) * every_range_len
+        return self._it_sum.find_prefixsum_idx_batch(mass)
 
-    def sample(self, batch_size, beta):
+    def sample(self, batch_size, beta, weights_dtype=None):
         """Sample a batch of experiences.
 
         compared to ReplayBuffer.sample
@@ -129,6 +346,8 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         beta: float
             To what degree to use importance weights
             (0 - no corrections, 1 - full correction)
+        weights_dtype: np.dtype
+            dtype of the returned importance weights (np.float64 if None)
 
         Returns
         -------
@@ -144,7 +363,7 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         weights: np.array
-            Array of shape (batch_size,) and dtype np.float32
+            Array of shape (batch_size,) and dtype `weights_dtype`
             denoting importance weight of each sampled transition
         idxes: np.array
             Array of shape (batch_size,) and dtype np.int32
@@ -154,18 +373,33 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
         idxes = self._sample_proportional(batch_size)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
+        p_total = self._it_sum.sum()
+        p_min = self._it_min.min() / p_total
+        max_weight = (p_min * len(self)) ** (-beta)
 
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        p_sample = self._it_sum.get_batch(idxes) / p_total
+        weights = (p_sample * len(self)) ** (-beta) / max_weight
+        if weights_dtype is not None:
+            weights = weights.astype(weights_dtype)
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
+    def _state_arrays(self):
+        data = super(PrioritizedReplayBuffer, self)._state_arrays()
+        data['priorities'] = self._it_sum.get_batch(np.arange(len(self)))
+        data['max_priority'] = self._max_priority
+        data['pending'] = np.array(self._pending, dtype=np.int64)
+        return data
+
+    def _load_state_arrays(self, data):
+        super(PrioritizedReplayBuffer, self)._load_state_arrays(data)
+        priorities = data['priorities']
+        self._it_sum.set_batch(np.arange(len(priorities)), priorities)
+        # zero priorities mark pending n-step transitions, they are not part of the min
+        self._it_min.set_batch(np.arange(len(priorities)), np.where(priorities > 0, priorities, np.inf))
+        self._max_priority = float(data['max_priority'])
+        self._pending = deque(data['pending'].tolist())
+
     def update_priorities(self, idxes, priorities):
         """Update priorities of sampled transitions.
 
@@ -179,13 +413,249 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         priorities: [float]
             List of updated priorities corresponding to
             transitions at the sampled idxes denoted by
-            variable `idxes`.
+            variable `idxes`. Updates of slots whose n-step return is
+            incomplete are ignored: they were sampled before their transition
+            was overwritten (e.g. with a ReplayPrefetcher), and the new one
+            must keep a zero priority.
         """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities)
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        assert np.all(priorities > 0)
+        assert np.all(0 <= idxes) and np.all(idxes < len(self))
+        if self._pending:
+            stale = np.isin(idxes, list(self._pending))
+            idxes, priorities = idxes[~stale], priorities[~stale]
+            if len(idxes) == 0:
+                return
+        self._it_sum.set_batch(idxes, priorities ** self._alpha)
+        self._it_min.set_batch(idxes, priorities ** self._alpha)
+
+        self._max_priority = max(self._max_priority, np.max(priorities))
+
+
+class FrameStackReplayBuffer(ReplayBuffer):
+    def __init__(self, size, frame_stack=4):
+        """Create a Replay buffer for stacked frame observations.
+
+        Observations are expected to be `frame_stack` frames concatenated
+        along the last axis (as produced by `wrap_deepmind(frame_stack=True)`).
+        Every unique frame is stored only once in a circular array and the
+        stacks for obs_t and obs_tp1 are rebuilt from frame indices at sample
+        time, so episode boundaries are respected exactly.
+
+        The frame storage holds `size + frame_stack + 1` frames. Each new
+        episode needs a few extra frames for its initial observation, so the
+        oldest transitions may be dropped slightly before `size` transitions
+        are stored.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        frame_stack: int
+            number of frames stacked in each observation
+
+        See Also
+        --------
+        ReplayBuffer.__init__
+        """
+        super(FrameStackReplayBuffer, self).__init__(size, columnar=True)
+        self._frame_stack = frame_stack
+        self._frames = None
+        self._frame_capacity = size + frame_stack + 1
+        self._next_frame_idx = 0
+        # indices of the frame_stack + 1 frames making up obs_t and obs_tp1 of each transition
+        self._frame_idxes = np.zeros((size, frame_stack + 1), dtype=np.int64)
+        self._last_frame_idxes = None
+
+    def _split_frames(self, obs):
+        obs = np.asarray(obs)
+        channels = obs.shape[-1] // self._frame_stack
+        return [obs[..., i * channels:(i + 1) * channels] for i in range(self._frame_stack)]
+
+    def _oldest_slot(self):
+        return (self._next_idx - self._num_in_buffer) % self._maxsize
+
+    def _add_frame(self, frame):
+        idx = self._next_frame_idx
+        # drop the transitions that still refer to the frame about to be overwritten;
+        # frames are written in order, so only the oldest transitions can refer to it
+        while self._num_in_buffer > 0 and self._frame_idxes[self._oldest_slot(), 0] == idx:
+            self._num_in_buffer -= 1
+        self._frames[idx] = frame
+        self._next_frame_idx = (idx + 1) % self._frame_capacity
+        return idx
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        frames_t = self._split_frames(obs_t)
+        if self._storage is None:
+            self._frames = self._allocate('frames', frames_t[0].shape, frames_t[0].dtype, self._frame_capacity)
+            self._storage = tuple(self._allocate(name, np.shape(x), self._column_dtype(name, np.asarray(x)))
+                                  for name, x in zip(('action', 'reward', 'done'), (action, reward, done)))
+
+        if self._last_frame_idxes is None:
+            # first observation of an episode, store its (usually repeated) frames
+            frame_idxes = []
+            for i, frame in enumerate(frames_t):
+                if i > 0 and np.array_equal(frame, frames_t[i - 1]):
+                    frame_idxes.append(frame_idxes[-1])
+                else:
+                    frame_idxes.append(self._add_frame(frame))
+        else:
+            frame_idxes = list(self._last_frame_idxes)
+        frame_idxes.append(self._add_frame(self._split_frames(obs_tp1)[-1]))
+
+        if self._num_in_buffer == self._maxsize:
+            self._num_in_buffer -= 1
+        self._frame_idxes[self._next_idx] = frame_idxes
+        for column, x in zip(self._storage, (action, reward, done)):
+            column[self._next_idx] = x
+        self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_in_buffer += 1
+        self._last_frame_idxes = None if done else frame_idxes[1:]
+
+    def _state_arrays(self):
+        data = {
+            'maxsize': self._maxsize,
+            'next_idx': self._next_idx,
+            'num_in_buffer': self._num_in_buffer,
+            'next_frame_idx': self._next_frame_idx,
+            'frame_idxes': self._frame_idxes,
+            'last_frame_idxes': np.array(self._last_frame_idxes or [], dtype=np.int64),
+        }
+        if self._storage is not None:
+            data['frames'] = self._frames
+            data.update(zip(('action', 'reward', 'done'), self._storage))
+        return data
+
+    def _load_state_arrays(self, data):
+        assert data['maxsize'] == self._maxsize, "saved buffer has a different size"
+        assert data['frame_idxes'].shape == self._frame_idxes.shape, "saved buffer has a different frame_stack"
+        self._next_idx = int(data['next_idx'])
+        self._num_in_buffer = int(data['num_in_buffer'])
+        self._next_frame_idx = int(data['next_frame_idx'])
+        self._frame_idxes[:] = data['frame_idxes']
+        self._last_frame_idxes = list(data['last_frame_idxes']) or None
+        if 'frames' in data:
+            self._frames = data['frames']
+            self._storage = tuple(data[name] for name in ('action', 'reward', 'done'))
+
+    def _stack(self, frames):
+        # (batch, frame_stack, ..., channels) -> (batch, ..., frame_stack * channels)
+        frames = np.moveaxis(frames, 1, -2)
+        return frames.reshape(frames.shape[:-2] + (-1,))
+
+    def _encode_sample(self, idxes):
+        frames = self._frames[self._frame_idxes[idxes]]
+        actions, rewards, dones = (column[idxes] for column in self._storage)
+        return self._stack(frames[:, :-1]), actions, rewards, self._stack(frames[:, 1:]), dones
+
+    def sample(self, batch_size):
+        """Sample a batch of experiences.
+
+        See Also
+        --------
+        ReplayBuffer.sample
+        """
+        idxes = (self._oldest_slot() + np.random.randint(0, len(self), size=batch_size)) % self._maxsize
+        return self._encode_sample(idxes)
+
+
+class ReplayPrefetcher(object):
+    def __init__(self, replay_buffer, num_batches=2):
+        """Sample minibatches from a replay buffer in a background thread.
+
+        Wraps `replay_buffer` and exposes the same `add`, `sample` and
+        `update_priorities` methods. A worker thread keeps up to
+        `num_batches` encoded minibatches ready in a bounded queue, so
+        sampling overlaps with the training step. Priority updates are
+        queued and applied by the worker under the buffer lock before it
+        samples the next minibatch, so prefetched batches may be up to
+        `num_batches` updates stale.
+
+        The worker samples with the arguments of the most recent call to
+        `sample` (e.g. the current beta of a prioritized buffer).
+
+        Parameters
+        ----------
+        replay_buffer: ReplayBuffer
+            buffer to sample from
+        num_batches: int
+            number of minibatches to keep ready
+        """
+        self._buffer = replay_buffer
+        self._batches = queue.Queue(maxsize=num_batches)
+        self._priority_updates = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sample_args = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, *args, **kwargs):
+        with self._lock:
+            self._buffer.add(*args, **kwargs)
+
+    def sample(self, *args, **kwargs):
+        """Returns the next prefetched minibatch, see ReplayBuffer.sample"""
+        self._sample_args = (args, kwargs)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        batch = self._batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def update_priorities(self, idxes, priorities):
+        """Queues a priority update, see PrioritizedReplayBuffer.update_priorities"""
+        self._priority_updates.put((idxes, priorities))
+
+    def _apply_priority_updates(self):
+        while True:
+            try:
+                idxes, priorities = self._priority_updates.get_nowait()
+            except queue.Empty:
+                return
+            self._buffer.update_priorities(idxes, priorities)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                args, kwargs = self._sample_args
+                with self._lock:
+                    self._apply_priority_updates()
+                    batch = self._buffer.sample(*args, **kwargs)
+                while not self._stop.is_set():
+                    try:
+                        self._batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as e:
+            self._batches.put(e)
+
+    def flush(self):
+        with self._lock:
+            self._buffer.flush()
+
+    def save(self, *args, **kwargs):
+        with self._lock:
+            self._buffer.save(*args, **kwargs)
+
+    def load(self, *args, **kwargs):
+        with self._lock:
+            self._buffer.load(*args, **kwargs)
 
-            self._max_priority = max(self._max_priority, priority)
+    def close(self):
+        """Stops the worker thread and applies the pending priority updates"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._apply_priority_updates()
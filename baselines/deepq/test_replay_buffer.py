@@ -0,0 +1,290 @@
+import gym
+import numpy as np
+
+from baselines.common.atari_wrappers import FrameStack
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, FrameStackReplayBuffer, ReplayPrefetcher
+
+
+def _fill(buffer, n, obs_shape=(4, 3)):
+    for i in range(n):
+        obs = np.full(obs_shape, i, dtype=np.uint8)
+        buffer.add(obs, i % 3, float(i), obs + 1, float(i % 7 == 0))
+
+
+def test_columnar_matches_list_storage():
+    size = 16
+    ref = ReplayBuffer(size)
+    columnar = ReplayBuffer(size, columnar=True)
+    # overflow the buffer so that the ring index wraps around
+    _fill(ref, 25)
+    _fill(columnar, 25)
+    assert len(ref) == len(columnar) == size
+
+    idxes = np.random.randint(0, size, size=32)
+    for out_ref, out_col in zip(ref._encode_sample(idxes), columnar._encode_sample(idxes)):
+        assert out_ref.shape == out_col.shape
+        assert out_ref.dtype == out_col.dtype
+        np.testing.assert_array_equal(out_ref, out_col)
+
+
+def test_columnar_sample_shapes():
+    buffer = ReplayBuffer(100, columnar=True)
+    _fill(buffer, 10)
+    obses_t, actions, rewards, obses_tp1, dones = buffer.sample(32)
+    assert obses_t.shape == obses_tp1.shape == (32, 4, 3)
+    assert obses_t.dtype == np.uint8
+    assert actions.shape == rewards.shape == dones.shape == (32,)
+    np.testing.assert_array_equal(obses_tp1, obses_t + 1)
+    assert np.all(rewards < 10)
+
+
+def test_columnar_prioritized():
+    buffer = PrioritizedReplayBuffer(8, alpha=0.6, columnar=True)
+    _fill(buffer, 5)
+    assert len(buffer) == 5
+    *_, weights, idxes = buffer.sample(16, beta=0.4)
+    assert weights.shape == (16,)
+    assert all(0 <= idx < 5 for idx in idxes)
+    buffer.update_priorities(idxes, np.ones(len(idxes)) * 2.0)
+
+
+class _FrameEnv(gym.Env):
+    """Emits a new random frame every step and ends episodes at random."""
+
+    def __init__(self, shape=(6, 5, 2)):
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(3)
+        self._rng = np.random.RandomState(0)
+
+    def _frame(self):
+        return self._rng.randint(0, 256, size=self.observation_space.shape).astype(np.uint8)
+
+    def reset(self):
+        return self._frame()
+
+    def step(self, action):
+        return self._frame(), 1.0, self._rng.rand() < 0.2, {}
+
+
+def test_frame_stack_matches_list_storage():
+    size, frame_stack = 20, 4
+    ref = ReplayBuffer(size)
+    dedup = FrameStackReplayBuffer(size, frame_stack=frame_stack)
+    env = FrameStack(_FrameEnv(), frame_stack)
+
+    obs = env.reset()
+    for t in range(73):
+        action = t % 3
+        new_obs, rew, done, _ = env.step(action)
+        for buffer in (ref, dedup):
+            buffer.add(obs, action, rew, new_obs, float(done))
+        obs = env.reset() if done else new_obs
+
+    assert 0 < len(dedup) <= len(ref) == size
+    assert dedup._frames.shape == (size + frame_stack + 1, 6, 5, 2)
+    # both buffers write transitions to the same slots
+    idxes = (dedup._oldest_slot() + np.arange(len(dedup))) % size
+    for out_ref, out_dedup in zip(ref._encode_sample(idxes), dedup._encode_sample(idxes)):
+        assert out_ref.shape == out_dedup.shape
+        np.testing.assert_array_equal(out_ref, out_dedup)
+
+    obses_t, actions, rewards, obses_tp1, dones = dedup.sample(8)
+    assert obses_t.shape == obses_tp1.shape == (8, 6, 5, 8)
+
+
+def test_columnar_int_first_reward():
+    obs = np.zeros((4, 3), dtype=np.uint8)
+    buffer = ReplayBuffer(4, columnar=True)
+    buffer.add(obs, 0, 1, obs, False)
+    buffer.add(obs, 0, 0.5, obs, 1.)
+    _, _, rewards, _, dones = buffer._encode_sample([0, 1])
+    np.testing.assert_array_equal(rewards, [1., 0.5])
+    np.testing.assert_array_equal(dones, [0., 1.])
+
+    env = FrameStack(_FrameEnv(), 2)
+    buffer = FrameStackReplayBuffer(4, frame_stack=2)
+    obs = env.reset()
+    buffer.add(obs, 0, 1, obs, False)
+    buffer.add(obs, 0, 0.5, obs, 1.)
+    _, _, rewards, _, dones = buffer._encode_sample([0, 1])
+    np.testing.assert_array_equal(rewards, [1., 0.5])
+    np.testing.assert_array_equal(dones, [0., 1.])
+
+
+def test_prioritized_weights():
+    buffer = PrioritizedReplayBuffer(16, alpha=0.6)
+    _fill(buffer, 10)
+    buffer.update_priorities(np.arange(10), np.arange(1, 11, dtype=np.float64))
+
+    beta = 0.4
+    *_, weights, idxes = buffer.sample(64, beta=beta, weights_dtype=np.float32)
+    assert weights.dtype == np.float32
+
+    p_total = buffer._it_sum.sum()
+    max_weight = (buffer._it_min.min() / p_total * len(buffer)) ** (-beta)
+    expected = [(buffer._it_sum[idx] / p_total * len(buffer)) ** (-beta) / max_weight for idx in idxes]
+    np.testing.assert_allclose(weights, expected, rtol=1e-6)
+    assert np.all(weights <= 1.0 + 1e-6)
+
+
+def test_prefetcher():
+    buffer = PrioritizedReplayBuffer(16, alpha=0.6, columnar=True)
+    prefetcher = ReplayPrefetcher(buffer, num_batches=3)
+    _fill(prefetcher, 10)
+    assert len(prefetcher) == 10
+    try:
+        for _ in range(5):
+            obses_t, actions, rewards, obses_tp1, dones, weights, idxes = prefetcher.sample(8, beta=0.4)
+            assert obses_t.shape == (8, 4, 3)
+            assert weights.shape == idxes.shape == (8,)
+            prefetcher.update_priorities(idxes, np.full(len(idxes), 5.0))
+            prefetcher.add(obses_t[0], 0, 0.0, obses_tp1[0], 0.0)
+    finally:
+        prefetcher.close()
+    assert buffer._max_priority == 5.0
+
+
+def test_storage_dir_resume(tmpdir):
+    storage_dir = str(tmpdir.join('replay'))
+    buffer = PrioritizedReplayBuffer(16, alpha=0.6, storage_dir=storage_dir)
+    _fill(buffer, 20)
+    buffer.flush()
+    expected = buffer._encode_sample(np.arange(16))
+
+    resumed = PrioritizedReplayBuffer(16, alpha=0.6, storage_dir=storage_dir)
+    assert len(resumed) == 16
+    assert resumed._next_idx == buffer._next_idx
+    assert isinstance(resumed._storage[0], np.memmap)
+    for out, out_resumed in zip(expected, resumed._encode_sample(np.arange(16))):
+        np.testing.assert_array_equal(out, out_resumed)
+    assert np.isclose(resumed._it_sum.sum(), 16.0)
+    resumed.sample(4, beta=0.4)
+
+
+def test_n_step_storage_dir_resume(tmpdir):
+    # the last done is at transition 14, or at the newest transition
+    for n in (20, 15):
+        storage_dir = str(tmpdir.join('replay%i' % n))
+        buffer = PrioritizedReplayBuffer(16, alpha=0.6, storage_dir=storage_dir, n_step=3)
+        _fill(buffer, n)
+        buffer.flush()
+
+        resumed = PrioritizedReplayBuffer(16, alpha=0.6, storage_dir=storage_dir, n_step=3)
+        assert list(resumed._pending) == list(buffer._pending)
+        assert len(resumed._pending) == (2 if n == 20 else 0)
+        idxes = np.arange(16)
+        np.testing.assert_array_equal(resumed._it_sum.get_batch(idxes), buffer._it_sum.get_batch(idxes))
+        resumed.add(np.zeros((4, 3), dtype=np.uint8), 0, 1.0, np.zeros((4, 3), dtype=np.uint8), 0.)
+        buffer.add(np.zeros((4, 3), dtype=np.uint8), 0, 1.0, np.zeros((4, 3), dtype=np.uint8), 0.)
+        assert list(resumed._pending) == list(buffer._pending)
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('replay_buffer.npz'))
+    for columnar in (False, True):
+        buffer = PrioritizedReplayBuffer(16, alpha=0.6, columnar=columnar)
+        _fill(buffer, 21)
+        buffer.update_priorities(np.arange(16), np.linspace(1, 3, 16))
+        buffer.save(path)
+
+        restored = PrioritizedReplayBuffer(16, alpha=0.6, columnar=columnar)
+        restored.load(path)
+        assert len(restored) == len(buffer)
+        assert restored._next_idx == buffer._next_idx
+        for out, out_restored in zip(buffer._encode_sample(np.arange(16)), restored._encode_sample(np.arange(16))):
+            np.testing.assert_array_equal(out, out_restored)
+        assert np.isclose(restored._it_sum.sum(), buffer._it_sum.sum())
+        assert np.isclose(restored._it_min.min(), buffer._it_min.min())
+        assert restored._max_priority == buffer._max_priority
+
+
+def test_list_storage_save_streams_chunks(tmpdir):
+    path = str(tmpdir.join('replay_buffer.npz'))
+    buffer = ReplayBuffer(2500)
+    # more transitions than a chunk, and a wrapped ring index
+    _fill(buffer, 2600)
+    buffer.save(path, compression=True)
+
+    dense = buffer._encode_sample(np.arange(len(buffer)))
+    with np.load(path) as data:
+        for name, expected in zip(ReplayBuffer._fields, dense):
+            np.testing.assert_array_equal(data[name], expected)
+            assert data[name].dtype == expected.dtype
+    restored = ReplayBuffer(2500)
+    restored.load(path)
+    assert restored._next_idx == buffer._next_idx
+    for out, out_restored in zip(dense, restored._encode_sample(np.arange(len(buffer)))):
+        np.testing.assert_array_equal(out, out_restored)
+
+
+def test_frame_stack_save_load(tmpdir):
+    path = str(tmpdir.join('replay_buffer.npz'))
+    buffer = FrameStackReplayBuffer(10, frame_stack=4)
+    env = FrameStack(_FrameEnv(), 4)
+    obs = env.reset()
+    for t in range(15):
+        new_obs, rew, done, _ = env.step(0)
+        buffer.add(obs, 0, rew, new_obs, float(done))
+        obs = env.reset() if done else new_obs
+    buffer.save(path, compression=True)
+
+    restored = FrameStackReplayBuffer(10, frame_stack=4)
+    restored.load(path)
+    idxes = (buffer._oldest_slot() + np.arange(len(buffer))) % 10
+    for out, out_restored in zip(buffer._encode_sample(idxes), restored._encode_sample(idxes)):
+        np.testing.assert_array_equal(out, out_restored)
+    # adding keeps working on the restored buffer
+    new_obs, rew, done, _ = env.step(0)
+    restored.add(obs, 0, rew, new_obs, float(done))
+
+
+def test_n_step_returns():
+    size, n_step, gamma = 16, 3, 0.9
+    buffer = ReplayBuffer(size, n_step=n_step, gamma=gamma)
+    rewards = np.arange(1, 24, dtype=np.float64)
+    dones = np.array([i % 5 == 4 for i in range(23)], dtype=np.float64)
+    for i in range(23):
+        buffer.add(np.array([i]), 0, rewards[i], np.array([i + 1]), dones[i])
+
+    # transitions 7..22 are stored, slot of transition i is i % size
+    for i in range(7, 21):
+        ret, j = 0.0, i
+        for k in range(n_step):
+            j = i + k
+            ret += gamma ** k * rewards[j]
+            if dones[j]:
+                break
+        obs_t, _, rew, obs_tp1, done = buffer._encode_sample([i % size])
+        assert obs_t[0, 0] == i
+        assert np.isclose(rew[0], ret)
+        assert obs_tp1[0, 0] == j + 1
+        assert done[0] == dones[j]
+
+    obses_t, _, _, _, _ = buffer.sample(256)
+    # the two newest transitions do not have a complete 3-step return yet
+    assert obses_t.min() >= 7 and obses_t.max() <= 20
+
+
+def test_n_step_prioritized():
+    buffer = PrioritizedReplayBuffer(16, alpha=0.6, n_step=3)
+    for i in range(7):
+        buffer.add(np.array([i]), 0, 1.0, np.array([i + 1]), float(i == 4))
+    # transitions 0..4 end with a done, 5 and 6 still wait for their return
+    assert np.isclose(buffer._it_sum.sum(), 5.0)
+    obses_t, *_, weights, idxes = buffer.sample(64, beta=0.4)
+    assert obses_t.max() <= 4
+    assert np.all(np.isfinite(weights))
+
+
+def test_n_step_stale_priority_update():
+    buffer = PrioritizedReplayBuffer(8, alpha=0.6, n_step=3)
+    for i in range(9):
+        buffer.add(np.array([i]), 0, 1.0, np.array([i + 1]), 0.)
+    # slot 0 was overwritten by transition 8, whose return is incomplete
+    assert 0 in buffer._pending
+    # an update for the transition sampled from slot 0 before it was overwritten
+    buffer.update_priorities([0], [5.0])
+    assert buffer._it_sum[0] == 0.0
+    obses_t, *_, weights, idxes = buffer.sample(64, beta=0.4)
+    assert 0 not in idxes
+    assert np.all(np.isfinite(weights))
@@ -25,7 +25,7 @@ class DDPG(object):
                  Q_lr, pi_lr, norm_eps, norm_clip, max_u, action_l2, clip_obs, scope, T,
                  rollout_batch_size, subtract_goals, relative_goals, clip_pos_returns, clip_return,
                  bc_loss, q_filter, num_demo, demo_batch_size, prm_loss_weight, aux_loss_weight,
-                 sample_transitions, gamma, reuse=False, **kwargs):
+                 sample_transitions, gamma, buffer_storage_dir=None, buffer_num_shards=1, reuse=False, **kwargs):
         """Implementation of DDPG that is used in combination with Hindsight Experience Replay (HER).
             Added functionality to use demonstrations for training to Overcome exploration problem.
 
@@ -61,6 +61,10 @@ class DDPG(object):
             demo_batch_size: number of samples to be used from the demonstrations buffer, per mpi thread
             prm_loss_weight: Weight corresponding to the primary loss
             aux_loss_weight: Weight corresponding to the auxilliary loss also called the cloning loss
+            buffer_storage_dir (str): directory in which the replay buffer is kept as memory-mapped files
+                (None keeps it in memory)
+            buffer_num_shards (int): number of shards of the replay buffer, one per thread that
+                stores episodes
         """
         if self.clip_return is None:
             self.clip_return = np.inf
@@ -101,7 +105,8 @@ class DDPG(object):
         buffer_shapes['ag'] = (self.T, self.dimg)
 
         buffer_size = (self.buffer_size // self.rollout_batch_size) * self.rollout_batch_size
-        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions)
+        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions,
+                                   storage_dir=self.buffer_storage_dir, num_shards=self.buffer_num_shards)
 
         global DEMO_BUFFER
         DEMO_BUFFER = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions) #initialize the demo buffer; in the same way as the primary data buffer
@@ -223,21 +228,28 @@ class DDPG(object):
         self.buffer.store_episode(episode_batch)
 
         if update_stats:
-            # add transitions to normalizer
-            episode_batch['o_2'] = episode_batch['o'][:, 1:, :]
-            episode_batch['ag_2'] = episode_batch['ag'][:, 1:, :]
-            num_normalizing_transitions = transitions_in_episode_batch(episode_batch)
-            transitions = self.sample_transitions(episode_batch, num_normalizing_transitions)
+            self.update_normalizer_stats(episode_batch)
 
-            o, g, ag = transitions['o'], transitions['g'], transitions['ag']
-            transitions['o'], transitions['g'] = self._preprocess_og(o, ag, g)
-            # No need to preprocess the o_2 and g_2 since this is only used for stats
+    def update_normalizer_stats(self, episode_batch):
+        """Adds the transitions of episode_batch to the observation and goal normalizers.
 
-            self.o_stats.update(transitions['o'])
-            self.g_stats.update(transitions['g'])
+        The stats are averaged over MPI workers, so all of them must call this equally often.
+        """
+        # add transitions to normalizer
+        episode_batch['o_2'] = episode_batch['o'][:, 1:, :]
+        episode_batch['ag_2'] = episode_batch['ag'][:, 1:, :]
+        num_normalizing_transitions = transitions_in_episode_batch(episode_batch)
+        transitions = self.sample_transitions(episode_batch, num_normalizing_transitions)
+
+        o, g, ag = transitions['o'], transitions['g'], transitions['ag']
+        transitions['o'], transitions['g'] = self._preprocess_og(o, ag, g)
+        # No need to preprocess the o_2 and g_2 since this is only used for stats
 
-            self.o_stats.recompute_stats()
-            self.g_stats.recompute_stats()
+        self.o_stats.update(transitions['o'])
+        self.g_stats.update(transitions['g'])
+
+        self.o_stats.recompute_stats()
+        self.g_stats.recompute_stats()
 
     def get_current_buffer_size(self):
         return self.buffer.get_current_size()
@@ -303,6 +315,9 @@ class DDPG(object):
     def clear_buffer(self):
         self.buffer.clear_buffer()
 
+    def flush_buffer(self):
+        self.buffer.flush()
+
     def _vars(self, scope):
         res = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=self.scope + '/' + scope)
         assert len(res) > 0
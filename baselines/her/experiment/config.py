@@ -24,6 +24,8 @@ DEFAULT_PARAMS = {
     'Q_lr': 0.001,  # critic learning rate
     'pi_lr': 0.001,  # actor learning rate
     'buffer_size': int(1E6),  # for experience replay
+    'buffer_storage_dir': None,  # if set, keep the replay buffer in memory-mapped files in this directory
+    'buffer_num_shards': 1,  # replay buffer shards, one per thread that stores episodes
     'polyak': 0.95,  # polyak averaging coefficient
     'action_l2': 1.0,  # quadratic penalty on actions (before rescaling by max_u)
     'clip_obs': 200.,
@@ -34,13 +36,14 @@ DEFAULT_PARAMS = {
     'rollout_batch_size': 2,  # per mpi thread
     'n_batches': 40,  # training batches per cycle
     'batch_size': 256,  # per mpi thread, measured in transitions and reduced to even multiple of chunk_length.
+    'concurrent_rollouts': False,  # generate the rollouts of the next cycle in a thread while training
     'n_test_rollouts': 10,  # number of test rollouts per epoch, each consists of rollout_batch_size rollouts
     'test_with_polyak': False,  # run test episodes with the target network
     # exploration
     'random_eps': 0.3,  # percentage of time a random action is taken
     'noise_eps': 0.2,  # std of gaussian noise added to not-completely-random actions as a percentage of max_u
     # HER
-    'replay_strategy': 'future',  # supported modes: future, none
+    'replay_strategy': 'future',  # supported modes: future, final, episode, none
     'replay_k': 4,  # number of additional goals used for replay, only used if off_policy_data=future
     # normalization
     'norm_eps': 0.01,  # epsilon used for observation normalization
@@ -105,7 +108,7 @@ def prepare_params(kwargs):
         kwargs['pi_lr'] = kwargs['lr']
         kwargs['Q_lr'] = kwargs['lr']
         del kwargs['lr']
-    for name in ['buffer_size', 'hidden', 'layers',
+    for name in ['buffer_size', 'buffer_storage_dir', 'buffer_num_shards', 'hidden', 'layers',
                  'network_class',
                  'polyak',
                  'batch_size', 'Q_lr', 'pi_lr',
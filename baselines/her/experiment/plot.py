@@ -79,6 +79,8 @@ for curr_path in paths:
 
     if replay_strategy == 'future':
         config = 'her'
+    elif replay_strategy in ['final', 'episode']:
+        config = 'her-' + replay_strategy
     else:
         config = 'ddpg'
     if 'Dense' in env_id:
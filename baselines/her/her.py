@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import numpy as np
@@ -21,7 +22,7 @@ def mpi_average(value):
 
 def train(*, policy, rollout_worker, evaluator,
           n_epochs, n_test_rollouts, n_cycles, n_batches, policy_save_interval,
-          save_path, demo_file, **kwargs):
+          save_path, demo_file, concurrent_rollouts=False, **kwargs):
     rank = MPI.COMM_WORLD.Get_rank()
 
     if save_path:
@@ -34,13 +35,29 @@ def train(*, policy, rollout_worker, evaluator,
 
     if policy.bc_loss == 1: policy.init_demo_buffer(demo_file) #initialize demo buffer if training with demonstrations
 
+    def generate_and_store_rollouts():
+        episode = rollout_worker.generate_rollouts()
+        policy.store_episode(episode, update_stats=False)
+        return episode
+
+    # with concurrent_rollouts the rollouts of the next cycle are generated while training on the
+    # current one; the normalizer stats are MPI-reduced, so they are still updated on this thread
+    executor = ThreadPoolExecutor(max_workers=1) if concurrent_rollouts else None
+
     # num_timesteps = n_epochs * n_cycles * rollout_length * number of rollout workers
     for epoch in range(n_epochs):
         # train
         rollout_worker.clear_history()
-        for _ in range(n_cycles):
-            episode = rollout_worker.generate_rollouts()
-            policy.store_episode(episode)
+        if executor is not None:
+            next_episode = executor.submit(generate_and_store_rollouts)
+        for cycle in range(n_cycles):
+            if executor is not None:
+                episode = next_episode.result()
+                if cycle + 1 < n_cycles:
+                    next_episode = executor.submit(generate_and_store_rollouts)
+            else:
+                episode = generate_and_store_rollouts()
+            policy.update_normalizer_stats(episode)
             for _ in range(n_batches):
                 policy.train()
             policy.update_target_net()
@@ -73,6 +90,7 @@ def train(*, policy, rollout_worker, evaluator,
             policy_path = periodic_policy_path.format(epoch)
             logger.info('Saving periodic policy to {} ...'.format(policy_path))
             evaluator.save_policy(policy_path)
+        policy.flush_buffer()
 
         # make sure that different threads have different seeds
         local_uniform = np.random.uniform(size=(1,))
@@ -81,6 +99,8 @@ def train(*, policy, rollout_worker, evaluator,
         if rank != 0:
             assert local_uniform[0] != root_uniform[0]
 
+    if executor is not None:
+        executor.shutdown()
     return policy
 
 
@@ -114,6 +134,8 @@ def learn(*, network, env, total_timesteps,
     if env_name in config.DEFAULT_ENV_PARAMS:
         params.update(config.DEFAULT_ENV_PARAMS[env_name])  # merge env-specific parameters in
     params.update(**override_params)  # makes it possible to override any parameter
+    if params.get('buffer_storage_dir') and num_cpu > 1:
+        params['buffer_storage_dir'] = os.path.join(params['buffer_storage_dir'], 'rank{}'.format(rank))
     with open(os.path.join(logger.get_dir(), 'params.json'), 'w') as f:
          json.dump(params, f)
     params = config.prepare_params(params)
@@ -174,7 +196,8 @@ def learn(*, network, env, total_timesteps,
         save_path=save_path, policy=policy, rollout_worker=rollout_worker,
         evaluator=evaluator, n_epochs=n_epochs, n_test_rollouts=params['n_test_rollouts'],
         n_cycles=params['n_cycles'], n_batches=params['n_batches'],
-        policy_save_interval=policy_save_interval, demo_file=demo_file)
+        policy_save_interval=policy_save_interval, demo_file=demo_file,
+        concurrent_rollouts=params['concurrent_rollouts'])
 
 
 @click.command()
@@ -182,7 +205,7 @@ def learn(*, network, env, total_timesteps,
 @click.option('--total_timesteps', type=int, default=int(5e5), help='the number of timesteps to run')
 @click.option('--seed', type=int, default=0, help='the random seed used to seed both the environment and the training code')
 @click.option('--policy_save_interval', type=int, default=5, help='the interval with which policy pickles are saved. If set to 0, only the best and latest policy will be pickled.')
-@click.option('--replay_strategy', type=click.Choice(['future', 'none']), default='future', help='the HER replay strategy to be used. "future" uses HER, "none" disables HER.')
+@click.option('--replay_strategy', type=click.Choice(['future', 'final', 'episode', 'none']), default='future', help='the HER replay strategy to be used. "future", "final" and "episode" relabel goals with achieved goals from a later step, the last step or any step of the episode, "none" disables HER.')
 @click.option('--clip_return', type=int, default=1, help='whether or not returns should be clipped')
 @click.option('--demo_file', type=str, default = 'PATH/TO/DEMO/DATA/FILE.npz', help='demo data file path')
 def main(**kwargs):
@@ -5,42 +5,65 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
     """Creates a sample function that can be used for HER experience replay.
 
     Args:
-        replay_strategy (in ['future', 'none']): the HER replay strategy; if set to 'none',
+        replay_strategy (in ['future', 'final', 'episode', 'none']): the HER replay strategy;
+            relabeled goals are achieved goals from a later step of the episode ('future'), from
+            its last step ('final') or from any of its steps ('episode'). If set to 'none',
             regular DDPG experience replay is used
         replay_k (int): the ratio between HER replays and regular replays (e.g. k = 4 -> 4 times
             as many HER replays as regular replays are used)
         reward_fun (function): function to re-compute the reward with substituted goals
     """
-    if replay_strategy == 'future':
+    assert replay_strategy in ['future', 'final', 'episode', 'none'], \
+        "unknown replay strategy {}".format(replay_strategy)
+    if replay_strategy != 'none':
         future_p = 1 - (1. / (1 + replay_k))
     else:  # 'replay_strategy' == 'none'
         future_p = 0
 
-    def _sample_her_transitions(episode_batch, batch_size_in_transitions):
+    def _sample_her_transitions(episode_batch, batch_size_in_transitions, episode_idxs=None, out=None):
         """episode_batch is {key: array(buffer_size x T x dim_key)}
+
+        episode_idxs (optional) are the episodes to sample from, one per transition;
+        by default they are drawn uniformly from episode_batch.
+
+        out (optional) is a dict of output arrays that is reused across calls: the transitions
+        are gathered into it and the returned arrays are only valid until the next call with
+        the same `out`.
         """
         T = episode_batch['u'].shape[1]
         rollout_batch_size = episode_batch['u'].shape[0]
         batch_size = batch_size_in_transitions
+        if out is None:
+            out = {}
 
         # Select which episodes and time steps to use.
-        episode_idxs = np.random.randint(0, rollout_batch_size, batch_size)
+        if episode_idxs is None:
+            episode_idxs = np.random.randint(0, rollout_batch_size, batch_size)
         t_samples = np.random.randint(T, size=batch_size)
-        transitions = {key: episode_batch[key][episode_idxs, t_samples].copy()
-                       for key in episode_batch.keys()}
-
-        # Select future time indexes proportional with probability future_p. These
-        # will be used for HER replay by substituting in future goals.
-        her_indexes = np.where(np.random.uniform(size=batch_size) < future_p)
-        future_offset = np.random.uniform(size=batch_size) * (T - t_samples)
-        future_offset = future_offset.astype(int)
-        future_t = (t_samples + 1 + future_offset)[her_indexes]
-
-        # Replace goal with achieved goal but only for the previously-selected
-        # HER transitions (as defined by her_indexes). For the other transitions,
-        # keep the original goal.
-        future_ag = episode_batch['ag'][episode_idxs[her_indexes], future_t]
-        transitions['g'][her_indexes] = future_ag
+        flat_idxs = {}
+        for key in episode_batch.keys():
+            _gather(episode_batch, key, episode_idxs, t_samples, out, flat_idxs)
+
+        # Select which transitions are relabeled (with probability future_p) and the time
+        # indexes of the achieved goals that replace their goals.
+        her_indexes = np.flatnonzero(np.random.uniform(size=batch_size) < future_p)
+        if len(her_indexes) > 0:
+            her_t = t_samples[her_indexes]
+            if replay_strategy == 'future':
+                future_offset = (np.random.uniform(size=len(her_indexes)) * (T - her_t)).astype(int)
+                future_t = her_t + 1 + future_offset
+            elif replay_strategy == 'final':
+                future_t = np.full(len(her_indexes), T)
+            else:  # 'episode'
+                future_t = np.random.randint(T + 1, size=len(her_indexes))
+
+            # Replace goal with achieved goal but only for the previously-selected
+            # HER transitions (as defined by her_indexes). For the other transitions,
+            # keep the original goal.
+            ag = episode_batch['ag']
+            out['g'][her_indexes] = ag[episode_idxs[her_indexes], future_t]
+
+        transitions = {key: out[key] for key in episode_batch.keys()}
 
         # Reconstruct info dictionary for reward  computation.
         info = {}
@@ -48,16 +71,36 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
             if key.startswith('info_'):
                 info[key.replace('info_', '')] = value
 
-        # Re-compute reward since we may have substituted the goal.
+        # Re-compute reward for the whole batch since we may have substituted the goal.
         reward_params = {k: transitions[k] for k in ['ag_2', 'g']}
         reward_params['info'] = info
         transitions['r'] = reward_fun(**reward_params)
 
-        transitions = {k: transitions[k].reshape(batch_size, *transitions[k].shape[1:])
-                       for k in transitions.keys()}
-
         assert(transitions['u'].shape[0] == batch_size_in_transitions)
 
         return transitions
 
     return _sample_her_transitions
+
+
+def _gather(episode_batch, key, episode_idxs, t_samples, out, flat_idxs):
+    """Writes episode_batch[key][episode_idxs, t_samples] into out[key].
+
+    The gather is a single take on a flattened (episodes * steps, ...) view. Keys ending
+    in '_2' are read from their base key at t + 1 when it is present, since they are usually
+    strided views of it that cannot be flattened without a copy. flat_idxs caches the
+    flattened indexes of the keys with the same number of steps.
+    """
+    offset = 0
+    src = episode_batch[key]
+    if key.endswith('_2') and key[:-2] in episode_batch:
+        src, offset = episode_batch[key[:-2]], 1
+    steps = src.shape[1]
+    flat = src.reshape((src.shape[0] * steps,) + src.shape[2:])
+
+    shape = (len(episode_idxs),) + src.shape[2:]
+    if key not in out or out[key].shape != shape or out[key].dtype != src.dtype:
+        out[key] = np.empty(shape, dtype=src.dtype)
+    if (steps, offset) not in flat_idxs:
+        flat_idxs[steps, offset] = episode_idxs * steps + t_samples + offset
+    flat.take(flat_idxs[steps, offset], axis=0, out=out[key])
@@ -1,107 +1,194 @@
+import os
 import threading
 
 import numpy as np
 
+from baselines.common.memmap_util import open_memmap, save_state, load_state
+
 
 class ReplayBuffer:
-    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions):
+    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions, storage_dir=None, num_shards=1):
         """Creates a replay buffer.
 
+        The episode slots are split into `num_shards` contiguous shards. Every thread that
+        stores episodes writes to its own shard under a per-shard lock, while `sample` takes
+        no lock at all: it gathers by index and retries the episodes that were overwritten
+        while it was reading them.
+
         Args:
             buffer_shapes (dict of ints): the shape for all buffers that are used in the replay
                 buffer
             size_in_transitions (int): the size of the buffer, measured in transitions
             T (int): the time horizon for episodes
             sample_transitions (function): a function that samples from the replay buffer
+            storage_dir (str): if set, the buffers are memory-mapped files in this directory and
+                a buffer previously saved there with `flush` is reopened
+            num_shards (int): number of shards, ideally the number of threads storing episodes
         """
         self.buffer_shapes = buffer_shapes
         self.size = size_in_transitions // T
         self.T = T
         self.sample_transitions = sample_transitions
+        assert 1 <= num_shards <= self.size, "Every shard must hold at least one episode!"
+        self.num_shards = num_shards
 
         # self.buffers is {key: array(size_in_episodes x T or T+1 x dim_key)}
-        self.buffers = {key: np.empty([self.size, *shape])
-                        for key, shape in buffer_shapes.items()}
-
-        # memory management
-        self.current_size = 0
+        self.storage_dir = storage_dir
+        if storage_dir is not None:
+            self.buffers = {key: open_memmap(os.path.join(storage_dir, key + '.npy'), [self.size, *shape], np.float64)
+                            for key, shape in buffer_shapes.items()}
+        else:
+            self.buffers = {key: np.empty([self.size, *shape])
+                            for key, shape in buffer_shapes.items()}
+        # views handed to sample_transitions, built once instead of on every sample
+        self._sample_buffers = dict(self.buffers)
+        self._sample_buffers['o_2'] = self.buffers['o'][:, 1:, :]
+        self._sample_buffers['ag_2'] = self.buffers['ag'][:, 1:, :]
+        # output arrays reused by sample_transitions across calls
+        self._sample_out = {}
+
+        # memory management; shard k owns the episode slots [shard_starts[k], shard_starts[k + 1])
+        self._shard_starts = np.arange(num_shards + 1) * self.size // num_shards
+        self._shard_sizes = np.zeros(num_shards, dtype=np.int64)
+        self._shard_locks = [threading.Lock() for _ in range(num_shards)]
+        # odd while an episode slot is being written, incremented again once it is written
+        self._versions = np.zeros(self.size, dtype=np.int64)
         self.n_transitions_stored = 0
+        state = load_state(storage_dir) if storage_dir is not None else None
+        if state is not None:
+            shard_sizes = state.get('shard_sizes', [state['current_size']])
+            assert len(shard_sizes) == num_shards, "{} holds a buffer with {} shards".format(
+                storage_dir, len(shard_sizes))
+            self._shard_sizes[:] = shard_sizes
+            self.n_transitions_stored = state['n_transitions_stored']
 
         self.lock = threading.Lock()
+        self._thread_shards = {}
+
+    @property
+    def current_size(self):
+        return int(self._shard_sizes.sum())
 
     @property
     def full(self):
-        with self.lock:
-            return self.current_size == self.size
+        return self.current_size == self.size
 
     def sample(self, batch_size):
         """Returns a dict {key: array(batch_size x shapes[key])}
-        """
-        buffers = {}
-
-        with self.lock:
-            assert self.current_size > 0
-            for key in self.buffers.keys():
-                buffers[key] = self.buffers[key][:self.current_size]
 
-        buffers['o_2'] = buffers['o'][:, 1:, :]
-        buffers['ag_2'] = buffers['ag'][:, 1:, :]
-
-        transitions = self.sample_transitions(buffers, batch_size)
+        The arrays are reused by the next call, so they must be consumed (or copied) before it.
+        """
+        episode_idxs = self._sample_episode_idxs(batch_size)
+        while True:
+            versions = self._versions[episode_idxs]
+            busy = versions % 2 == 1
+            if busy.any():
+                episode_idxs[busy] = self._sample_episode_idxs(busy.sum())
+                continue
+
+            transitions = self.sample_transitions(self._sample_buffers, batch_size, episode_idxs,
+                                                  out=self._sample_out)
+
+            # episodes that were overwritten during the gather are replaced and the batch is redrawn
+            torn = self._versions[episode_idxs] != versions
+            if not torn.any():
+                break
+            episode_idxs[torn] = self._sample_episode_idxs(torn.sum())
 
         for key in (['r', 'o_2', 'ag_2'] + list(self.buffers.keys())):
             assert key in transitions, "key %s missing from transitions" % key
 
         return transitions
 
-    def store_episode(self, episode_batch):
+    def _sample_episode_idxs(self, n):
+        """Draws `n` episode slots uniformly from the ones that are stored in all shards"""
+        sizes = self._shard_sizes.copy()
+        ends = np.cumsum(sizes)
+        assert ends[-1] > 0
+        ranks = np.random.randint(0, ends[-1], n)
+        shards = np.searchsorted(ends, ranks, side='right')
+        return self._shard_starts[shards] + ranks - (ends - sizes)[shards]
+
+    def store_episode(self, episode_batch, shard=None):
         """episode_batch: array(batch_size x (T or T+1) x dim_key)
+
+        The episodes are written to `shard`; by default every thread gets a shard of its own.
         """
         batch_sizes = [len(episode_batch[key]) for key in episode_batch.keys()]
         assert np.all(np.array(batch_sizes) == batch_sizes[0])
         batch_size = batch_sizes[0]
+        if shard is None:
+            shard = self._get_thread_shard()
 
-        with self.lock:
-            idxs = self._get_storage_idx(batch_size)
+        with self._shard_locks[shard]:
+            idxs = self._get_storage_idx(batch_size, shard)
+            self._versions[idxs] += 1
 
             # load inputs into buffers
             for key in self.buffers.keys():
                 self.buffers[key][idxs] = episode_batch[key]
 
-            self.n_transitions_stored += batch_size * self.T
+            self._versions[idxs] += 1
+            # publish the new slots only after they have been written
+            self._shard_sizes[shard] = min(self._shard_capacity(shard), self._shard_sizes[shard] + batch_size)
+            with self.lock:
+                self.n_transitions_stored += batch_size * self.T
 
     def get_current_episode_size(self):
-        with self.lock:
-            return self.current_size
+        return self.current_size
 
     def get_current_size(self):
-        with self.lock:
-            return self.current_size * self.T
+        return self.current_size * self.T
 
     def get_transitions_stored(self):
         with self.lock:
             return self.n_transitions_stored
 
+    def flush(self):
+        """Writes the buffers to storage_dir so that they can be reopened later"""
+        if self.storage_dir is None:
+            return
+        for lock in self._shard_locks:
+            lock.acquire()
+        try:
+            state = {'current_size': self.current_size, 'shard_sizes': self._shard_sizes.tolist(),
+                     'n_transitions_stored': self.n_transitions_stored}
+            save_state(self.storage_dir, state, self.buffers.values())
+        finally:
+            for lock in self._shard_locks:
+                lock.release()
+
     def clear_buffer(self):
+        for shard, lock in enumerate(self._shard_locks):
+            with lock:
+                self._shard_sizes[shard] = 0
+
+    def _get_thread_shard(self):
+        thread_id = threading.get_ident()
         with self.lock:
-            self.current_size = 0
+            if thread_id not in self._thread_shards:
+                self._thread_shards[thread_id] = len(self._thread_shards) % self.num_shards
+            return self._thread_shards[thread_id]
 
-    def _get_storage_idx(self, inc=None):
+    def _shard_capacity(self, shard):
+        return self._shard_starts[shard + 1] - self._shard_starts[shard]
+
+    def _get_storage_idx(self, inc=None, shard=0):
         inc = inc or 1   # size increment
-        assert inc <= self.size, "Batch committed to replay is too large!"
+        size = self._shard_capacity(shard)
+        current_size = self._shard_sizes[shard]
+        assert inc <= size, "Batch committed to replay is too large!"
         # go consecutively until you hit the end, and then go randomly.
-        if self.current_size+inc <= self.size:
-            idx = np.arange(self.current_size, self.current_size+inc)
-        elif self.current_size < self.size:
-            overflow = inc - (self.size - self.current_size)
-            idx_a = np.arange(self.current_size, self.size)
-            idx_b = np.random.randint(0, self.current_size, overflow)
+        if current_size+inc <= size:
+            idx = np.arange(current_size, current_size+inc)
+        elif current_size < size:
+            overflow = inc - (size - current_size)
+            idx_a = np.arange(current_size, size)
+            idx_b = np.random.randint(0, current_size, overflow)
             idx = np.concatenate([idx_a, idx_b])
         else:
-            idx = np.random.randint(0, self.size, inc)
-
-        # update replay size
-        self.current_size = min(self.size, self.current_size+inc)
+            idx = np.random.randint(0, size, inc)
+        idx = idx + self._shard_starts[shard]
 
         if inc == 1:
             idx = idx[0]
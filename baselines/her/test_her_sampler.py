@@ -0,0 +1,69 @@
+import numpy as np
+
+from baselines.her.her_sampler import make_sample_her_transitions
+
+T = 6
+
+
+def _reward_fun(ag_2, g, info):
+    return -(np.abs(ag_2 - g).sum(axis=-1) > 0).astype(np.float32)
+
+
+def _episode_batch(num_episodes=10):
+    # o and ag encode (episode, step) so that the sampled steps can be recovered
+    steps = np.arange(num_episodes)[:, None] * 100 + np.arange(T + 1)[None, :]
+    episode_batch = {
+        'o': np.stack([steps, -steps], axis=-1).astype(np.float64),
+        'ag': steps[..., None].astype(np.float64),
+        'g': np.full((num_episodes, T, 1), -1.0),
+        'u': steps[:, :T, None].astype(np.float64),
+        'info_is_success': np.zeros((num_episodes, T, 1)),
+    }
+    episode_batch['o_2'] = episode_batch['o'][:, 1:, :]
+    episode_batch['ag_2'] = episode_batch['ag'][:, 1:, :]
+    return episode_batch
+
+
+def test_sample_matches_episodes():
+    episode_batch = _episode_batch()
+    sample = make_sample_her_transitions('none', 4, _reward_fun)
+    transitions = sample(episode_batch, 128)
+    steps = transitions['u'][:, 0]
+    np.testing.assert_array_equal(transitions['o'][:, 0], steps)
+    np.testing.assert_array_equal(transitions['o_2'][:, 0], steps + 1)
+    np.testing.assert_array_equal(transitions['ag_2'][:, 0], steps + 1)
+    np.testing.assert_array_equal(transitions['g'], np.full((128, 1), -1.0))
+    np.testing.assert_array_equal(transitions['r'], -np.ones(128))
+
+
+def test_relabel_strategies():
+    episode_batch = _episode_batch()
+    for strategy in ['future', 'final', 'episode']:
+        sample = make_sample_her_transitions(strategy, 4, _reward_fun)
+        transitions = sample(episode_batch, 512)
+        steps = transitions['u'][:, 0]
+        goals = transitions['g'][:, 0]
+        her = goals >= 0
+        assert 0.6 < her.mean() < 0.95
+        # relabeled goals are achieved goals of the same episode
+        np.testing.assert_array_equal(goals[her] // 100, steps[her] // 100)
+        goal_t, t = goals[her] % 100, steps[her] % 100
+        if strategy == 'future':
+            assert np.all(goal_t > t) and np.all(goal_t <= T)
+        elif strategy == 'final':
+            assert np.all(goal_t == T)
+        else:
+            assert np.all(goal_t <= T) and goal_t.min() == 0
+        np.testing.assert_array_equal(transitions['r'], _reward_fun(transitions['ag_2'], transitions['g'], {}))
+
+
+def test_out_buffers_are_reused():
+    episode_batch = _episode_batch()
+    sample = make_sample_her_transitions('future', 4, _reward_fun)
+    out = {}
+    transitions = sample(episode_batch, 32, episode_idxs=np.full(32, 3), out=out)
+    arrays = {key: out[key] for key in episode_batch.keys()}
+    assert np.all(transitions['u'] // 100 == 3)
+    transitions = sample(episode_batch, 32, out=out)
+    for key in episode_batch.keys():
+        assert transitions[key] is arrays[key]
@@ -0,0 +1,55 @@
+import threading
+
+import numpy as np
+
+from baselines.her.her_sampler import make_sample_her_transitions
+from baselines.her.replay_buffer import ReplayBuffer
+
+T = 5
+BUFFER_SHAPES = {'o': (T + 1, 2), 'ag': (T + 1, 1), 'g': (T, 1), 'u': (T, 1)}
+
+
+def _reward_fun(ag_2, g, info):
+    return -(np.abs(ag_2 - g).sum(axis=-1) > 0).astype(np.float32)
+
+
+def _episodes(episode_id, batch_size=2):
+    # every entry of an episode holds its id, so torn reads are visible in the samples
+    return {key: np.full((batch_size,) + shape, float(episode_id)) for key, shape in BUFFER_SHAPES.items()}
+
+
+def test_sharded_sample():
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    buffer = ReplayBuffer(BUFFER_SHAPES, 20 * T, T, sample_transitions, num_shards=2)
+    buffer.store_episode(_episodes(1), shard=0)
+    buffer.store_episode(_episodes(2, batch_size=3), shard=1)
+    assert buffer.get_current_episode_size() == 5
+    assert buffer.get_transitions_stored() == 5 * T
+
+    transitions = buffer.sample(64)
+    assert transitions['o'].shape == transitions['o_2'].shape == (64, 2)
+    assert transitions['r'].shape == (64,)
+    assert set(np.unique(transitions['o'])) == {1.0, 2.0}
+    np.testing.assert_array_equal(transitions['r'], np.zeros(64))
+
+
+def test_concurrent_store_and_sample():
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    buffer = ReplayBuffer(BUFFER_SHAPES, 8 * T, T, sample_transitions, num_shards=2)
+    buffer.store_episode(_episodes(0), shard=0)
+
+    def store(offset):
+        for i in range(300):
+            buffer.store_episode(_episodes(2 * i + offset))
+
+    threads = [threading.Thread(target=store, args=(offset,)) for offset in range(2)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        transitions = buffer.sample(32)
+        for key in ('u', 'o_2', 'ag_2', 'g'):
+            np.testing.assert_array_equal(transitions[key][:, 0], transitions['o'][:, 0])
+    for thread in threads:
+        thread.join()
+    assert buffer.full
+    assert buffer.get_transitions_stored() == (1 + 600) * 2 * T
@@ -6,6 +6,9 @@ import json
 import time
 import datetime
 import tempfile
+import atexit
+import queue
+import threading
 from collections import defaultdict
 from contextlib import contextmanager
 
@@ -101,29 +104,34 @@ class JSONOutputFormat(KVWriter):
         self.file.close()
 
 class CSVOutputFormat(KVWriter):
-    def __init__(self, filename):
-        self.file = open(filename, 'w+t')
+    """
+    Appends the key/values to a csv file, and never rewrites it: when new keys show up, the
+    file is closed and the next rows go to a new segment, filename with the segment number
+    before the extension (progress.1.csv, progress.2.csv, ...), whose header lists all the keys
+    so far. read_csv merges the segments back. Rows are flushed at most every flush_secs seconds.
+    """
+    def __init__(self, filename, flush_secs=10.):
+        self.filename = filename
+        self.file = open(filename, 'wt')
+        # segments of a previous log
+        for fname in csv_segments(filename)[1:]:
+            os.remove(fname)
+        self.nsegments = 1
         self.keys = []
         self.sep = ','
+        self.flush_secs = flush_secs
+        self.tlastflush = time.time()
 
     def writekvs(self, kvs):
-        # Add our current row to the history
         extra_keys = list(kvs.keys() - self.keys)
         extra_keys.sort()
         if extra_keys:
+            if self.keys:
+                self.file.close()
+                self.file = open(csv_segment(self.filename, self.nsegments), 'wt')
+                self.nsegments += 1
             self.keys.extend(extra_keys)
-            self.file.seek(0)
-            lines = self.file.readlines()
-            self.file.seek(0)
-            for (i, k) in enumerate(self.keys):
-                if i > 0:
-                    self.file.write(',')
-                self.file.write(k)
-            self.file.write('\n')
-            for line in lines[1:]:
-                self.file.write(line[:-1])
-                self.file.write(self.sep * len(extra_keys))
-                self.file.write('\n')
+            self.file.write(self.sep.join(self.keys) + '\n')
         for (i, k) in enumerate(self.keys):
             if i > 0:
                 self.file.write(',')
@@ -131,17 +139,38 @@ class CSVOutputFormat(KVWriter):
             if v is not None:
                 self.file.write(str(v))
         self.file.write('\n')
-        self.file.flush()
+        if time.time() - self.tlastflush >= self.flush_secs:
+            self.file.flush()
+            self.tlastflush = time.time()
 
     def close(self):
         self.file.close()
 
 
+def csv_segment(filename, i):
+    """
+    Name of the i-th segment of the csv file filename written by CSVOutputFormat.
+    """
+    if i == 0:
+        return filename
+    root, ext = osp.splitext(filename)
+    return '%s.%i%s' % (root, i, ext)
+
+def csv_segments(filename):
+    """
+    Names of the existing segments of the csv file filename, in order.
+    """
+    segments = []
+    while osp.exists(csv_segment(filename, len(segments))):
+        segments.append(csv_segment(filename, len(segments)))
+    return segments
+
+
 class TensorBoardOutputFormat(KVWriter):
     """
-    Dumps key/value pairs into TensorBoard's numeric format.
+    Dumps key/value pairs into TensorBoard's numeric format, flushed at most every flush_secs seconds.
     """
-    def __init__(self, dir):
+    def __init__(self, dir, flush_secs=10.):
         os.makedirs(dir, exist_ok=True)
         self.dir = dir
         self.step = 1
@@ -155,6 +184,8 @@ class TensorBoardOutputFormat(KVWriter):
         self.event_pb2 = event_pb2
         self.pywrap_tensorflow = pywrap_tensorflow
         self.writer = pywrap_tensorflow.EventsWriter(compat.as_bytes(path))
+        self.flush_secs = flush_secs
+        self.tlastflush = time.time()
 
     def writekvs(self, kvs):
         def summary_val(k, v):
@@ -164,7 +195,9 @@ class TensorBoardOutputFormat(KVWriter):
         event = self.event_pb2.Event(wall_time=time.time(), summary=summary)
         event.step = self.step # is there any reason why you'd want to specify the step?
         self.writer.WriteEvent(event)
-        self.writer.Flush()
+        if time.time() - self.tlastflush >= self.flush_secs:
+            self.writer.Flush()
+            self.tlastflush = time.time()
         self.step += 1
 
     def close(self):
@@ -172,6 +205,74 @@ class TensorBoardOutputFormat(KVWriter):
             self.writer.Close()
             self.writer = None
 
+class AsyncOutputFormat(KVWriter, SeqWriter):
+    """
+    Hands the key/values and the log messages over to a thread that writes them to
+    output_formats, so that dumpkvs() and log() do not wait for the formatting and the I/O.
+    At most max_queue snapshots of key/values wait to be written; when the queue is full,
+    policy='block' waits for the thread to catch up and policy='drop' drops the snapshot
+    (the number of dropped snapshots is logged on close). Log messages are never dropped.
+    The writer is closed at exit if it is still open then.
+    """
+    def __init__(self, output_formats, max_queue=100, policy='block'):
+        assert policy in ('block', 'drop'), policy
+        self.output_formats = output_formats
+        self.policy = policy
+        self.queue = queue.Queue(max_queue)
+        self.ndropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='logger', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def writekvs(self, kvs):
+        self._check()
+        item = ('kvs', dict(kvs))
+        if self.policy == 'block':
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.ndropped += 1
+
+    def writeseq(self, seq):
+        self._check()
+        self.queue.put(('seq', list(seq)))
+
+    def close(self):
+        if self.thread is None:
+            return
+        atexit.unregister(self.close)
+        if self.ndropped > 0:
+            self.queue.put(('seq', ['Logger dropped %i snapshots of key/values' % self.ndropped]))
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        for fmt in self.output_formats:
+            fmt.close()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            kind, data = item
+            try:
+                for fmt in self.output_formats:
+                    if kind == 'kvs' and isinstance(fmt, KVWriter):
+                        fmt.writekvs(data)
+                    elif kind == 'seq' and isinstance(fmt, SeqWriter):
+                        fmt.writeseq(data)
+            except Exception as e:
+                self.error = e
+
 def make_output_format(format, ev_dir, log_suffix=''):
     os.makedirs(ev_dir, exist_ok=True)
     if format == 'stdout':
@@ -260,6 +361,18 @@ def get_dir():
 record_tabular = logkv
 dump_tabular = dumpkvs
 
+_dump_hooks = []
+
+def add_dump_hook(fn):
+    """
+    Call fn() after every dumpkvs(), eg. to act once every logging interval of the training loop.
+    """
+    _dump_hooks.append(fn)
+
+def remove_dump_hook(fn):
+    if fn in _dump_hooks:
+        _dump_hooks.remove(fn)
+
 @contextmanager
 def profile_kv(scopename):
     logkey = 'wait_' + scopename
@@ -267,7 +380,33 @@ def profile_kv(scopename):
     try:
         yield
     finally:
-        get_current().name2val[logkey] += time.time() - tstart
+        elapsed = time.time() - tstart
+        current = get_current()
+        current.name2val[logkey] += elapsed
+        if current.timers:
+            current.timings[scopename].append(elapsed)
+
+class _NoTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_NO_TIMER = _NoTimer()
+
+def timer(scopename):
+    """
+    Usage:
+    with timer("env_step"): code
+
+    Time the phase scopename of the training loop, if the timers are enabled (see configure):
+    like profile_kv, and the next dumpkvs() also writes the mean, median, 90th and 99th
+    percentiles of the durations of the phase. Does nothing otherwise.
+    """
+    if not get_current().timers:
+        return _NO_TIMER
+    return profile_kv(scopename)
 
 def profile(n):
     """
@@ -299,9 +438,11 @@ class Logger(object):
                     # So that you can still log to the terminal without setting up any output files
     CURRENT = None  # Current logger being used by the free functions above
 
-    def __init__(self, dir, output_formats, comm=None):
+    def __init__(self, dir, output_formats, comm=None, timers=False):
         self.name2val = defaultdict(float)  # values this iteration
         self.name2cnt = defaultdict(int)
+        self.timers = timers
+        self.timings = defaultdict(list)  # durations of the phases timed this iteration
         self.level = INFO
         self.dir = dir
         self.output_formats = output_formats
@@ -318,6 +459,7 @@ class Logger(object):
         self.name2cnt[key] = cnt + 1
 
     def dumpkvs(self):
+        self._dump_timings()
         if self.comm is None:
             d = self.name2val
         else:
@@ -333,6 +475,8 @@ class Logger(object):
                 fmt.writekvs(d)
         self.name2val.clear()
         self.name2cnt.clear()
+        for fn in list(_dump_hooks):
+            fn()
         return out
 
     def log(self, *args, level=INFO):
@@ -356,14 +500,28 @@ class Logger(object):
 
     # Misc
     # ----------------------------------------
+    def _dump_timings(self):
+        import numpy as np
+        for scopename, durations in self.timings.items():
+            logkey = 'wait_' + scopename
+            self.name2val[logkey + '_mean'] = np.mean(durations)
+            for q in (50, 90, 99):
+                self.name2val[logkey + '_p%i' % q] = np.percentile(durations, q)
+        self.timings.clear()
+
     def _do_log(self, args):
         for fmt in self.output_formats:
             if isinstance(fmt, SeqWriter):
                 fmt.writeseq(map(str, args))
 
-def configure(dir=None, format_strs=None, comm=None):
+def configure(dir=None, format_strs=None, comm=None, async_policy=None, async_queue=100, timers=None):
     """
     If comm is provided, average all numerical stats across that comm
+    If async_policy is 'block' or 'drop', the output is written by a background thread, with
+    up to async_queue snapshots of key/values waiting (see AsyncOutputFormat); it defaults
+    to the OPENAI_LOG_ASYNC environment variable. The thread is flushed on close and on exit.
+    If timers is True, the phases of the training loops are timed (see timer); it defaults to
+    the OPENAI_LOG_TIMERS environment variable.
     """
     if dir is None:
         dir = os.getenv('OPENAI_LOGDIR')
@@ -390,8 +548,15 @@ def configure(dir=None, format_strs=None, comm=None):
             format_strs = os.getenv('OPENAI_LOG_FORMAT_MPI', 'log').split(',')
     format_strs = filter(None, format_strs)
     output_formats = [make_output_format(f, dir, log_suffix) for f in format_strs]
+    if async_policy is None:
+        async_policy = os.getenv('OPENAI_LOG_ASYNC')
+    if async_policy and output_formats:
+        output_formats = [AsyncOutputFormat(output_formats, max_queue=async_queue, policy=async_policy)]
+
+    if timers is None:
+        timers = bool(os.getenv('OPENAI_LOG_TIMERS'))
 
-    Logger.CURRENT = Logger(dir=dir, output_formats=output_formats, comm=comm)
+    Logger.CURRENT = Logger(dir=dir, output_formats=output_formats, comm=comm, timers=timers)
     log('Logging to %s'%dir)
 
 def _configure_default_logger():
@@ -405,9 +570,10 @@ def reset():
         log('Reset logger')
 
 @contextmanager
-def scoped_configure(dir=None, format_strs=None, comm=None):
+def scoped_configure(dir=None, format_strs=None, comm=None, async_policy=None, async_queue=100, timers=None):
     prevlogger = Logger.CURRENT
-    configure(dir=dir, format_strs=format_strs, comm=comm)
+    configure(dir=dir, format_strs=format_strs, comm=comm, async_policy=async_policy, async_queue=async_queue,
+              timers=timers)
     try:
         yield
     finally:
@@ -458,8 +624,15 @@ def read_json(fname):
     return pandas.DataFrame(ds)
 
 def read_csv(fname):
+    """
+    Read a csv file written by CSVOutputFormat, merging its segments.
+    """
     import pandas
-    return pandas.read_csv(fname, index_col=None, comment='#')
+    dfs = [pandas.read_csv(segment, index_col=None, comment='#') for segment in csv_segments(fname)]
+    if len(dfs) <= 1:
+        return dfs[0] if dfs else pandas.read_csv(fname, index_col=None, comment='#')
+    # the last segment has all the keys
+    return pandas.concat(dfs, ignore_index=True, sort=False)[list(dfs[-1].columns)]
 
 def read_tb(path):
     """
@@ -3,13 +3,13 @@ import os
 import glob
 import functools
 import tensorflow as tf
-import pandas as pd
 
 from baselines import logger
 
 from baselines.common import set_global_seeds, explained_variance
 from baselines.common import tf_util
 from baselines.common.policies import build_policy
+from baselines.common.episode_log import EpisodeLog
 
 
 from baselines.meta_a2c.utils import Scheduler, find_trainable_variables
@@ -35,7 +35,7 @@ class Model(object):
     def __init__(self, policy, env, nsteps,
             ent_coef=0.01, vf_coef=0.5, max_grad_norm=0.5, lr=7e-4,
             alpha=0.99, epsilon=1e-5, total_timesteps=int(80e6), lrschedule='linear',
-            exp_timesteps=int(80e6), lrschedule_offset=0):
+            exp_timesteps=int(80e6), lrschedule_offset=0, pipelined=False):
 
         sess = tf_util.get_session()
         nenvs = env.num_envs
@@ -43,8 +43,8 @@ class Model(object):
 
 
         with tf.variable_scope('meta-a2c_model', reuse=tf.AUTO_REUSE):
-            # step_model is used for sampling
-            step_model = policy(nenvs, 1, sess)
+            # step_model is used for sampling (one half of the envs at a time when pipelined)
+            step_model = policy(nenvs // 2 if pipelined else nenvs, 1, sess)
 
             # train_model is used to train our network
             train_model = policy(nbatch, nsteps, sess)
@@ -149,6 +149,8 @@ def learn(
     n_tasks=5,  # For deep meta-rl: learning to reinforcement learn
     exp_timesteps=None,
     lrschedule_offset=0,
+    async_envs=False,
+    pipelined=False,
     # tmp_save_path=None,
     **network_kwargs):
 
@@ -194,6 +196,13 @@ def learn(
 
     log_interval:       int, specifies how frequently the logs are printed out (default: 100)
 
+    async_envs:         bool, step every env as soon as its previous step finished instead of waiting for the slowest env
+                        of the batch, which helps when step times vary a lot (eg. NASGym). Needs an env with
+                        step_async(actions, env_ids) and poll(), such as SubprocVecEnv or ShmemVecEnv (default: False)
+
+    pipelined:          bool, split the envs in two halves and compute the actions of one half while the other half is simulated.
+                        Needs an even number of envs and an env with step_async(actions, env_ids) and poll() (default: False)
+
     **network_kwargs:   keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                         For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
 
@@ -232,7 +241,8 @@ def learn(
         total_timesteps=total_timesteps,
         lrschedule=lrschedule,
         exp_timesteps=exp_timesteps,
-        lrschedule_offset=lrschedule_offset
+        lrschedule_offset=lrschedule_offset,
+        pipelined=pipelined
     )
 
     if load_path is not None:
@@ -262,14 +272,18 @@ def learn(
     )
     os.makedirs(models_save_dir, exist_ok=True)
 
-    # Initialize the episde_df
-    episode_df = None
+    episode_log = EpisodeLog("{dir}/{name}.csv".format(
+        dir=episode_log_dir,
+        name="episodes_results"
+    ))
+    # Steps memoized by StepCache (--step_cache) and steps that were run
+    step_cache_hits, step_cache_misses = 0, 0
     for task_i in range(1, n_tasks + 1):
         tstart = time.time()
         
         # Instantiate the runner object inside the for-loop, so we start from
         # the beginning.
-        runner = Runner(env, model, nsteps=nsteps, gamma=gamma)
+        runner = Runner(env, model, nsteps=nsteps, gamma=gamma, async_envs=async_envs, pipelined=pipelined)
         logger.log("Starting task", task_i)
         prev_actions = np.zeros(nbatch, dtype=np.int)
         prev_rewards = np.zeros(nbatch, dtype=np.int)
@@ -277,7 +291,8 @@ def learn(
         # for update in range(1, 3):
         for update in range(1, total_timesteps//nbatch + 1):
             # Get mini batch of experiences
-            obs, states, rewards, masks, actions, values, timesteps, info_dicts = runner.run()
+            with logger.timer('rollout'):
+                obs, states, rewards, masks, actions, values, timesteps, info_dicts = runner.run()
 
             # Build the prev actions
             p_actions = np.append(prev_actions[-nenvs:], actions[:-nenvs])
@@ -288,16 +303,14 @@ def learn(
             p_rewards = p_rewards.reshape((nbatch, 1))
             prev_rewards = rewards
 
-            policy_loss, value_loss, policy_entropy = model.train(obs, states, rewards, masks, actions, values, p_rewards, p_actions, timesteps)
+            with logger.timer('train'):
+                policy_loss, value_loss, policy_entropy = model.train(obs, states, rewards, masks, actions, values, p_rewards, p_actions, timesteps)
             nseconds = time.time() - tstart
 
-            if episode_df is None:
-                headers = info_dicts[0].keys()
-                episode_df = pd.DataFrame(columns=headers)
-
-            episode_df = episode_df.append(
-                info_dicts, ignore_index=True
-            )
+            episode_log.append(info_dicts)
+            cache_hits = [info['step_cache_hit'] for info in info_dicts if 'step_cache_hit' in info]
+            step_cache_hits += sum(cache_hits)
+            step_cache_misses += len(cache_hits) - sum(cache_hits)
 
             # Calculate the fps (frame per second)
             fps = int((update*nbatch)/nseconds)
@@ -314,35 +327,23 @@ def learn(
                 logger.record_tabular("value_loss", float(value_loss))
                 logger.record_tabular("policy_loss", float(policy_loss))
                 logger.record_tabular("explained_variance", float(ev))
-                logger.dump_tabular()
+                if step_cache_hits + step_cache_misses > 0:
+                    logger.record_tabular("step_cache_hits", step_cache_hits)
+                    logger.record_tabular("step_cache_misses", step_cache_misses)
+                with logger.timer('logging'):
+                    logger.dump_tabular()
 
                 # Save trial log
-                episode_log_path = "{dir}/{name}.csv".format(
-                    dir=episode_log_dir,
-                    name="episodes_results"
-                )
-
-                outfile = open(episode_log_path, 'w')
-                episode_df.to_csv(outfile)
-                outfile.close()
+                episode_log.flush()
 
                 # Save the db of experiments
                 logger.log("Saving database of experiments of the environment")
-                env.save_db_experiments()
-
-            # Save trial log
-            episode_log_path = "{dir}/{name}.csv".format(
-                dir=episode_log_dir,
-                name="episodes_results"
-            )
-
-            outfile = open(episode_log_path, 'w')
-            episode_df.to_csv(outfile)
-            outfile.close()
+                env.env_method('save_db_experiments')
 
         # Save the db of experiments
         logger.log("Saving databse of experiments of the environment")
-        env.save_db_experiments()
+        env.env_method('save_db_experiments')
 
+    episode_log.close()
     return model
 
@@ -1,6 +1,7 @@
 import numpy as np
 from baselines.meta_a2c.utils import discount_with_dones
 from baselines.common.runners import AbstractEnvRunner
+from baselines.common.vec_env.vec_env import check_partial_steps
 from baselines import logger
 
 class Runner(AbstractEnvRunner):
@@ -13,13 +14,21 @@ class Runner(AbstractEnvRunner):
     run():
     - Make a mini batch of experiences
     """
-    def __init__(self, env, model, nsteps=5, gamma=0.99):
-        super().__init__(env=env, model=model, nsteps=nsteps)
+    def __init__(self, env, model, nsteps=5, gamma=0.99, async_envs=False, pipelined=False):
+        super().__init__(env=env, model=model, nsteps=nsteps, pipelined=pipelined)
         self.gamma = gamma
         self.batch_action_shape = [x if x is not None else -1 for x in model.train_model.action.shape.as_list()]
         self.ob_dtype = model.train_model.X.dtype.as_numpy_dtype
+        # Step each env as soon as its previous step finished (see run_async)
+        self.async_envs = async_envs
+        if async_envs:
+            check_partial_steps(env)
 
     def run(self):
+        if self.pipelined:
+            return self.run_pipelined()
+        if self.async_envs:
+            return self.run_async()
         # We initialize the lists that will contain the mb of experiences
         mb_obs, mb_rewards, mb_actions, mb_values, mb_dones = [],[],[],[],[]
         mb_timesteps = []
@@ -29,14 +38,15 @@ class Runner(AbstractEnvRunner):
             # Given observations, take action and value (V(s))
             # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
             
-            actions, values, states, _ = self.model.step(
-                self.obs,
-                self.p_actions,
-                self.p_rewards,
-                self.timesteps,
-                S=self.states,
-                M=self.dones
-            )
+            with logger.timer('inference'):
+                actions, values, states, _ = self.model.step(
+                    self.obs,
+                    self.p_actions,
+                    self.p_rewards,
+                    self.timesteps,
+                    S=self.states,
+                    M=self.dones
+                )
 
             # Append the experiences
             mb_obs.append(np.copy(self.obs))
@@ -45,7 +55,8 @@ class Runner(AbstractEnvRunner):
             mb_dones.append(self.dones)
 
             # Take actions in env and look the results
-            obs, rewards, dones, info_dicts = self.env.step(actions)
+            with logger.timer('env_step'):
+                obs, rewards, dones, info_dicts = self.env.step(actions)
 
             mb_infodicts.extend(list(info_dicts))
             self.states = states
@@ -60,6 +71,133 @@ class Runner(AbstractEnvRunner):
 
         mb_dones.append(self.dones)
 
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_timesteps, mb_states, mb_infodicts)
+
+    def run_async(self):
+        """
+        Like run(), but every env is stepped again as soon as its previous step finished
+        (env.step_async(actions, env_ids) and env.poll()), which keeps the workers busy when
+        step times vary a lot, as with NASGym. Every env still contributes nsteps consecutive
+        transitions to the batch. Actions are computed for the whole batch and only used for
+        the ready envs, whose rows of the recurrent state, previous action, previous reward
+        and timestep are the only ones that advance. Info dicts are listed in the order in
+        which the steps finished.
+        """
+        nenv, nsteps = self.nenv, self.nsteps
+        mb_obs = np.zeros((nsteps,) + self.obs.shape, dtype=self.ob_dtype)
+        mb_rewards, mb_values = np.zeros((nsteps, nenv), dtype=np.float32), np.zeros((nsteps, nenv), dtype=np.float32)
+        mb_actions = np.zeros((nsteps, nenv), dtype=self.model.train_model.action.dtype.name)
+        mb_dones = np.zeros((nsteps + 1, nenv), dtype=np.bool)
+        mb_timesteps = np.zeros((nsteps, nenv, 1), dtype=np.int32)
+        mb_infodicts = []
+        mb_states = self.states
+        if self.states is not None:
+            self.states = np.copy(self.states)
+        self.dones = np.array(self.dones, dtype=np.bool)
+        self.p_actions = np.array(self.p_actions).reshape(nenv)
+        self.p_rewards = np.array(self.p_rewards, dtype=np.float64).reshape((nenv, 1))
+        counts = np.zeros(nenv, dtype=np.int64)
+
+        def dispatch(env_ids):
+            with logger.timer('inference'):
+                actions, values, states, _ = self.model.step(
+                    self.obs,
+                    self.p_actions,
+                    self.p_rewards,
+                    self.timesteps,
+                    S=self.states,
+                    M=self.dones
+                )
+            t = counts[env_ids]
+            mb_obs[t, env_ids] = self.obs[env_ids]
+            mb_actions[t, env_ids] = actions[env_ids]
+            mb_values[t, env_ids] = values[env_ids]
+            mb_dones[t, env_ids] = self.dones[env_ids]
+            if states is not None:
+                self.states[env_ids] = states[env_ids]
+            self.p_actions[env_ids] = actions[env_ids]
+            self.env.step_async(actions[env_ids], env_ids)
+
+        dispatch(np.arange(nenv))
+        while counts.sum() < nenv * nsteps:
+            with logger.timer('env_step'):
+                env_ids, obs, rewards, dones, info_dicts = self.env.poll()
+            if len(env_ids) == 0:
+                continue
+            t = counts[env_ids]
+            mb_infodicts.extend(list(info_dicts))
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+            self.p_rewards[env_ids, 0] = rewards
+            self.timesteps[env_ids] = np.logical_not(dones).reshape((-1, 1)) * (self.timesteps[env_ids] + 1)
+            mb_timesteps[t, env_ids] = self.timesteps[env_ids]
+            mb_rewards[t, env_ids] = rewards
+            counts[env_ids] += 1
+            env_ids = env_ids[counts[env_ids] < nsteps]
+            if len(env_ids) > 0:
+                dispatch(env_ids)
+        mb_dones[nsteps] = self.dones
+
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_timesteps, mb_states, mb_infodicts)
+
+    def run_pipelined(self):
+        """
+        Like run(), but the envs are split in two halves that are stepped in turn: while one
+        half simulates (env.step_async(actions, env_ids)), the policy computes the actions of
+        the other one, so inference and simulation overlap. Info dicts are listed in the order
+        in which the steps finished.
+        """
+        nenv, nsteps = self.nenv, self.nsteps
+        mb_obs = np.zeros((nsteps,) + self.obs.shape, dtype=self.ob_dtype)
+        mb_rewards, mb_values = np.zeros((nsteps, nenv), dtype=np.float32), np.zeros((nsteps, nenv), dtype=np.float32)
+        mb_actions = np.zeros((nsteps, nenv), dtype=self.model.train_model.action.dtype.name)
+        mb_dones = np.zeros((nsteps + 1, nenv), dtype=np.bool)
+        mb_timesteps = np.zeros((nsteps, nenv, 1), dtype=np.int32)
+        mb_infodicts = []
+        mb_states = self.pipelined_states()
+        self.dones = np.array(self.dones, dtype=np.bool)
+        self.p_actions = np.array(self.p_actions).reshape(nenv)
+        self.p_rewards = np.array(self.p_rewards, dtype=np.float64).reshape((nenv, 1))
+
+        def act(g, env_ids, t):
+            actions, values, self.group_states[g], _ = self.model.step(
+                self.obs[env_ids],
+                self.p_actions[env_ids],
+                self.p_rewards[env_ids],
+                self.timesteps[env_ids],
+                S=self.group_states[g],
+                M=self.dones[env_ids]
+            )
+            mb_obs[t, env_ids] = self.obs[env_ids]
+            mb_actions[t, env_ids] = actions
+            mb_values[t, env_ids] = values
+            mb_dones[t, env_ids] = self.dones[env_ids]
+            self.p_actions[env_ids] = actions
+            return actions
+
+        def observe(env_ids, t, obs, rewards, dones, info_dicts):
+            mb_infodicts.extend(list(info_dicts))
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+            self.p_rewards[env_ids, 0] = rewards
+            self.timesteps[env_ids] = np.logical_not(dones).reshape((-1, 1)) * (self.timesteps[env_ids] + 1)
+            mb_timesteps[t, env_ids] = self.timesteps[env_ids]
+            mb_rewards[t, env_ids] = rewards
+
+        self.step_groups(self.groups, act, observe)
+        mb_dones[nsteps] = self.dones
+
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_timesteps, mb_states, mb_infodicts)
+
+    def _last_values(self):
+        if not self.pipelined:
+            return self.model.value(self.obs, self.p_actions, self.p_rewards, self.timesteps, S=self.states, M=self.dones)
+        return np.concatenate([
+            self.model.value(self.obs[env_ids], self.p_actions[env_ids], self.p_rewards[env_ids],
+                             self.timesteps[env_ids], S=states, M=self.dones[env_ids])
+            for env_ids, states in zip(self.groups, self.group_states)])
+
+    def _finish(self, mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_timesteps, mb_states, mb_infodicts):
         # Batch of steps to batch of rollouts
         mb_timesteps = np.asarray(mb_timesteps, dtype=np.int32).swapaxes(1, 0)
 
@@ -73,7 +211,7 @@ class Runner(AbstractEnvRunner):
 
         if self.gamma > 0.0:
             # Discount/bootstrap off value fn
-            last_values = self.model.value(self.obs, self.p_actions, self.p_rewards, self.timesteps, S=self.states, M=self.dones).tolist()
+            last_values = self._last_values().tolist()
             for n, (rewards, dones, value) in enumerate(zip(mb_rewards, mb_dones, last_values)):
                 rewards = rewards.tolist()
                 dones = dones.tolist()
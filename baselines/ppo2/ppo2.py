@@ -6,6 +6,7 @@ from baselines import logger
 from collections import deque
 from baselines.common import explained_variance, set_global_seeds
 from baselines.common.policies import build_policy
+from baselines.common.vec_env.vec_normalize import find_vec_normalize
 try:
     from mpi4py import MPI
 except ImportError:
@@ -21,7 +22,7 @@ def constfn(val):
 def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2048, ent_coef=0.0, lr=3e-4,
             vf_coef=0.5,  max_grad_norm=0.5, gamma=0.99, lam=0.95,
             log_interval=10, nminibatches=4, noptepochs=4, cliprange=0.2,
-            save_interval=0, load_path=None, model_fn=None, **network_kwargs):
+            save_interval=0, load_path=None, model_fn=None, async_envs=False, pipelined=False, **network_kwargs):
     '''
     Learn policy using PPO algorithm (https://arxiv.org/abs/1707.06347)
 
@@ -68,7 +69,15 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
 
     save_interval: int                number of timesteps between saving events
 
-    load_path: str                    path to load the model from
+    load_path: str                    path to load the model from. The statistics of a VecNormalize env are loaded as well if
+                                      they were saved next to the model (load_path + '.vecnormalize')
+
+    async_envs: bool                  step every env as soon as its previous step finished instead of waiting for the slowest env
+                                      of the batch. Needs an env with step_async(actions, env_ids) and poll(): DummyVecEnv, SubprocVecEnv or ShmemVecEnv,
+                                      wrapped only in wrappers that implement poll (eg. VecFrameStack, VecNormalize, VecMonitor).
+
+    pipelined: bool                   split the envs in two halves and compute the actions of one half while the other half is simulated.
+                                      Needs an even number of envs and an env with step_async(actions, env_ids) and poll().
 
     **network_kwargs:                 keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                                       For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
@@ -103,16 +112,25 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
         from baselines.ppo2.model import Model
         model_fn = Model
 
-    model = model_fn(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs, nbatch_train=nbatch_train,
+    model = model_fn(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs // 2 if pipelined else nenvs, nbatch_train=nbatch_train,
                     nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
                     max_grad_norm=max_grad_norm)
 
+    vec_normalize = find_vec_normalize(env)
     if load_path is not None:
         model.load(load_path)
+        if vec_normalize is not None and osp.exists(load_path + '.vecnormalize'):
+            vec_normalize.load_stats(load_path + '.vecnormalize')
+    if eval_env is not None and vec_normalize is not None:
+        # evaluate with the statistics of the training env, without updating them
+        eval_normalize = find_vec_normalize(eval_env)
+        if eval_normalize is not None:
+            eval_normalize.ob_rms, eval_normalize.ret_rms = vec_normalize.ob_rms, vec_normalize.ret_rms
+            eval_normalize.training = False
     # Instantiate the runner object
-    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam, async_envs=async_envs, pipelined=pipelined)
     if eval_env is not None:
-        eval_runner = Runner(env = eval_env, model = model, nsteps = nsteps, gamma = gamma, lam= lam)
+        eval_runner = Runner(env = eval_env, model = model, nsteps = nsteps, gamma = gamma, lam= lam, async_envs=async_envs, pipelined=pipelined)
 
     epinfobuf = deque(maxlen=100)
     if eval_env is not None:
@@ -132,7 +150,8 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
         # Calculate the cliprange
         cliprangenow = cliprange(frac)
         # Get minibatch
-        obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
+        with logger.timer('rollout'):
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
         if eval_env is not None:
             eval_obs, eval_returns, eval_masks, eval_actions, eval_values, eval_neglogpacs, eval_states, eval_epinfos = eval_runner.run() #pylint: disable=E0632
 
@@ -154,7 +173,8 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
                     end = start + nbatch_train
                     mbinds = inds[start:end]
                     slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                    mblossvals.append(model.train(lrnow, cliprangenow, *slices))
+                    with logger.timer('train'):
+                        mblossvals.append(model.train(lrnow, cliprangenow, *slices))
         else: # recurrent version
             assert nenvs % nminibatches == 0
             envsperbatch = nenvs // nminibatches
@@ -168,7 +188,8 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
                     mbflatinds = flatinds[mbenvinds].ravel()
                     slices = (arr[mbflatinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
                     mbstates = states[mbenvinds]
-                    mblossvals.append(model.train(lrnow, cliprangenow, *slices, mbstates))
+                    with logger.timer('train'):
+                        mblossvals.append(model.train(lrnow, cliprangenow, *slices, mbstates))
 
         # Feedforward --> get losses --> update
         lossvals = np.mean(mblossvals, axis=0)
@@ -194,13 +215,16 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
             for (lossval, lossname) in zip(lossvals, model.loss_names):
                 logger.logkv(lossname, lossval)
             if MPI is None or MPI.COMM_WORLD.Get_rank() == 0:
-                logger.dumpkvs()
+                with logger.timer('logging'):
+                    logger.dumpkvs()
         if save_interval and (update % save_interval == 0 or update == 1) and logger.get_dir() and (MPI is None or MPI.COMM_WORLD.Get_rank() == 0):
             checkdir = osp.join(logger.get_dir(), 'checkpoints')
             os.makedirs(checkdir, exist_ok=True)
             savepath = osp.join(checkdir, '%.5i'%update)
             print('Saving to', savepath)
             model.save(savepath)
+            if vec_normalize is not None:
+                vec_normalize.save_stats(savepath + '.vecnormalize')
     return model
 # Avoid division error when calculate the mean (in our case if epinfo is empty returns np.nan, not return an error)
 def safemean(xs):
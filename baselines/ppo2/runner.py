@@ -1,5 +1,7 @@
 import numpy as np
 from baselines.common.runners import AbstractEnvRunner
+from baselines.common.vec_env.vec_env import check_partial_steps
+from baselines import logger
 
 class Runner(AbstractEnvRunner):
     """
@@ -10,14 +12,22 @@ class Runner(AbstractEnvRunner):
     run():
     - Make a mini batch
     """
-    def __init__(self, *, env, model, nsteps, gamma, lam):
-        super().__init__(env=env, model=model, nsteps=nsteps)
+    def __init__(self, *, env, model, nsteps, gamma, lam, async_envs=False, pipelined=False):
+        super().__init__(env=env, model=model, nsteps=nsteps, pipelined=pipelined)
         # Lambda used in GAE (General Advantage Estimation)
         self.lam = lam
         # Discount rate
         self.gamma = gamma
+        # Step each env as soon as its previous step finished (see run_async)
+        self.async_envs = async_envs
+        if async_envs:
+            check_partial_steps(env)
 
     def run(self):
+        if self.pipelined:
+            return self.run_pipelined()
+        if self.async_envs:
+            return self.run_async()
         # Here, we init the lists that will contain the mb of experiences
         mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs = [],[],[],[],[],[]
         mb_states = self.states
@@ -26,7 +36,8 @@ class Runner(AbstractEnvRunner):
         for _ in range(self.nsteps):
             # Given observations, get action value and neglopacs
             # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
-            actions, values, self.states, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
+            with logger.timer('inference'):
+                actions, values, self.states, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
             mb_obs.append(self.obs.copy())
             mb_actions.append(actions)
             mb_values.append(values)
@@ -35,7 +46,8 @@ class Runner(AbstractEnvRunner):
 
             # Take actions in env and look the results
             # Infos contains a ton of useful informations
-            self.obs[:], rewards, self.dones, infos = self.env.step(actions)
+            with logger.timer('env_step'):
+                self.obs[:], rewards, self.dones, infos = self.env.step(actions)
             for info in infos:
                 maybeepinfo = info.get('episode')
                 if maybeepinfo: epinfos.append(maybeepinfo)
@@ -47,7 +59,109 @@ class Runner(AbstractEnvRunner):
         mb_values = np.asarray(mb_values, dtype=np.float32)
         mb_neglogpacs = np.asarray(mb_neglogpacs, dtype=np.float32)
         mb_dones = np.asarray(mb_dones, dtype=np.bool)
-        last_values = self.model.value(self.obs, S=self.states, M=self.dones)
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_neglogpacs, mb_dones, mb_states, epinfos)
+
+    def run_async(self):
+        """
+        Like run(), but every env is stepped again as soon as its previous step finished
+        (env.step_async(actions, env_ids) and env.poll()), so that slow envs do not stall the
+        others. Every env still contributes nsteps consecutive transitions to the batch.
+        Actions are computed for the whole batch and only used for the ready envs, whose rows
+        of the recurrent state are the only ones that advance.
+        """
+        nenv, nsteps = self.nenv, self.nsteps
+        mb_obs = np.zeros((nsteps,) + self.obs.shape, dtype=self.obs.dtype)
+        mb_rewards, mb_values, mb_neglogpacs = [np.zeros((nsteps, nenv), dtype=np.float32) for _ in range(3)]
+        mb_dones = np.zeros((nsteps, nenv), dtype=np.bool)
+        mb_actions = None
+        mb_states = self.states
+        if self.states is not None:
+            self.states = np.copy(self.states)
+        self.dones = np.array(self.dones, dtype=np.bool)
+        epinfos = []
+        counts = np.zeros(nenv, dtype=np.int64)
+
+        def dispatch(env_ids):
+            nonlocal mb_actions
+            with logger.timer('inference'):
+                actions, values, states, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
+            if mb_actions is None:
+                mb_actions = np.zeros((nsteps,) + actions.shape, dtype=actions.dtype)
+            t = counts[env_ids]
+            mb_obs[t, env_ids] = self.obs[env_ids]
+            mb_actions[t, env_ids] = actions[env_ids]
+            mb_values[t, env_ids] = values[env_ids]
+            mb_neglogpacs[t, env_ids] = neglogpacs[env_ids]
+            mb_dones[t, env_ids] = self.dones[env_ids]
+            if states is not None:
+                self.states[env_ids] = states[env_ids]
+            self.env.step_async(actions[env_ids], env_ids)
+
+        dispatch(np.arange(nenv))
+        while counts.sum() < nenv * nsteps:
+            with logger.timer('env_step'):
+                env_ids, obs, rewards, dones, infos = self.env.poll()
+            if len(env_ids) == 0:
+                continue
+            mb_rewards[counts[env_ids], env_ids] = rewards
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+            counts[env_ids] += 1
+            env_ids = env_ids[counts[env_ids] < nsteps]
+            if len(env_ids) > 0:
+                dispatch(env_ids)
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_neglogpacs, mb_dones, mb_states, epinfos)
+
+    def run_pipelined(self):
+        """
+        Like run(), but the envs are split in two halves that are stepped in turn: while one
+        half simulates (env.step_async(actions, env_ids)), the policy computes the actions of
+        the other one, so inference and simulation overlap.
+        """
+        nenv, nsteps = self.nenv, self.nsteps
+        mb_obs = np.zeros((nsteps,) + self.obs.shape, dtype=self.obs.dtype)
+        mb_rewards, mb_values, mb_neglogpacs = [np.zeros((nsteps, nenv), dtype=np.float32) for _ in range(3)]
+        mb_dones = np.zeros((nsteps, nenv), dtype=np.bool)
+        mb_actions = None
+        mb_states = self.pipelined_states()
+        self.dones = np.array(self.dones, dtype=np.bool)
+        epinfos = []
+
+        def act(g, env_ids, t):
+            nonlocal mb_actions
+            actions, values, self.group_states[g], neglogpacs = self.model.step(
+                self.obs[env_ids], S=self.group_states[g], M=self.dones[env_ids])
+            if mb_actions is None:
+                mb_actions = np.zeros((nsteps, nenv) + actions.shape[1:], dtype=actions.dtype)
+            mb_obs[t, env_ids] = self.obs[env_ids]
+            mb_actions[t, env_ids] = actions
+            mb_values[t, env_ids] = values
+            mb_neglogpacs[t, env_ids] = neglogpacs
+            mb_dones[t, env_ids] = self.dones[env_ids]
+            return actions
+
+        def observe(env_ids, t, obs, rewards, dones, infos):
+            mb_rewards[t, env_ids] = rewards
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+
+        self.step_groups(self.groups, act, observe)
+        return self._finish(mb_obs, mb_rewards, mb_actions, mb_values, mb_neglogpacs, mb_dones, mb_states, epinfos)
+
+    def _last_values(self):
+        if not self.pipelined:
+            return self.model.value(self.obs, S=self.states, M=self.dones)
+        return np.concatenate([self.model.value(self.obs[env_ids], S=states, M=self.dones[env_ids])
+                               for env_ids, states in zip(self.groups, self.group_states)])
+
+    def _finish(self, mb_obs, mb_rewards, mb_actions, mb_values, mb_neglogpacs, mb_dones, mb_states, epinfos):
+        last_values = self._last_values()
 
         # discount/bootstrap off value fn
         mb_returns = np.zeros_like(mb_rewards)
@@ -12,11 +12,13 @@ except ImportError as ex:
 from collections import defaultdict
 import tensorflow as tf
 import numpy as np
-import pandas as pd
 from baselines.common.vec_env import VecFrameStack, VecNormalize, VecEnv
+from baselines.common.vec_env.vec_normalize import find_vec_normalize
 from baselines.common.vec_env.vec_video_recorder import VecVideoRecorder
 from baselines.common.cmd_util import common_arg_parser, parse_unknown_args, make_vec_env, make_env
 from baselines.common.tf_util import get_session
+from baselines.common.episode_log import EpisodeLog
+from baselines.common.profiler import sample_stacks, CProfileWindow
 from baselines import logger
 from importlib import import_module
 
@@ -105,7 +107,9 @@ def build_env(args):
             env = make_env(env_id, env_type, seed=seed)
         else:
             frame_stack_size = 4
-            env = make_vec_env(env_id, env_type, nenv, seed, gamestate=args.gamestate, reward_scale=args.reward_scale)
+            env = make_vec_env(env_id, env_type, nenv, seed, gamestate=args.gamestate, reward_scale=args.reward_scale,
+                               envs_per_worker=args.envs_per_worker, max_env_restarts=args.max_env_restarts,
+                               profile_rate=args.profile_rate if args.profile and args.profile_workers else None)
             env = VecFrameStack(env, frame_stack_size)
 
     else:
@@ -116,7 +120,11 @@ def build_env(args):
         get_session(config=config)
 
         flatten_dict_observations = alg not in {'her'}
-        env = make_vec_env(env_id, env_type, args.num_env or 1, seed, reward_scale=args.reward_scale, flatten_dict_observations=flatten_dict_observations)
+        env = make_vec_env(env_id, env_type, args.num_env or 1, seed, reward_scale=args.reward_scale, flatten_dict_observations=flatten_dict_observations,
+                           envs_per_worker=args.envs_per_worker, max_env_restarts=args.max_env_restarts,
+                           step_cache=args.step_cache, step_cache_size=args.step_cache_size,
+                           step_cache_set_state=args.step_cache_set_state,
+                           profile_rate=args.profile_rate if args.profile and args.profile_workers else None)
 
         if env_type == 'mujoco':
             env = VecNormalize(env)
@@ -214,14 +222,27 @@ def main(args):
         logger.configure(format_strs=[])
         rank = MPI.COMM_WORLD.Get_rank()
 
+    if args.profile:
+        suffix = '' if rank == 0 else '-rank%03i' % rank
+        sampler = sample_stacks(osp.join(logger.get_dir(), 'profile_stacks%s.txt' % suffix), args.profile_rate)
+        cprofile = CProfileWindow(osp.join(logger.get_dir(), 'profile%s.prof' % suffix), *args.profile_window)
+
     logger.log("Starting training")
     model, env = train(args, extra_args)
     logger.log("Training ended")
 
+    if args.profile:
+        cprofile.stop()
+        sampler.stop()
+        logger.log("Saved the profiles to", logger.get_dir())
+
     if args.save_path is not None and rank == 0:
         save_path = osp.expanduser(args.save_path)
         logger.log("Saving trained model to", save_path)
         model.save(save_path)
+        vec_normalize = find_vec_normalize(env)
+        if vec_normalize is not None:
+            vec_normalize.save_stats(save_path + '.vecnormalize')
 
     if args.play:
         # Make directory for episode logs
@@ -229,13 +250,15 @@ def main(args):
             dir=logger.get_dir()
         )
         os.makedirs(episode_log_dir, exist_ok=True)
-        episode_log_path = "{dir}/{name}.csv".format(
+        episode_log = EpisodeLog("{dir}/{name}.csv".format(
             dir=episode_log_dir,
             name="episode_results"
-        )
-        episode_df = None
+        ))
 
         logger.log("Running trained model")
+        vec_normalize = find_vec_normalize(env)
+        if vec_normalize is not None:
+            vec_normalize.training = False
         obs = env.reset()
 
         # Temporal change for meta-rl
@@ -271,14 +294,7 @@ def main(args):
 
             env.render()
 
-            if episode_df is None:
-                headers = info_dict[0].keys()
-                episode_df = pd.DataFrame(columns=headers)
-
-            # TODO: Check if this works
-            episode_df = episode_df.append(
-                info_dict, ignore_index=True
-            )
+            episode_log.append(info_dict)
 
             done = done.any() if isinstance(done, np.ndarray) else done
             if done:
@@ -292,12 +308,8 @@ def main(args):
                 if hasattr(env, 'save_db_experiments'):
                     logger.log("Saving database of experiments")
                     env.save_db_experiments()
-                if episode_df is not None:
-                    outfile = open(episode_log_path, 'w')
-                    logger.log("Saving episode logs")
-                    episode_df.to_csv(outfile)
-                    outfile.close()
-                    # episode_df = None
+                logger.log("Saving episode logs")
+                episode_log.flush()
 
             play_count += 1
 
@@ -305,12 +317,8 @@ def main(args):
         if hasattr(env, 'save_db_experiments'):
             logger.log("Saving database of experiments")
             env.save_db_experiments()
-        if episode_df is not None:
-            outfile = open(episode_log_path, 'w')
-            logger.log("Saving episode logs")
-            episode_df.to_csv(outfile)
-            outfile.close()
-            # episode_df = None
+        logger.log("Saving episode logs")
+        episode_log.close()
 
     env.close()
 